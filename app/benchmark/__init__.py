@@ -0,0 +1,9 @@
+"""Offline benchmark suite for the API and the data layer.
+
+Run from the app directory:
+
+    python -m benchmark --scale 100k --output results.json
+
+The database is seeded with synthetic persons and blesses, the FastAPI app is
+driven in-process and every result is emitted as JSON so runs can be diffed.
+"""
@@ -0,0 +1,256 @@
+import os
+import sys
+import json
+import random
+import time
+import argparse
+import subprocess
+import platform
+from datetime import datetime
+from loguru import logger
+from benchmark.seed import seed, SCALES
+from benchmark.timing import measure, summarize
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog="python -m benchmark", description="Blessed by the bot benchmark suite")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="1k", help="Number of synthetic persons to seed")
+    parser.add_argument("--persons", type=int, help="Explicit number of persons, overrides --scale")
+    parser.add_argument("--db", default="db/data.db", help="Database file to seed and benchmark")
+    parser.add_argument("--force", action="store_true", help="Delete an existing database before seeding")
+    parser.add_argument("--reuse", action="store_true", help="Benchmark an existing database without seeding")
+    parser.add_argument("--iterations", type=int, default=200, help="Timed iterations per benchmark")
+    parser.add_argument("--output", help="Write the JSON results to this file instead of stdout")
+    parser.add_argument("--only", help="Comma separated benchmark groups: routes,connector,search,dispatch,backup,startup")
+    return parser.parse_args()
+
+
+def prepare_database(args):
+    if os.path.exists(args.db) and not args.reuse:
+        if not args.force:
+            sys.exit(f"{args.db} already exists, pass --force to replace it or --reuse to benchmark it as is")
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(args.db + suffix):
+                os.remove(args.db + suffix)
+    os.makedirs(os.path.dirname(args.db) or ".", exist_ok=True)
+    # Must be set before the app modules are imported so every connector uses the benchmark database
+    os.environ["DB_PATH"] = args.db
+
+
+def route_benchmarks(client, db, ids, persons, iterations):
+    rng = random.Random(7)
+    counter = iter(range(10 ** 9))
+    language_ids, gender_ids = ids["languages"], ids["genders"]
+    max_person = max(persons, 1)
+    heavy = max(3, iterations // 20) if persons >= 100_000 else iterations
+    person = {"FirstName": "Bench", "LastName": "Mark", "BirthDate": "1990-05-17", "GenderId": gender_ids[0],
+              "LanguageId": language_ids[0], "PhoneNumber": "+972500000000", "PreferredHour": 9, "Intro": "Hi"}
+    bless = {"GenderId": gender_ids[0], "LanguageId": language_ids[0], "Bless": "Benchmark bless"}
+    configuration = {"WhatsappApiUrl": "http://127.0.0.1:3000", "WhatsappApiToken": "token", "WhatsappApiSessionName": "default"}
+
+    def new_language():
+        return (db.insert_language(f"bench-language-{next(counter)}"),)
+
+    def new_gender():
+        return (db.insert_gender(f"bench-gender-{next(counter)}"),)
+
+    def new_bless():
+        return (db.insert_bless(gender_ids[0], language_ids[0], "Benchmark bless"),)
+
+    def new_person():
+        return (db.insert_person("Bench", "Mark", "1990-05-17", gender_ids[0], language_ids[0], "+972500000000", 9, "Hi"),)
+
+    bulk_rows = [person] * 1000
+    return {
+        "GET /languages/": measure(lambda: client.get("/languages/"), iterations),
+        "GET /genders/": measure(lambda: client.get("/genders/"), iterations),
+        "GET /configuration/": measure(lambda: client.get("/configuration/"), iterations),
+        "GET /blesses/": measure(lambda: client.get("/blesses/"), iterations),
+        "GET /persons/?limit=100": measure(lambda: client.get("/persons/", params={"limit": 100, "after_id": rng.randint(0, max_person)}), iterations),
+        "GET /persons/?limit=100&gender_id&language_id": measure(lambda: client.get("/persons/", params={
+            "limit": 100, "gender_id": rng.choice(gender_ids), "language_id": rng.choice(language_ids)}), iterations),
+        "GET /persons/search?q=": measure(lambda: client.get("/persons/search", params={"q": rng.choice(["Da", "Cohen", "Noa Levi", "50123"])}), iterations),
+        "GET /blesses/search?q=": measure(lambda: client.get("/blesses/search", params={"q": "birthday"}), iterations),
+        "GET /forecast (1 year)": measure(lambda: client.get("/forecast", params={"start": "2027-01-01", "end": "2027-12-31"}), iterations),
+        "GET /stats?group_by=language,status": measure(lambda: client.get("/stats", params={"group_by": "language,status"}), iterations),
+        "GET /persons/": measure(lambda: client.get("/persons/"), heavy, warmup=1),
+        "GET /persons/?format=columns": measure(lambda: client.get("/persons/", params={"format": "columns"}), heavy, warmup=1),
+        "GET /persons/?stream=true": measure(lambda: client.get("/persons/", params={"stream": "true"}), heavy, warmup=1),
+        "POST /languages/": measure(lambda: client.post("/languages/", json={"Language": f"bench-post-{next(counter)}"}), iterations),
+        "POST /genders/": measure(lambda: client.post("/genders/", json={"Gender": f"bench-post-{next(counter)}"}), iterations),
+        "POST /blesses/": measure(lambda: client.post("/blesses/", json=bless), iterations),
+        "POST /configuration/": measure(lambda: client.post("/configuration/", json=configuration), iterations),
+        "POST /persons/bulk (1000 rows)": measure(lambda: client.post("/persons/bulk", json=bulk_rows), max(3, iterations // 20)),
+        "PATCH /persons/batch (1000 rows)": measure(lambda: client.patch("/persons/batch", json=[
+            {"PersonId": rng.randint(1, max_person), "PreferredHour": rng.randint(0, 23)} for _ in range(1000)]), max(3, iterations // 20)),
+        "PUT /languages/{id}": measure(lambda language_id: client.put(f"/languages/{language_id}", json={"Language": f"bench-put-{next(counter)}"}),
+                                       iterations, setup=new_language),
+        "PUT /genders/{id}": measure(lambda gender_id: client.put(f"/genders/{gender_id}", json={"Gender": f"bench-put-{next(counter)}"}),
+                                     iterations, setup=new_gender),
+        "PUT /blesses/{id}": measure(lambda: client.put(f"/blesses/{rng.randint(1, 100)}", json=bless), iterations),
+        "PUT /persons/{id}": measure(lambda: client.put(f"/persons/{rng.randint(1, max_person)}", json=person), iterations),
+        "PUT /configuration/": measure(lambda: client.put("/configuration/", json=configuration), iterations),
+        "DELETE /languages/{id}": measure(lambda language_id: client.delete(f"/languages/{language_id}"), iterations, setup=new_language),
+        "DELETE /genders/{id}": measure(lambda gender_id: client.delete(f"/genders/{gender_id}"), iterations, setup=new_gender),
+        "DELETE /blesses/{id}": measure(lambda bless_id: client.delete(f"/blesses/{bless_id}"), iterations, setup=new_bless),
+        "DELETE /persons/{id}": measure(lambda person_id: client.delete(f"/persons/{person_id}"), iterations, setup=new_person),
+    }
+
+
+def connector_benchmarks(db, ids, persons, iterations):
+    rng = random.Random(11)
+    max_person = max(persons, 1)
+    heavy = max(3, iterations // 20) if persons >= 100_000 else iterations
+    return {
+        "execute_query": measure(lambda: db.execute_query("UPDATE Configuration SET WhatsappApiSessionName = ? WHERE ConfigId = 1", ("default",)), iterations),
+        "select_all_languages": measure(lambda: db.select_all_languages(True), iterations),
+        "select_all_genders": measure(lambda: db.select_all_genders(True), iterations),
+        "get_configuration": measure(lambda: db.get_configuration(True), iterations),
+        "select_all_blesses": measure(lambda: db.select_all_blesses(True), iterations),
+        "select_all_persons": measure(lambda: db.select_all_persons(True), heavy, warmup=1),
+        "select_persons_page": measure(lambda: db.select_persons_page(rng.randint(0, max_person), 100, api_call=True), iterations),
+        "select_persons_by_ids (100)": measure(lambda: db.select_persons_by_ids(rng.sample(range(1, max_person + 1), min(100, max_person)), True),
+                                               iterations),
+        "insert_person": measure(lambda: db.insert_person("Bench", "Mark", "1990-05-17", ids["genders"][0], ids["languages"][0],
+                                                          "+972500000000", 9, "Hi"), iterations),
+        "update_person": measure(lambda: db.update_person(rng.randint(1, max_person), preferred_hour=rng.randint(0, 23)), iterations),
+        "delete_person": measure(lambda person_id: db.delete_person(person_id), iterations,
+                                 setup=lambda: (db.insert_person("Bench", "Mark", "1990-05-17", ids["genders"][0], ids["languages"][0],
+                                                                 "+972500000000", 9, "Hi"),)),
+    }
+
+
+def search_benchmarks(db, iterations):
+    # Every seeded person has the intro "Hi" and one of 10 first names: the worst case for prefix ranking
+    queries = {"2 letter prefix": "Da", "prefix of every person": "Hi", "last name": "Cohen", "full name": "Noa Levi",
+               "three words": "Dana Cohen Hi", "typing a last name": "Dana Co",
+               "no match": "Zz", "phone digits": "50123", "phone prefix of every person": "9725"}
+    return {f"search_persons ({name})": measure(lambda text=text: db.search_persons(text, 20, True), iterations)
+            for name, text in queries.items()}
+
+
+def dispatch_benchmarks(db, iterations):
+    import httpx
+    from dispatcher import Dispatcher
+    from whatsappsender import WhatsappSender, ShardedSender
+
+    rng = random.Random(13)
+    sender = WhatsappSender("http://whatsapp.invalid", "token", "default", rate_limit=10 ** 9,
+                            transport=httpx.MockTransport(lambda request: httpx.Response(201, json={})))
+
+    def dispatch(persons):
+        blesses = db.bless_index.choose_for_persons(persons, 2025)
+        messages = [(person["PhoneNumber"], blesses[person["PersonId"]][1]) for person in persons if person["PersonId"] in blesses]
+        return sender.send_batch_sync(messages)
+
+    dispatcher = Dispatcher(db, handler=dispatch)
+    max_person = db.fetch_all('SELECT coalesce(max(PersonId), 1) FROM Persons')[0][0]
+    # Persons sharing one birthday hour on average, at least a handful
+    batch_size = max(5, max_person // (365 * 24))
+
+    sharded_messages = [(f"+9725{index:08d}", "Happy birthday") for index in range(600)]
+    # One outbox batch worth of send attempts
+    delivery_rows = [(index, index + 1, "default", "sent", 1, None, time.time()) for index in range(200)]
+
+    def sharded_sender(count):
+        return ShardedSender({f"session-{index}": WhatsappSender(
+            f"http://whatsapp-{index}.invalid", "token", f"session-{index}", rate_limit=100,
+            transport=httpx.MockTransport(lambda request: httpx.Response(201, json={}))) for index in range(count)}, {})
+
+    def random_persons():
+        return (db.select_persons_by_ids(rng.sample(range(1, max_person + 1), min(batch_size, max_person)), True),)
+
+    def due_batch():
+        # One fire time's worth of persons, due a second ago
+        now = time.time()
+        for person_id in rng.sample(range(1, max_person + 1), min(batch_size, max_person)):
+            dispatcher.timers.schedule(person_id, now - 1)
+        return (now,)
+
+    load = measure(dispatcher.load, max(3, iterations // 20), warmup=1)
+    return {
+        "Dispatcher.load": load,
+        "choose_for_persons": measure(lambda persons: db.bless_index.choose_for_persons(persons, 2025), iterations, setup=random_persons),
+        # Pops the due timers, loads the persons, picks blesses, sends them and schedules next year
+        "Dispatcher.tick": measure(dispatcher.tick, max(3, iterations // 10), setup=due_batch),
+        "insert_deliveries (200 attempts, one flush)": measure(lambda: db.insert_deliveries(delivery_rows), max(3, iterations // 10)),
+        "insert_deliveries (200 attempts, one commit each)": measure(lambda: [db.insert_deliveries([row]) for row in delivery_rows],
+                                                                     max(3, iterations // 10)),
+        # 600 messages through sessions limited to 100/s each: send time should shrink with the number of sessions
+        **{f"send_batch_sharded ({count} sessions)": measure(lambda sharded: sharded.send_batch_sync(sharded_messages), 1, warmup=0,
+                                                             setup=lambda count=count: (sharded_sender(count),))
+           for count in (1, 2, 4)},
+    }
+
+
+def backup_benchmarks(client, iterations):
+    return {"GET /backup": measure(lambda: client.get("/backup"), max(3, iterations // 40), warmup=1)}
+
+
+def startup_benchmarks(iterations):
+    # Each sample imports the server in a fresh interpreter, like a container restart does
+    budget = float(os.getenv("IMPORT_TIME_BUDGET", 1.0))
+    app_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    samples = []
+    for _ in range(max(3, iterations // 40)):
+        output = subprocess.run([sys.executable, "-c", "import server; print(server.IMPORT_SECONDS)"], cwd=app_dir,
+                                capture_output=True, text=True, check=True).stdout
+        samples.append(float(output.split()[-1]))
+    return {"import server": {**summarize(samples), "budget_ms": budget * 1000, "within_budget": max(samples) <= budget}}
+
+
+def main():
+    args = parse_args()
+    persons = args.persons if args.persons is not None else SCALES[args.scale]
+    groups = set((args.only or "routes,connector,search,dispatch,backup,startup").split(","))
+    prepare_database(args)
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    from fastapi.testclient import TestClient
+    from server import Server
+
+    server = Server()
+    # The lifespan is not run by TestClient outside a with block, and it would also start the dispatcher
+    server.initialize()
+    db = server.db
+    if args.reuse:
+        ids = {"languages": [row[0] for row in db.select_all_languages()], "genders": [row[0] for row in db.select_all_genders()]}
+        persons = len(db.fetch_all("SELECT PersonId FROM Persons"))
+    else:
+        ids = seed(db, persons)
+    client = TestClient(server.app, raise_server_exceptions=False)
+
+    results = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "persons": persons,
+        "iterations": args.iterations,
+        "benchmarks": {},
+    }
+    if "routes" in groups:
+        results["benchmarks"]["routes"] = route_benchmarks(client, db, ids, persons, args.iterations)
+    if "connector" in groups:
+        results["benchmarks"]["connector"] = connector_benchmarks(db, ids, persons, args.iterations)
+    if "search" in groups:
+        results["benchmarks"]["search"] = search_benchmarks(db, args.iterations)
+    if "dispatch" in groups:
+        results["benchmarks"]["dispatch"] = dispatch_benchmarks(db, args.iterations)
+    if "backup" in groups:
+        results["benchmarks"]["backup"] = backup_benchmarks(client, args.iterations)
+    if "startup" in groups:
+        results["benchmarks"]["startup"] = startup_benchmarks(args.iterations)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+    if "startup" in groups and not results["benchmarks"]["startup"]["import server"]["within_budget"]:
+        sys.exit("Server imports are over IMPORT_TIME_BUDGET")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+import random
+from loguru import logger
+from migrations import analyze
+
+SCALES = {"1k": 1_000, "100k": 100_000, "1m": 1_000_000}
+LANGUAGES = ["Hebrew", "English", "Russian", "Arabic"]
+GENDERS = ["Male", "Female"]
+FIRST_NAMES = ["Noa", "Yossi", "Maya", "Avi", "Tamar", "David", "Shira", "Omer", "Dana", "Itay"]
+LAST_NAMES = ["Cohen", "Levi", "Mizrahi", "Peretz", "Biton", "Friedman", "Katz", "Azulay"]
+
+
+def seed(db, persons, blesses_per_bucket=20, random_seed=42, chunk_size=50_000):
+    """Fills an empty database with deterministic synthetic data."""
+    rng = random.Random(random_seed)
+    language_ids = [db.insert_language(language) for language in LANGUAGES]
+    gender_ids = [db.insert_gender(gender) for gender in GENDERS]
+    db.bulk_insert_blesses([(gender_id, language_id, f"Happy birthday! Wish #{index}")
+                            for gender_id in gender_ids for language_id in language_ids
+                            for index in range(blesses_per_bucket)])
+    db.insert_configurarion("http://127.0.0.1:3000", "benchmark-token", "default")
+    for start in range(0, persons, chunk_size):
+        db.bulk_insert_persons([(rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES),
+                                 f"{rng.randint(1940, 2015)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+                                 rng.choice(gender_ids), rng.choice(language_ids),
+                                 f"+9725{rng.randint(0, 99999999):08d}", rng.randint(0, 23), "Hi", None)
+                                for _ in range(min(chunk_size, persons - start))])
+    with db.pool.connection() as conn:
+        analyze(conn)
+    logger.info(f"Seeded {persons} persons")
+    return {"languages": language_ids, "genders": gender_ids}
@@ -0,0 +1,45 @@
+import time
+from collections import Counter
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(durations, statuses=None):
+    durations = sorted(durations)
+    total = sum(durations)
+    result = {
+        "iterations": len(durations),
+        "p50_ms": round(percentile(durations, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(durations, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(durations, 0.99) * 1000, 3),
+        "mean_ms": round(total / len(durations) * 1000, 3),
+        "throughput_per_sec": round(len(durations) / total, 1) if total else None,
+    }
+    if statuses:
+        result["statuses"] = dict(Counter(statuses))
+    return result
+
+
+def measure(fn, iterations, warmup=3, setup=None):
+    """Times fn(*setup()) iterations times; setup runs outside the timed section.
+
+    fn may return an HTTP response, whose status code is then counted.
+    """
+    for _ in range(warmup):
+        fn(*(setup() if setup else ()))
+    durations = []
+    statuses = []
+    for _ in range(iterations):
+        args = setup() if setup else ()
+        started = time.perf_counter()
+        result = fn(*args)
+        durations.append(time.perf_counter() - started)
+        status = getattr(result, "status_code", None)
+        if status is not None:
+            statuses.append(status)
+    return summarize(durations, statuses)
@@ -0,0 +1,103 @@
+import random
+import threading
+from array import array
+from loguru import logger
+
+
+class BlessBucket:
+    __slots__ = ("ids", "texts", "positions")
+
+    def __init__(self):
+        self.ids = array("q")
+        self.texts = []
+        self.positions = {}
+
+    def add(self, bless_id, text):
+        self.positions[bless_id] = len(self.ids)
+        self.ids.append(bless_id)
+        self.texts.append(text)
+
+    def choose(self, exclude_id=None):
+        # O(1) uniform pick that skips the excluded bless by shifting past its slot
+        count = len(self.ids)
+        excluded = self.positions.get(exclude_id)
+        if excluded is None or count == 1:
+            position = random.randrange(count)
+        else:
+            position = random.randrange(count - 1)
+            if position >= excluded:
+                position += 1
+        return self.ids[position], self.texts[position]
+
+
+class BlessIndex:
+    """In-process (GenderId, LanguageId) -> blesses map.
+
+    The map is rebuilt lazily with a single query after insert_bless,
+    update_bless or delete_bless invalidate it. Each person's last bless is
+    kept in the BlessRotation table so nobody gets the same bless two years
+    in a row. Every invalidate() bumps a version, so a build that raced with
+    a bless write is used once but never stored over the newer data.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.buckets = None
+        self.version = 0
+        self.lock = threading.Lock()
+        # Concurrent misses wait for one build instead of each running their own
+        self.build_lock = threading.Lock()
+
+    def invalidate(self):
+        with self.lock:
+            self.version += 1
+            self.buckets = None
+
+    def get_buckets(self):
+        buckets = self.buckets
+        if buckets is not None:
+            return buckets
+        with self.build_lock:
+            buckets = self.buckets
+            if buckets is not None:
+                return buckets
+            version = self.version
+            buckets = self.build()
+            with self.lock:
+                if self.version == version:
+                    self.buckets = buckets
+            return buckets
+
+    def build(self):
+        buckets = {}
+        for bless_id, gender_id, language_id, text in self.db.select_all_blesses():
+            buckets.setdefault((gender_id, language_id), BlessBucket()).add(bless_id, text)
+        logger.info(f"Bless index built with {len(buckets)} buckets")
+        return buckets
+
+    def choose(self, gender_id, language_id, exclude_id=None):
+        bucket = self.get_buckets().get((gender_id, language_id))
+        if bucket is None:
+            return None
+        return bucket.choose(exclude_id)
+
+    def choose_for_persons(self, persons, year):
+        # Returns {PersonId: (BlessId, Bless)} and records new choices in the rotation table
+        rotation = self.db.select_bless_rotation([person["PersonId"] for person in persons])
+        chosen = {}
+        changed = []
+        for person in persons:
+            person_id = person["PersonId"]
+            last_bless_id, last_year = rotation.get(person_id, (None, None))
+            bucket = self.get_buckets().get((person["GenderId"], person["LanguageId"]))
+            if bucket is None:
+                logger.warning(f"No bless found for person {person_id}")
+                continue
+            # A person dispatched again in the same year keeps the bless already chosen for them
+            if last_year == year and last_bless_id in bucket.positions:
+                chosen[person_id] = (last_bless_id, bucket.texts[bucket.positions[last_bless_id]])
+                continue
+            chosen[person_id] = bucket.choose(last_bless_id)
+            changed.append((person_id, chosen[person_id][0], year))
+        self.db.upsert_bless_rotation(changed)
+        return chosen
@@ -0,0 +1,107 @@
+import os
+import zlib
+import threading
+from collections import OrderedDict
+from loguru import logger
+
+
+class CompiledBless:
+    __slots__ = ("template", "uses_intro")
+
+    def __init__(self, template, uses_intro):
+        self.template = template
+        self.uses_intro = uses_intro
+
+
+class BlessTemplates:
+    """Bless texts as sandboxed Jinja2 templates.
+
+    Templates are compiled once, when a bless is inserted or updated, and kept
+    in an LRU keyed by (BlessId, version), where the version is a checksum of
+    the text, so an edited bless can never be rendered from a stale template.
+    Available variables: first_name, last_name, intro and age. Blesses that do
+    not use {{ intro }} get the person's Intro on its own line, as before.
+    """
+
+    def __init__(self, size=None):
+        self.size = int(size or os.getenv("TEMPLATE_CACHE_SIZE", 1024))
+        self._environment = None
+        self.compiled = OrderedDict()
+        self.lock = threading.Lock()
+
+    @property
+    def environment(self):
+        # jinja2 is only imported once the first template is compiled
+        if self._environment is None:
+            from jinja2.sandbox import SandboxedEnvironment
+            self._environment = SandboxedEnvironment(autoescape=False, keep_trailing_newline=True)
+        return self._environment
+
+    @staticmethod
+    def version(text):
+        return zlib.crc32(text.encode("utf-8"))
+
+    def parse(self, text):
+        from jinja2 import TemplateError, meta
+        try:
+            source = self.environment.parse(text)
+            template = self.environment.from_string(text)
+        except TemplateError as e:
+            raise ValueError(f"Invalid bless template: {e}")
+        return CompiledBless(template, "intro" in meta.find_undeclared_variables(source))
+
+    def validate(self, text):
+        self.parse(text)
+
+    def compile(self, bless_id, text):
+        key = (bless_id, self.version(text))
+        with self.lock:
+            compiled = self.compiled.get(key)
+            if compiled is not None:
+                self.compiled.move_to_end(key)
+                return compiled
+        compiled = self.parse(text)
+        with self.lock:
+            self.compiled[key] = compiled
+            self.compiled.move_to_end(key)
+            while len(self.compiled) > self.size:
+                self.compiled.popitem(last=False)
+        return compiled
+
+    def evict(self, bless_id):
+        with self.lock:
+            for key in [key for key in self.compiled if key[0] == bless_id]:
+                del self.compiled[key]
+
+    def clear(self):
+        with self.lock:
+            self.compiled.clear()
+
+    @staticmethod
+    def context(person, year):
+        try:
+            age = year - int(person["BirthDate"][:4])
+        except (KeyError, TypeError, ValueError):
+            age = None
+        return {"first_name": person.get("FirstName", ""), "last_name": person.get("LastName", ""),
+                "intro": person.get("Intro", ""), "age": age}
+
+    def render(self, bless_id, text, person, year):
+        return self.render_compiled(self.compile(bless_id, text), person, year)
+
+    def render_compiled(self, compiled, person, year):
+        message = compiled.template.render(self.context(person, year))
+        if not compiled.uses_intro and person.get("Intro"):
+            message = f"{person['Intro']}\n{message}"
+        return message
+
+    def render_batch(self, items, year):
+        # items are (BlessId, Bless, person) tuples; returns the messages in the same order
+        messages = []
+        for bless_id, text, person in items:
+            try:
+                messages.append(self.render(bless_id, text, person, year))
+            except Exception as e:
+                logger.error(f"Failed rendering bless {bless_id} for person {person.get('PersonId')}: {e}")
+                messages.append(None)
+        return messages
@@ -0,0 +1,60 @@
+import hashlib
+import threading
+from prometheus_client import Counter
+from serialization import dumps
+
+CACHE_REQUESTS = Counter("blessed_cache_requests_total", "Read-through cache lookups", ["cache", "result"])
+
+
+class CacheEntry:
+    __slots__ = ("value", "_body", "_etag")
+
+    def __init__(self, value):
+        self.value = value
+        self._body = None
+        self._etag = None
+
+    # JSON body and strong ETag are computed once per cached value
+    def encoded(self):
+        if self._body is None:
+            self._body = dumps(self.value)
+            self._etag = '"' + hashlib.sha1(self._body).hexdigest() + '"'
+        return self._body, self._etag
+
+
+class ReadThroughCache:
+    """Versioned in-memory cache for small, rarely changing tables.
+
+    Every invalidate() bumps the version of a name, so a load that raced with
+    a write is never stored over the newer data.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.versions = {}
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    def get(self, name, key, loader):
+        entry = self.entries.get((name, key))
+        if entry is not None:
+            CACHE_REQUESTS.labels(name, "hit").inc()
+            return entry
+        CACHE_REQUESTS.labels(name, "miss").inc()
+        version = (self.generation, self.versions.get(name, 0))
+        entry = CacheEntry(loader())
+        with self.lock:
+            if (self.generation, self.versions.get(name, 0)) == version:
+                self.entries[(name, key)] = entry
+        return entry
+
+    def invalidate(self, name):
+        with self.lock:
+            self.versions[name] = self.versions.get(name, 0) + 1
+            for cache_key in [cache_key for cache_key in self.entries if cache_key[0] == name]:
+                del self.entries[cache_key]
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
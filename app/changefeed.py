@@ -0,0 +1,158 @@
+import os
+import json
+import time
+import asyncio
+import threading
+from collections import deque
+from loguru import logger
+
+
+class ChangeFeed:
+    """Sequenced feed of every insert, update and delete made through the connector.
+
+    Changes are appended to the ChangeLog table in the same transaction as the
+    write they describe, so an entry exists exactly when its change committed.
+    The AUTOINCREMENT sequence is shared by every worker process, and each
+    process tails that table into
+    a bounded ring buffer. Clients resume from the last sequence they saw, and
+    only need a full snapshot when they fell off the ring.
+    """
+
+    def __init__(self, db, size=None, poll_interval=None, max_ids=None):
+        self.db = db
+        self.size = int(size or os.getenv("CHANGE_FEED_SIZE", 10000))
+        self.poll_interval = float(poll_interval or os.getenv("CHANGE_FEED_POLL_INTERVAL", 1))
+        # Larger changes are published without ids, telling clients to reload the table
+        self.max_ids = int(max_ids or os.getenv("CHANGE_FEED_MAX_IDS", 1000))
+        self.ring = deque(maxlen=self.size)
+        self.last_seq = None
+        # lock guards the ring and is never held across a query, since() takes it on the event loop;
+        # sync_lock makes one sync at a time read the ChangeLog
+        self.lock = threading.Lock()
+        self.sync_lock = threading.Lock()
+        self.waiters = set()
+        # Callbacks taking the changes every sync brings into the ring, whichever process made them
+        self.listeners = []
+        self.thread = None
+        self.stop_event = threading.Event()
+
+    def record(self, conn, table, operation, ids=None):
+        # Runs on the writer's connection inside its transaction; call refresh() once that committed
+        if ids is not None:
+            ids = list(ids)
+            if len(ids) > self.max_ids:
+                ids = None
+        conn.execute('INSERT INTO ChangeLog (TableName, Operation, Ids, CreatedAt) VALUES (?, ?, ?, ?)',
+                     (table, operation, None if ids is None else json.dumps(ids), time.time()))
+
+    def refresh(self):
+        # Brings committed entries into the ring right away; if this fails the poll loop catches up
+        try:
+            self.sync()
+        except Exception as e:
+            logger.error(f"Change feed sync failed: {e}")
+
+    def sync(self):
+        with self.sync_lock:
+            last_seq = self.last_seq
+            if last_seq is None:
+                # Start with the newest entries so clients of other workers can resume here
+                latest = self.db.fetch_all('SELECT coalesce(max(Seq), 0) FROM ChangeLog')[0][0]
+                last_seq = max(0, latest - self.size)
+                with self.lock:
+                    self.last_seq = last_seq
+            added = []
+            while True:
+                rows = self.db.fetch_all('SELECT Seq, TableName, Operation, Ids, CreatedAt FROM ChangeLog WHERE Seq > ? ORDER BY Seq LIMIT 1000',
+                                         (last_seq,))
+                if not rows:
+                    break
+                changes = [{"seq": seq, "table": table, "op": operation, "ids": None if ids is None else json.loads(ids), "at": created_at}
+                           for seq, table, operation, ids, created_at in rows]
+                last_seq = rows[-1][0]
+                with self.lock:
+                    self.ring.extend(changes)
+                    self.last_seq = last_seq
+                added.extend(changes)
+        if added:
+            for listener in self.listeners:
+                try:
+                    listener(added)
+                except Exception as e:
+                    logger.error(f"Change listener failed: {e}")
+            self.wake()
+        return self.last_seq
+
+    def reset(self):
+        # The database file was replaced: its ChangeLog starts another history
+        with self.sync_lock, self.lock:
+            self.ring.clear()
+            self.last_seq = None
+        self.sync()
+
+    def since(self, after):
+        # Returns (changes, reset); reset means after is no longer in the ring and a snapshot is needed
+        with self.lock:
+            last_seq = self.last_seq or 0
+            oldest = self.ring[0]["seq"] if self.ring else last_seq + 1
+            if after > last_seq or after < oldest - 1:
+                return [], True
+            changes = []
+            for change in reversed(self.ring):
+                if change["seq"] <= after:
+                    break
+                changes.append(change)
+            changes.reverse()
+            return changes, False
+
+    def wake(self):
+        for loop, event in list(self.waiters):
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # The waiter's event loop is already closed
+                self.waiters.discard((loop, event))
+
+    async def wait(self, after, timeout):
+        # Resolves as soon as a change newer than after is in the ring, or after timeout seconds
+        if (self.last_seq or 0) > after:
+            return True
+        event = asyncio.Event()
+        waiter = (asyncio.get_running_loop(), event)
+        self.waiters.add(waiter)
+        try:
+            if (self.last_seq or 0) > after:
+                return True
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.waiters.discard(waiter)
+
+    def prune(self):
+        if self.last_seq:
+            self.db.execute_query('DELETE FROM ChangeLog WHERE Seq <= ?', (self.last_seq - self.size,))
+
+    def run(self):
+        # Picks up the changes made by other worker processes
+        next_prune = 0
+        while not self.stop_event.wait(self.poll_interval):
+            try:
+                self.sync()
+                if time.monotonic() >= next_prune:
+                    self.prune()
+                    next_prune = time.monotonic() + 60
+            except Exception as e:
+                logger.error(f"Change feed sync failed: {e}")
+
+    def start(self):
+        self.stop_event.clear()
+        self.sync()
+        self.thread = threading.Thread(target=self.run, name="change-feed", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=self.poll_interval + 5)
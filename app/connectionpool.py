@@ -0,0 +1,158 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from loguru import logger
+
+
+class ConnectionPool:
+    """Fixed size pool of long lived SQLite connections shared by the API threadpool.
+
+    Connections are checked out for the duration of a single unit of work, so
+    concurrent handlers never share a connection, and the connect/pragma cost is
+    paid once per pooled connection instead of once per query.
+    """
+
+    def __init__(self, db_path, pool_size=None, journal_mode=None, synchronous=None, busy_timeout=None, cached_statements=None, timeout=None):
+        self.db_path = db_path
+        self.pool_size = int(pool_size or os.getenv("DB_POOL_SIZE", 8))
+        self.journal_mode = journal_mode or os.getenv("DB_JOURNAL_MODE", "WAL")
+        self.synchronous = synchronous or os.getenv("DB_SYNCHRONOUS", "NORMAL")
+        self.busy_timeout = int(busy_timeout or os.getenv("DB_BUSY_TIMEOUT", 5000))
+        self.cached_statements = int(cached_statements or os.getenv("DB_CACHED_STATEMENTS", 256))
+        self.timeout = float(timeout or os.getenv("DB_POOL_TIMEOUT", 30))
+        self._idle = queue.LifoQueue(maxsize=self.pool_size)
+        self._lock = threading.Lock()
+        self._created = 0
+        self._generation = 0
+        self._state = threading.Condition()
+        self._in_use = 0
+        self._draining = False
+        # Optional callback taking the seconds every acquire() waited
+        self.acquire_observer = None
+        # Optional callback taking every new connection, e.g. to register SQL functions
+        self.on_connect = None
+
+    def _connect(self, generation):
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=self.busy_timeout / 1000,
+                               cached_statements=self.cached_statements, factory=PooledConnection)
+        conn.generation = generation
+        conn.execute(f"PRAGMA journal_mode={self.journal_mode}")
+        conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        conn.execute(f"PRAGMA busy_timeout={self.busy_timeout}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        if self.on_connect is not None:
+            self.on_connect(conn)
+        logger.info("Pooled connection opened successfully.")
+        return conn
+
+    def acquire(self):
+        if self.acquire_observer is None:
+            return self._acquire()
+        started = time.perf_counter()
+        conn = self._acquire()
+        self.acquire_observer(time.perf_counter() - started)
+        return conn
+
+    def _acquire(self):
+        with self._state:
+            if not self._state.wait_for(lambda: not self._draining, timeout=self.timeout):
+                raise sqlite3.OperationalError("Timed out waiting for the connection pool to reopen")
+            self._in_use += 1
+        try:
+            return self._checkout()
+        except Exception:
+            self._checked_in()
+            raise
+
+    def _checked_in(self):
+        with self._state:
+            self._in_use -= 1
+            self._state.notify_all()
+
+    def _checkout(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.pool_size:
+                self._created += 1
+                generation = self._generation
+                create = True
+            else:
+                create = False
+        if create:
+            try:
+                conn = self._connect(generation)
+            except sqlite3.Error as e:
+                with self._lock:
+                    self._created -= 1
+                logger.error(f"Error connecting to database: {e}")
+                raise
+            return conn
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError("Timed out waiting for a pooled database connection")
+
+    def release(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            with self._lock:
+                stale = conn.generation != self._generation
+                if stale:
+                    self._created -= 1
+            if stale:
+                conn.close()
+            else:
+                self._idle.put_nowait(conn)
+        finally:
+            self._checked_in()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close_all(self):
+        # Bump the generation so connections still checked out are closed on release
+        with self._lock:
+            self._generation += 1
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            with self._lock:
+                self._created -= 1
+            conn.close()
+        logger.info("Connection pool drained.")
+
+    # Blocks new checkouts, waits for in flight work and closes every connection,
+    # so the database file can be swapped underneath the pool
+    @contextmanager
+    def drained(self):
+        with self._state:
+            self._draining = True
+        try:
+            with self._state:
+                if not self._state.wait_for(lambda: self._in_use == 0, timeout=self.timeout):
+                    raise sqlite3.OperationalError("Timed out draining the connection pool")
+            self.close_all()
+            yield
+        finally:
+            with self._state:
+                self._draining = False
+                self._state.notify_all()
+
+
+class PooledConnection(sqlite3.Connection):
+    # Tagged with the pool generation it was opened in, so a drained pool can retire it on release
+    generation = 0
@@ -0,0 +1,89 @@
+import os
+import time
+import threading
+from loguru import logger
+
+
+class DeliveryLog:
+    """Buffered history of send attempts.
+
+    Attempts are collected in memory and written together with their
+    DeliveryStats rollups in one transaction per flush: when the buffer holds
+    batch_size attempts, every flush_interval seconds, after an outbox drain
+    and on stop. Raw rows older than retention_days are pruned, the daily
+    rollups are kept.
+    """
+
+    def __init__(self, db, batch_size=None, flush_interval=None, retention_days=None, max_buffer=None):
+        self.db = db
+        self.batch_size = int(batch_size or os.getenv("DELIVERY_LOG_BATCH_SIZE", 1000))
+        self.flush_interval = float(flush_interval or os.getenv("DELIVERY_LOG_FLUSH_INTERVAL", 5))
+        self.retention_days = float(retention_days or os.getenv("DELIVERY_LOG_RETENTION_DAYS", 90))
+        # Attempts kept for the next flush while the database is failing; older ones are dropped
+        self.max_buffer = int(max_buffer or os.getenv("DELIVERY_LOG_MAX_BUFFER", 100000))
+        self.buffer = []
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.thread = None
+        self.stop_event = threading.Event()
+
+    def record(self, outbox_rows, results, max_attempts):
+        # outbox_rows are claimed Outbox rows and results the matching sender results
+        now = time.time()
+        entries = []
+        for row, result in zip(outbox_rows, results):
+            if result["Sent"]:
+                status, error = "sent", None
+            else:
+                retry = row["Attempts"] < max_attempts and result.get("Retryable", True)
+                status, error = "retry" if retry else "failed", result.get("Error")
+            entries.append((row["OutboxId"], row["PersonId"], result.get("Session"), status, row["Attempts"], error, now))
+        with self.lock:
+            self.buffer.extend(entries)
+            full = len(self.buffer) >= self.batch_size
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                entries, self.buffer = self.buffer, []
+            if not entries:
+                return 0
+            try:
+                self.db.insert_deliveries(entries)
+            except Exception as e:
+                logger.error(f"Failed writing {len(entries)} delivery log entries: {e}")
+                with self.lock:
+                    self.buffer[:0] = entries
+                    del self.buffer[:-self.max_buffer]
+                return 0
+            return len(entries)
+
+    def prune(self):
+        pruned = self.db.prune_deliveries(time.time() - self.retention_days * 86400)
+        if pruned:
+            logger.info(f"Pruned {pruned} delivery log entries older than {self.retention_days:g} days")
+        return pruned
+
+    def run(self):
+        next_prune = 0
+        while not self.stop_event.wait(self.flush_interval):
+            try:
+                self.flush()
+                if time.monotonic() >= next_prune:
+                    self.prune()
+                    next_prune = time.monotonic() + 3600
+            except Exception as e:
+                logger.error(f"Delivery log maintenance failed: {e}")
+
+    def start(self):
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name="delivery-log", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=self.flush_interval + 5)
+        self.flush()
@@ -0,0 +1,200 @@
+import os
+import time
+import calendar
+import threading
+from loguru import logger
+from datetime import datetime
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from prometheus_client import Gauge
+from scheduler import TimerScheduler
+
+SCHEDULED_PERSONS = Gauge("blessed_dispatch_scheduled_persons", "Persons with a birthday timer")
+SCHEDULER_LAG = Gauge("blessed_dispatch_lag_seconds", "Delay between the fire time of the last dispatched batch and its dispatch")
+DUE_PERSONS = Gauge("blessed_dispatch_due_persons", "Persons in the last dispatched batch")
+
+
+class Dispatcher:
+    """Birthday dispatcher driven by a timer heap.
+
+    Every person's next fire timestamp is computed from BirthDate,
+    PreferredHour and their TimeZone (falling back to DEFAULT_TIMEZONE, or the
+    server zone) and kept in a TimerScheduler. The loop sleeps until the next
+    due batch, and person inserts, updates and deletes reschedule only the
+    persons involved. Only the loop touches the schedule: writers merely flag
+    that PersonChanges has news, and only in the process where the loop runs.
+    """
+
+    def __init__(self, db, handler=None, retry_handler=None, retry_interval=60, default_zone=None, grace_period=3600,
+                 poll_interval=5):
+        self.db = db
+        self.handler = handler or self.log_due_persons
+        self.retry_handler = retry_handler
+        self.retry_interval = retry_interval
+        self.default_zone = self.get_zone(default_zone or os.getenv("DEFAULT_TIMEZONE"))
+        # On (re)load, birthdays that fired less than this many seconds ago are still dispatched
+        self.grace_period = grace_period
+        # Changes made by other worker processes reach us through the PersonChanges table
+        self.poll_interval = poll_interval
+        self.change_seq = 0
+        self.timers = TimerScheduler()
+        SCHEDULED_PERSONS.set_function(self.timers.__len__)
+        self.zones = {}
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.reload_pending = False
+        self.changes_pending = False
+        db.person_listeners.append(self.persons_changed)
+
+    @staticmethod
+    def get_zone(name):
+        if not name:
+            return None
+        try:
+            return ZoneInfo(name)
+        except (ZoneInfoNotFoundError, ValueError):
+            logger.warning(f"Unknown time zone {name}, using the default zone")
+            return None
+
+    def zone_for(self, name):
+        if not name:
+            return self.default_zone
+        if name not in self.zones:
+            self.zones[name] = self.get_zone(name) or self.default_zone
+        return self.zones[name]
+
+    def next_fire_time(self, birth_date, preferred_hour, time_zone, after):
+        try:
+            month, day = int(birth_date[5:7]), int(birth_date[8:10])
+        except (TypeError, ValueError):
+            return None
+        zone = self.zone_for(time_zone)
+        year = datetime.fromtimestamp(after, zone).year
+        for year in (year, year + 1):
+            fire_day = 28 if month == 2 and day == 29 and not calendar.isleap(year) else day
+            try:
+                fire_time = datetime(year, month, fire_day, preferred_hour, tzinfo=zone).timestamp()
+            except (TypeError, ValueError):
+                return None
+            if fire_time > after:
+                return fire_time
+        return None
+
+    def schedule_rows(self, rows, after):
+        items = []
+        for person_id, birth_date, preferred_hour, time_zone in rows:
+            fire_time = self.next_fire_time(birth_date, preferred_hour, time_zone, after)
+            if fire_time is None:
+                logger.warning(f"Unable to schedule person {person_id} with birth date {birth_date}")
+                continue
+            items.append((person_id, fire_time))
+        return items
+
+    def load(self):
+        started = time.monotonic()
+        self.change_seq = self.db.last_person_change()
+        rows = self.db.fetch_all("SELECT PersonId, BirthDate, PreferredHour, TimeZone FROM Persons")
+        self.timers.clear()
+        self.timers.schedule_many(self.schedule_rows(rows, time.time() - self.grace_period))
+        logger.info(f"Scheduled {len(self.timers)} persons in {time.monotonic() - started:.2f}s")
+
+    @property
+    def running(self):
+        return self.thread is not None and not self.stop_event.is_set()
+
+    def persons_changed(self, person_ids):
+        # Runs in the writing thread, so it only wakes the loop up; the changes themselves are read from PersonChanges
+        if not self.running:
+            return
+        with self.timers.condition:
+            if person_ids is None:
+                self.reload_pending = True
+            self.changes_pending = True
+            self.timers.condition.notify_all()
+
+    def on_persons_changed(self, person_ids):
+        if person_ids is None:
+            self.load()
+            return
+        rows = self.db.select_persons_by_ids(person_ids)
+        found = set()
+        for person_id, fire_time in self.schedule_rows([(row[0], row[3], row[7], row[9]) for row in rows], time.time()):
+            self.timers.schedule(person_id, fire_time)
+            found.add(person_id)
+        for person_id in set(person_ids) - found:
+            self.timers.cancel(person_id)
+
+    def sync_changes(self):
+        while True:
+            changes = self.db.select_person_changes(self.change_seq)
+            if not changes:
+                return
+            self.on_persons_changed(list({person_id for _, person_id in changes}))
+            self.change_seq = changes[-1][0]
+            self.db.prune_person_changes(self.change_seq)
+
+    def tick(self, now=None):
+        now = now or time.time()
+        fire_time = self.timers.next_fire_time()
+        due = self.timers.pop_due(now)
+        if not due:
+            return []
+        SCHEDULER_LAG.set(max(0, now - fire_time))
+        DUE_PERSONS.set(len(due))
+        persons = self.db.select_persons_by_ids(due, True)
+        logger.info(f"Dispatching {len(persons)} persons")
+        try:
+            if persons:
+                self.handler(persons)
+        finally:
+            # Next year's birthday for everyone that just fired
+            for person in persons:
+                fire_time = self.next_fire_time(person["BirthDate"], person["PreferredHour"], person["TimeZone"], now)
+                if fire_time is not None:
+                    self.timers.schedule(person["PersonId"], fire_time)
+        return persons
+
+    def log_due_persons(self, persons):
+        for person in persons:
+            logger.info(f"Birthday due for person {person['PersonId']}")
+
+    def run(self, stop_event):
+        # Without its schedule the loop would never fire, so a failed load is retried until it succeeds
+        while not stop_event.is_set():
+            try:
+                self.load()
+                break
+            except Exception as e:
+                logger.error(f"Loading the dispatch schedule failed, retrying in {self.poll_interval}s: {e}")
+                stop_event.wait(self.poll_interval)
+        next_retry = time.time() + self.retry_interval
+        next_poll = time.time() + self.poll_interval
+        while not stop_event.is_set():
+            self.timers.wait(time.time, max(0, min(next_retry, next_poll) - time.time()))
+            if stop_event.is_set():
+                break
+            try:
+                # Changes first, so a person added or moved into the current hour is still dispatched
+                if self.reload_pending:
+                    self.reload_pending = self.changes_pending = False
+                    self.load()
+                elif self.changes_pending or time.time() >= next_poll:
+                    self.changes_pending = False
+                    next_poll = time.time() + self.poll_interval
+                    self.sync_changes()
+                self.tick()
+                if self.retry_handler and time.time() >= next_retry:
+                    next_retry = time.time() + self.retry_interval
+                    self.retry_handler()
+            except Exception as e:
+                logger.error(f"Dispatch failed: {e}")
+
+    def start(self):
+        # A fresh event per run, so a previous loop that is still finishing a batch cannot be revived
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, args=(self.stop_event,), name="dispatcher", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        with self.timers.condition:
+            self.timers.condition.notify_all()
@@ -0,0 +1,141 @@
+import heapq
+import calendar
+import threading
+from array import array
+from datetime import date, datetime, timedelta
+
+SLOTS = 12 * 31
+HOURS = 24
+
+
+def slot(month, day):
+    return (month - 1) * 31 + day - 1
+
+
+class SendForecast:
+    """Per-day, per-hour send volume forecast.
+
+    Persons are aggregated with a single GROUP BY into compact arrays holding
+    a count per (birthday, preferred hour) for every (time zone, gender,
+    language) group. A forecast for any date range then only adds up 24
+    counters per day and time zone, so it costs the same at 1M persons as at
+    1K. The arrays are rebuilt when persons change, in this or in another
+    worker process.
+    """
+
+    def __init__(self, db, zone_for, default_zone=None):
+        self.db = db
+        self.zone_for = zone_for
+        self.default_zone = default_zone
+        self.version = None
+        self.groups = {}
+        self.zones = {}
+        self.lock = threading.Lock()
+        db.person_listeners.append(self.invalidate)
+
+    def invalidate(self, person_ids=None):
+        self.version = None
+
+    def load(self):
+        rows = self.db.fetch_all('''
+            SELECT CAST(substr(BirthDate, 6, 2) AS INTEGER), CAST(substr(BirthDate, 9, 2) AS INTEGER), PreferredHour,
+                   TimeZone, GenderId, LanguageId, COUNT(*)
+            FROM Persons GROUP BY substr(BirthDate, 6, 5), PreferredHour, TimeZone, GenderId, LanguageId''')
+        groups = {}
+        zones = {}
+        for month, day, hour, time_zone, gender_id, language_id, count in rows:
+            if not all(isinstance(value, int) for value in (month, day, hour)) or not (1 <= month <= 12 and 1 <= day <= 31 and 0 <= hour < HOURS):
+                continue
+            key = (time_zone or None, gender_id, language_id)
+            if key not in groups:
+                groups[key] = array('I', bytes(4 * SLOTS * HOURS))
+            if key[0] not in zones:
+                zones[key[0]] = array('I', bytes(4 * SLOTS * HOURS))
+            index = slot(month, day) * HOURS + hour
+            groups[key][index] += count
+            zones[key[0]][index] += count
+        self.groups = groups
+        self.zones = zones
+
+    def refresh(self):
+        version = self.db.person_change_version()
+        with self.lock:
+            if version != self.version:
+                self.load()
+                self.version = version
+            return self.groups, self.zones
+
+    def utc_offset(self, zone, day):
+        # Whole hours are enough for a forecast, the DST switch hour itself is not modelled
+        noon = datetime(day.year, day.month, day.day, 12)
+        noon = noon.replace(tzinfo=zone) if zone is not None else noon.astimezone()
+        return int(noon.utcoffset().total_seconds() // 3600)
+
+    def shift(self, time_zone, output_zone, day):
+        zone = self.zone_for(time_zone)
+        if zone is output_zone:
+            return 0
+        return self.utc_offset(output_zone, day) - self.utc_offset(zone, day)
+
+    @staticmethod
+    def day_slots(day):
+        slots = [slot(day.month, day.day)]
+        # Feb 29 birthdays are sent on Feb 28 in non leap years, like the dispatcher does
+        if day.month == 2 and day.day == 28 and not calendar.isleap(day.year):
+            slots.append(slot(2, 29))
+        return slots
+
+    def forecast(self, start: date, end: date, time_zone=None, top=10, window=3600):
+        output_zone = self.zone_for(time_zone) if time_zone else self.default_zone
+        groups, zones = self.refresh()
+        days = (end - start).days + 1
+        histogram = array('Q', bytes(8 * days * HOURS))
+        genders = {}
+        languages = {}
+        # Neighbouring days are included so birthdays shifted across midnight by the zone offset land in range
+        for offset in range(-1, days + 1):
+            day = start + timedelta(days=offset)
+            slots = self.day_slots(day)
+            for zone_name, counts in zones.items():
+                base = offset * HOURS + self.shift(zone_name, output_zone, day)
+                for day_slot in slots:
+                    source = day_slot * HOURS
+                    for hour in range(HOURS):
+                        count = counts[source + hour]
+                        if count and 0 <= base + hour < days * HOURS:
+                            histogram[base + hour] += count
+            if 0 <= offset < days:
+                for (_, gender_id, language_id), counts in groups.items():
+                    total = sum(sum(counts[day_slot * HOURS:(day_slot + 1) * HOURS]) for day_slot in slots)
+                    if total:
+                        genders[gender_id] = genders.get(gender_id, 0) + total
+                        languages[language_id] = languages.get(language_id, 0) + total
+        peaks = heapq.nlargest(top, (index for index in range(len(histogram)) if histogram[index]), key=histogram.__getitem__)
+        peak = histogram[peaks[0]] if peaks else 0
+        return {
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+            "time_zone": time_zone,
+            "total": sum(histogram),
+            "genders": genders,
+            "languages": languages,
+            "peak_hours": [self.peak_hour(groups, output_zone, start, index, histogram[index]) for index in peaks],
+            "required_sends_per_second": round(peak / window, 2),
+            "days": [{"date": (start + timedelta(days=offset)).isoformat(),
+                      "total": sum(histogram[offset * HOURS:(offset + 1) * HOURS]),
+                      "hours": histogram[offset * HOURS:(offset + 1) * HOURS].tolist()} for offset in range(days)],
+        }
+
+    def peak_hour(self, groups, output_zone, start, index, count):
+        # Gender / language breakdown of one output hour, mapped back to each group's local birthday hour
+        day = start + timedelta(days=index // HOURS)
+        genders = {}
+        languages = {}
+        for (zone_name, gender_id, language_id), counts in groups.items():
+            local = index % HOURS - self.shift(zone_name, output_zone, day)
+            local_day = day + timedelta(days=local // HOURS)
+            total = sum(counts[day_slot * HOURS + local % HOURS] for day_slot in self.day_slots(local_day))
+            if total:
+                genders[gender_id] = genders.get(gender_id, 0) + total
+                languages[language_id] = languages.get(language_id, 0) + total
+        return {"date": day.isoformat(), "hour": index % HOURS, "count": count, "genders": genders, "languages": languages}
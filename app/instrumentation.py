@@ -0,0 +1,84 @@
+import os
+import re
+import time
+import sqlite3
+from loguru import logger
+from prometheus_client import Counter, Histogram
+
+QUERY_SECONDS = Histogram("blessed_db_query_seconds", "Statement execution time, fetching included", ["operation"],
+                          buckets=(0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5))
+QUERY_ROWS = Histogram("blessed_db_query_rows", "Rows returned by a statement", ["operation"],
+                       buckets=(0, 1, 10, 100, 1000, 10000, 100000))
+ACQUIRE_SECONDS = Histogram("blessed_db_connection_acquire_seconds", "Wait for a pooled connection",
+                            buckets=(0.00001, 0.0001, 0.001, 0.01, 0.1, 1, 5, 30))
+COMMIT_SECONDS = Histogram("blessed_db_commit_seconds", "Transaction commit time",
+                           buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5))
+LOCK_RETRIES = Counter("blessed_db_lock_retries_total", "Statements retried after finding the database locked", ["operation"])
+SLOW_QUERIES = Counter("blessed_db_slow_queries_total", "Statements slower than DB_SLOW_QUERY_MS", ["operation"])
+
+TABLE = re.compile(r'\b(?:FROM|INTO|UPDATE)\s+(\w+)', re.IGNORECASE)
+MAX_OPERATIONS = 1000
+
+
+def is_lock_error(error):
+    message = str(error)
+    return isinstance(error, sqlite3.OperationalError) and ('locked' in message or 'busy' in message)
+
+
+class QueryMetrics:
+    """Statement, commit and pool wait metrics for SqliteConnector.
+
+    Statements are labeled by operation, their verb and main table (e.g.
+    "select Persons"), so the label set stays small however the SQL is built.
+    With DB_METRICS off and no DB_SLOW_QUERY_MS the connector skips the
+    timing calls altogether.
+    """
+
+    def __init__(self, enabled=None, slow_query_ms=None):
+        self.enabled = (os.getenv("DB_METRICS", "true").lower() in ("1", "true", "yes")) if enabled is None else enabled
+        self.slow_query = float(slow_query_ms if slow_query_ms is not None else os.getenv("DB_SLOW_QUERY_MS", 0)) / 1000
+        self.active = self.enabled or self.slow_query > 0
+        self.operations = {}
+        self.children = {}
+
+    def operation(self, query):
+        operation = self.operations.get(query)
+        if operation is None:
+            match = TABLE.search(query)
+            verb = query.split(None, 1)[0].lower()
+            operation = f"{verb} {match.group(1)}" if match else verb
+            # Queries with a variable number of placeholders must not grow this without bound
+            if len(self.operations) >= MAX_OPERATIONS:
+                self.operations.clear()
+            self.operations[query] = operation
+        return operation
+
+    def observe(self, query, started, rows=None):
+        elapsed = time.perf_counter() - started
+        operation = self.operation(query)
+        if self.enabled:
+            children = self.children.get(operation)
+            if children is None:
+                children = self.children[operation] = (QUERY_SECONDS.labels(operation), QUERY_ROWS.labels(operation))
+            children[0].observe(elapsed)
+            if rows is not None:
+                children[1].observe(rows)
+        if self.slow_query and elapsed >= self.slow_query:
+            SLOW_QUERIES.labels(operation).inc()
+            logger.warning(f"Slow query ({elapsed * 1000:.1f}ms, {operation}): {' '.join(query.split())}")
+
+    def commit(self, conn):
+        if not self.enabled:
+            conn.commit()
+            return
+        started = time.perf_counter()
+        conn.commit()
+        COMMIT_SECONDS.observe(time.perf_counter() - started)
+
+    def observe_acquire(self, seconds):
+        ACQUIRE_SECONDS.observe(seconds)
+
+    def retried(self, query, error):
+        operation = self.operation(query)
+        LOCK_RETRIES.labels(operation).inc()
+        logger.warning(f"Retrying {operation} after a lock error: {error}")
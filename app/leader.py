@@ -0,0 +1,81 @@
+import os
+import uuid
+import time
+import socket
+import threading
+from loguru import logger
+
+
+class LeaderElection:
+    """Lease based leader election stored in the Leases table.
+
+    Every worker process runs one of these; the holder renews its lease every
+    ttl / 3 seconds and any other worker takes the lease over once it has been
+    expired for a full ttl, so exactly one live worker runs the dispatcher.
+    """
+
+    def __init__(self, db, name="dispatcher", on_elected=None, on_demoted=None, ttl=None):
+        self.db = db
+        self.name = name
+        self.on_elected = on_elected
+        self.on_demoted = on_demoted
+        self.ttl = float(ttl or os.getenv("LEADER_LEASE_TTL", 30))
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.is_leader = False
+        self.thread = None
+        self.stop_event = threading.Event()
+
+    def heartbeat(self):
+        try:
+            acquired = self.db.acquire_lease(self.name, self.holder, time.time(), self.ttl)
+        except Exception as e:
+            # Without a confirmed renewal we can no longer assume the lease is ours
+            logger.error(f"Lease heartbeat failed: {e}")
+            acquired = False
+        if acquired and not self.is_leader:
+            self.is_leader = True
+            logger.info(f"{self.holder} elected {self.name} leader")
+            if self.on_elected:
+                try:
+                    self.on_elected()
+                except Exception as e:
+                    # A leader that failed to start must not sit on the lease; the next heartbeat, here or elsewhere, retries
+                    logger.error(f"{self.holder} failed to take over as {self.name} leader: {e}")
+                    self.resign()
+                    return False
+        elif not acquired and self.is_leader:
+            self.is_leader = False
+            logger.warning(f"{self.holder} lost the {self.name} lease")
+            if self.on_demoted:
+                self.on_demoted()
+        return acquired
+
+    def resign(self):
+        self.is_leader = False
+        try:
+            if self.on_demoted:
+                self.on_demoted()
+        except Exception as e:
+            logger.error(f"Stepping down as {self.name} leader failed: {e}")
+        try:
+            self.db.release_lease(self.name, self.holder)
+        except Exception as e:
+            logger.error(f"Releasing the {self.name} lease failed, it expires in {self.ttl:.0f}s: {e}")
+
+    def run(self):
+        while not self.stop_event.is_set():
+            self.heartbeat()
+            self.stop_event.wait(self.ttl / 3)
+
+    def start(self):
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name=f"leader-{self.name}", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=self.ttl)
+        if self.is_leader:
+            # Hand the lease over right away instead of letting it time out
+            self.resign()
@@ -0,0 +1,431 @@
+import re
+import unicodedata
+from loguru import logger
+
+NON_DIGITS = re.compile(r'\D')
+
+
+# SQL functions the connector and the search migrations normalize indexed text with. Triggers never call them,
+# so connections that did not register them, such as the sqlite3 shell, can still write every table.
+def fold_text(text):
+    # unicode61 splits words at combining marks it does not fold, such as Hebrew niqqud, so they are dropped before indexing
+    if text is None or text.isascii():
+        return text
+    text = ''.join(char for char in unicodedata.normalize('NFD', text) if not unicodedata.combining(char))
+    return unicodedata.normalize('NFC', text)
+
+
+def phone_digits(text):
+    return None if text is None else NON_DIGITS.sub('', text)
+
+
+def register_functions(conn):
+    conn.create_function('fold', 1, fold_text, deterministic=True)
+    conn.create_function('digits', 1, phone_digits, deterministic=True)
+
+
+# Ordered schema migrations, tracked through PRAGMA user_version.
+# Never edit a released migration; append a new one instead.
+MIGRATIONS = [
+    (1, "Base schema", [
+        '''
+        CREATE TABLE IF NOT EXISTS Languages (
+            LanguageId INTEGER PRIMARY KEY AUTOINCREMENT,
+            Language TEXT NOT NULL UNIQUE)
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS Genders (
+            GenderId INTEGER PRIMARY KEY AUTOINCREMENT,
+            Gender TEXT NOT NULL UNIQUE)
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS Blesses (
+            BlessId INTEGER PRIMARY KEY AUTOINCREMENT,
+            GenderId INTEGER,
+            LanguageId INTEGER,
+            Bless TEXT NOT NULL,
+            FOREIGN KEY(GenderId) REFERENCES Genders(GenderId),
+            FOREIGN KEY(LanguageId) REFERENCES Languages(LanguageId))
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS Persons (
+            PersonId INTEGER PRIMARY KEY AUTOINCREMENT,
+            FirstName TEXT NOT NULL,
+            LastName TEXT NOT NULL,
+            BirthDate DATE NOT NULL,
+            GenderId INTEGER,
+            LanguageId INTEGER,
+            PhoneNumber TEXT NOT NULL,
+            PreferredHour INTEGER NOT NULL,
+            Intro TEXT NOT NULL,
+            FOREIGN KEY(GenderId) REFERENCES Genders(GenderId),
+            FOREIGN KEY(LanguageId) REFERENCES Languages(LanguageId))
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS Configuration (
+            ConfigId INTEGER PRIMARY KEY CHECK (ConfigId = 1),
+            WhatsappApiUrl TEXT NOT NULL,
+            WhatsappApiToken TEXT NOT NULL,
+            WhatsappApiSessionName TEXT NOT NULL)
+        ''',
+        # Last bless sent to each person, so the next year's pick can skip it
+        '''
+        CREATE TABLE IF NOT EXISTS BlessRotation (
+            PersonId INTEGER PRIMARY KEY,
+            BlessId INTEGER NOT NULL,
+            Year INTEGER NOT NULL)
+        ''',
+        # Birthday lookups by (MM-DD, PreferredHour) for the dispatcher
+        '''
+        CREATE INDEX IF NOT EXISTS IX_Persons_Birthday
+        ON Persons(substr(BirthDate, 6, 5), PreferredHour)
+        ''',
+    ]),
+    (2, "Foreign key and listing filter indexes", [
+        'CREATE INDEX IF NOT EXISTS IX_Blesses_Gender_Language ON Blesses(GenderId, LanguageId)',
+        'CREATE INDEX IF NOT EXISTS IX_Blesses_Language ON Blesses(LanguageId)',
+        'CREATE INDEX IF NOT EXISTS IX_Persons_Gender_Language ON Persons(GenderId, LanguageId)',
+        'CREATE INDEX IF NOT EXISTS IX_Persons_Language ON Persons(LanguageId)',
+    ]),
+    (3, "Delivery outbox", [
+        # One row per (PersonId, Year): a birthday greeting can be enqueued only once
+        '''
+        CREATE TABLE IF NOT EXISTS Outbox (
+            OutboxId INTEGER PRIMARY KEY AUTOINCREMENT,
+            PersonId INTEGER NOT NULL,
+            Year INTEGER NOT NULL,
+            BlessId INTEGER,
+            PhoneNumber TEXT NOT NULL,
+            Message TEXT NOT NULL,
+            Status TEXT NOT NULL DEFAULT 'pending' CHECK (Status IN ('pending', 'sending', 'sent', 'failed')),
+            Attempts INTEGER NOT NULL DEFAULT 0,
+            NextAttemptAt INTEGER NOT NULL,
+            ClaimedBy TEXT,
+            ClaimedAt INTEGER,
+            LastError TEXT,
+            UNIQUE(PersonId, Year))
+        ''',
+        "CREATE INDEX IF NOT EXISTS IX_Outbox_Pending ON Outbox(NextAttemptAt) WHERE Status = 'pending'",
+        "CREATE INDEX IF NOT EXISTS IX_Outbox_Sending ON Outbox(ClaimedAt) WHERE Status = 'sending'",
+    ]),
+    (4, "Per-person time zone", [
+        # IANA zone name, NULL falls back to the server default zone
+        'ALTER TABLE Persons ADD COLUMN TimeZone TEXT',
+    ]),
+    (5, "Leader election leases", [
+        '''
+        CREATE TABLE IF NOT EXISTS Leases (
+            Name TEXT PRIMARY KEY,
+            Holder TEXT NOT NULL,
+            ExpiresAt REAL NOT NULL)
+        ''',
+        # Person changes made by any worker process, consumed by the dispatcher leader
+        '''
+        CREATE TABLE IF NOT EXISTS PersonChanges (
+            Seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            PersonId INTEGER NOT NULL)
+        ''',
+        'CREATE TRIGGER IF NOT EXISTS TR_Persons_Insert AFTER INSERT ON Persons BEGIN INSERT INTO PersonChanges (PersonId) VALUES (new.PersonId); END',
+        'CREATE TRIGGER IF NOT EXISTS TR_Persons_Update AFTER UPDATE ON Persons BEGIN INSERT INTO PersonChanges (PersonId) VALUES (new.PersonId); END',
+        'CREATE TRIGGER IF NOT EXISTS TR_Persons_Delete AFTER DELETE ON Persons BEGIN INSERT INTO PersonChanges (PersonId) VALUES (old.PersonId); END',
+    ]),
+    (6, "Full-text search", [
+        # External content FTS5 tables: only the index is stored, rows are read back from Persons and Blesses
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS PersonsSearch USING fts5(
+            FirstName, LastName, PhoneNumber, Intro,
+            content='Persons', content_rowid='PersonId', tokenize='unicode61 remove_diacritics 2', prefix='2 3')
+        ''',
+        # Trigrams match any part of a phone number, not only its beginning
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS PhonesSearch USING fts5(
+            PhoneNumber, content='Persons', content_rowid='PersonId', tokenize='trigram')
+        ''',
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS BlessesSearch USING fts5(
+            Bless, content='Blesses', content_rowid='BlessId', tokenize='unicode61 remove_diacritics 2', prefix='2 3')
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS TR_PersonsSearch_Insert AFTER INSERT ON Persons BEGIN
+            INSERT INTO PersonsSearch (rowid, FirstName, LastName, PhoneNumber, Intro)
+            VALUES (new.PersonId, new.FirstName, new.LastName, new.PhoneNumber, new.Intro);
+            INSERT INTO PhonesSearch (rowid, PhoneNumber) VALUES (new.PersonId, new.PhoneNumber);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS TR_PersonsSearch_Delete AFTER DELETE ON Persons BEGIN
+            INSERT INTO PersonsSearch (PersonsSearch, rowid, FirstName, LastName, PhoneNumber, Intro)
+            VALUES ('delete', old.PersonId, old.FirstName, old.LastName, old.PhoneNumber, old.Intro);
+            INSERT INTO PhonesSearch (PhonesSearch, rowid, PhoneNumber) VALUES ('delete', old.PersonId, old.PhoneNumber);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS TR_PersonsSearch_Update
+        AFTER UPDATE OF FirstName, LastName, PhoneNumber, Intro ON Persons BEGIN
+            INSERT INTO PersonsSearch (PersonsSearch, rowid, FirstName, LastName, PhoneNumber, Intro)
+            VALUES ('delete', old.PersonId, old.FirstName, old.LastName, old.PhoneNumber, old.Intro);
+            INSERT INTO PersonsSearch (rowid, FirstName, LastName, PhoneNumber, Intro)
+            VALUES (new.PersonId, new.FirstName, new.LastName, new.PhoneNumber, new.Intro);
+            INSERT INTO PhonesSearch (PhonesSearch, rowid, PhoneNumber) VALUES ('delete', old.PersonId, old.PhoneNumber);
+            INSERT INTO PhonesSearch (rowid, PhoneNumber) VALUES (new.PersonId, new.PhoneNumber);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS TR_BlessesSearch_Insert AFTER INSERT ON Blesses BEGIN
+            INSERT INTO BlessesSearch (rowid, Bless) VALUES (new.BlessId, new.Bless);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS TR_BlessesSearch_Delete AFTER DELETE ON Blesses BEGIN
+            INSERT INTO BlessesSearch (BlessesSearch, rowid, Bless) VALUES ('delete', old.BlessId, old.Bless);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS TR_BlessesSearch_Update AFTER UPDATE OF Bless ON Blesses BEGIN
+            INSERT INTO BlessesSearch (BlessesSearch, rowid, Bless) VALUES ('delete', old.BlessId, old.Bless);
+            INSERT INTO BlessesSearch (rowid, Bless) VALUES (new.BlessId, new.Bless);
+        END
+        ''',
+        # Index the rows that existed before this migration
+        "INSERT INTO PersonsSearch (PersonsSearch) VALUES ('rebuild')",
+        "INSERT INTO PhonesSearch (PhonesSearch) VALUES ('rebuild')",
+        "INSERT INTO BlessesSearch (BlessesSearch) VALUES ('rebuild')",
+    ]),
+    (7, "WhatsApp sessions", [
+        # Sessions in addition to the Configuration row; messages are sharded across all enabled ones
+        '''
+        CREATE TABLE IF NOT EXISTS Sessions (
+            SessionId INTEGER PRIMARY KEY AUTOINCREMENT,
+            Name TEXT NOT NULL UNIQUE,
+            WhatsappApiUrl TEXT NOT NULL,
+            WhatsappApiToken TEXT NOT NULL,
+            WhatsappApiSessionName TEXT NOT NULL,
+            RateLimit REAL,
+            Enabled INTEGER NOT NULL DEFAULT 1)
+        ''',
+    ]),
+    (8, "Change feed", [
+        # One global change sequence for every worker; Ids is a JSON array, NULL when the whole table changed
+        '''
+        CREATE TABLE IF NOT EXISTS ChangeLog (
+            Seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            TableName TEXT NOT NULL,
+            Operation TEXT NOT NULL,
+            Ids TEXT,
+            CreatedAt REAL NOT NULL)
+        ''',
+    ]),
+    (9, "Delivery history", [
+        # One row per send attempt; pruned after DELIVERY_LOG_RETENTION_DAYS
+        '''
+        CREATE TABLE IF NOT EXISTS DeliveryLog (
+            LogId INTEGER PRIMARY KEY AUTOINCREMENT,
+            OutboxId INTEGER NOT NULL,
+            PersonId INTEGER NOT NULL,
+            LanguageId INTEGER,
+            GenderId INTEGER,
+            Session TEXT,
+            Status TEXT NOT NULL CHECK (Status IN ('sent', 'retry', 'failed')),
+            Attempt INTEGER NOT NULL,
+            Error TEXT,
+            CreatedAt REAL NOT NULL)
+        ''',
+        'CREATE INDEX IF NOT EXISTS IX_DeliveryLog_CreatedAt ON DeliveryLog(CreatedAt)',
+        # Per-day counts kept up to date with every flush of the log, and kept after the log rows are pruned.
+        # Unknown ids and sessions are stored as 0 and '' so they take part in the primary key.
+        '''
+        CREATE TABLE IF NOT EXISTS DeliveryStats (
+            Day TEXT NOT NULL,
+            LanguageId INTEGER NOT NULL,
+            GenderId INTEGER NOT NULL,
+            Session TEXT NOT NULL,
+            Status TEXT NOT NULL,
+            Count INTEGER NOT NULL,
+            PRIMARY KEY (Day, LanguageId, GenderId, Session, Status)) WITHOUT ROWID
+        ''',
+    ]),
+    (10, "Gender filter indexes", [
+        # Filtering by gender alone otherwise sorts every matching row to page them by id
+        'CREATE INDEX IF NOT EXISTS IX_Persons_Gender ON Persons(GenderId)',
+        'CREATE INDEX IF NOT EXISTS IX_Blesses_Gender ON Blesses(GenderId)',
+    ]),
+    (11, "Drop the birthday lookup index", [
+        # The dispatcher keeps every next birthday in its timer heap and no longer queries by birthday
+        'DROP INDEX IF EXISTS IX_Persons_Birthday',
+    ]),
+    (12, "Folded search text and bulk load triggers", [
+        # Text is indexed through fold() and phone numbers as digits only, the way queries are normalized.
+        # Insert triggers stand aside during bulk loads, which index their rows in one statement.
+        'DROP TRIGGER IF EXISTS TR_Persons_Insert',
+        'DROP TRIGGER IF EXISTS TR_PersonsSearch_Insert',
+        'DROP TRIGGER IF EXISTS TR_PersonsSearch_Delete',
+        'DROP TRIGGER IF EXISTS TR_PersonsSearch_Update',
+        'DROP TRIGGER IF EXISTS TR_BlessesSearch_Insert',
+        'DROP TRIGGER IF EXISTS TR_BlessesSearch_Delete',
+        'DROP TRIGGER IF EXISTS TR_BlessesSearch_Update',
+        '''
+        CREATE TRIGGER IF NOT EXISTS TR_Persons_Insert AFTER INSERT ON Persons WHEN NOT bulk_loading() BEGIN
+            INSERT INTO PersonChanges (PersonId) VALUES (new.PersonId);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS TR_PersonsSearch_Insert AFTER INSERT ON Persons WHEN NOT bulk_loading() BEGIN
+            INSERT INTO PersonsSearch (rowid, FirstName, LastName, PhoneNumber, Intro)
+            VALUES (new.PersonId, fold(new.FirstName), fold(new.LastName), fold(new.PhoneNumber), fold(new.Intro));
+            INSERT INTO PhonesSearch (rowid, PhoneNumber) VALUES (new.PersonId, digits(new.PhoneNumber));
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS TR_PersonsSearch_Delete AFTER DELETE ON Persons BEGIN
+            INSERT INTO PersonsSearch (PersonsSearch, rowid, FirstName, LastName, PhoneNumber, Intro)
+            VALUES ('delete', old.PersonId, fold(old.FirstName), fold(old.LastName), fold(old.PhoneNumber), fold(old.Intro));
+            INSERT INTO PhonesSearch (PhonesSearch, rowid, PhoneNumber) VALUES ('delete', old.PersonId, digits(old.PhoneNumber));
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS TR_PersonsSearch_Update
+        AFTER UPDATE OF FirstName, LastName, PhoneNumber, Intro ON Persons BEGIN
+            INSERT INTO PersonsSearch (PersonsSearch, rowid, FirstName, LastName, PhoneNumber, Intro)
+            VALUES ('delete', old.PersonId, fold(old.FirstName), fold(old.LastName), fold(old.PhoneNumber), fold(old.Intro));
+            INSERT INTO PersonsSearch (rowid, FirstName, LastName, PhoneNumber, Intro)
+            VALUES (new.PersonId, fold(new.FirstName), fold(new.LastName), fold(new.PhoneNumber), fold(new.Intro));
+            INSERT INTO PhonesSearch (PhonesSearch, rowid, PhoneNumber) VALUES ('delete', old.PersonId, digits(old.PhoneNumber));
+            INSERT INTO PhonesSearch (rowid, PhoneNumber) VALUES (new.PersonId, digits(new.PhoneNumber));
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS TR_BlessesSearch_Insert AFTER INSERT ON Blesses WHEN NOT bulk_loading() BEGIN
+            INSERT INTO BlessesSearch (rowid, Bless) VALUES (new.BlessId, fold(new.Bless));
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS TR_BlessesSearch_Delete AFTER DELETE ON Blesses BEGIN
+            INSERT INTO BlessesSearch (BlessesSearch, rowid, Bless) VALUES ('delete', old.BlessId, fold(old.Bless));
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS TR_BlessesSearch_Update AFTER UPDATE OF Bless ON Blesses BEGIN
+            INSERT INTO BlessesSearch (BlessesSearch, rowid, Bless) VALUES ('delete', old.BlessId, fold(old.Bless));
+            INSERT INTO BlessesSearch (rowid, Bless) VALUES (new.BlessId, fold(new.Bless));
+        END
+        ''',
+        # 'rebuild' would read the unfolded content back, so the indexes are emptied and refilled explicitly
+        "INSERT INTO PersonsSearch (PersonsSearch) VALUES ('delete-all')",
+        "INSERT INTO PhonesSearch (PhonesSearch) VALUES ('delete-all')",
+        "INSERT INTO BlessesSearch (BlessesSearch) VALUES ('delete-all')",
+        '''
+        INSERT INTO PersonsSearch (rowid, FirstName, LastName, PhoneNumber, Intro)
+        SELECT PersonId, fold(FirstName), fold(LastName), fold(PhoneNumber), fold(Intro) FROM Persons
+        ''',
+        'INSERT INTO PhonesSearch (rowid, PhoneNumber) SELECT PersonId, digits(PhoneNumber) FROM Persons',
+        'INSERT INTO BlessesSearch (rowid, Bless) SELECT BlessId, fold(Bless) FROM Blesses',
+    ]),
+    (13, "Plain SQL search triggers", [
+        # The search tables keep their own copy of the indexed text, so a row is deleted by rowid whatever was indexed.
+        # Triggers index the raw text of every writer; the connector folds the rows it writes in the same transaction.
+        # Bulk loads drop the insert triggers inside their transaction instead of asking a bulk_loading() function.
+        'DROP TRIGGER IF EXISTS TR_Persons_Insert',
+        'DROP TRIGGER IF EXISTS TR_PersonsSearch_Insert',
+        'DROP TRIGGER IF EXISTS TR_PersonsSearch_Delete',
+        'DROP TRIGGER IF EXISTS TR_PersonsSearch_Update',
+        'DROP TRIGGER IF EXISTS TR_BlessesSearch_Insert',
+        'DROP TRIGGER IF EXISTS TR_BlessesSearch_Delete',
+        'DROP TRIGGER IF EXISTS TR_BlessesSearch_Update',
+        'DROP TABLE IF EXISTS PersonsSearch',
+        'DROP TABLE IF EXISTS PhonesSearch',
+        'DROP TABLE IF EXISTS BlessesSearch',
+        '''
+        CREATE VIRTUAL TABLE PersonsSearch USING fts5(
+            FirstName, LastName, PhoneNumber, Intro, tokenize='unicode61 remove_diacritics 2', prefix='2 3')
+        ''',
+        "CREATE VIRTUAL TABLE PhonesSearch USING fts5(PhoneNumber, tokenize='trigram')",
+        "CREATE VIRTUAL TABLE BlessesSearch USING fts5(Bless, tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+        '''
+        CREATE TRIGGER TR_Persons_Insert AFTER INSERT ON Persons BEGIN
+            INSERT INTO PersonChanges (PersonId) VALUES (new.PersonId);
+        END
+        ''',
+        '''
+        CREATE TRIGGER TR_PersonsSearch_Insert AFTER INSERT ON Persons BEGIN
+            INSERT INTO PersonsSearch (rowid, FirstName, LastName, PhoneNumber, Intro)
+            VALUES (new.PersonId, new.FirstName, new.LastName, new.PhoneNumber, new.Intro);
+            INSERT INTO PhonesSearch (rowid, PhoneNumber) VALUES (new.PersonId, new.PhoneNumber);
+        END
+        ''',
+        '''
+        CREATE TRIGGER TR_PersonsSearch_Delete AFTER DELETE ON Persons BEGIN
+            DELETE FROM PersonsSearch WHERE rowid = old.PersonId;
+            DELETE FROM PhonesSearch WHERE rowid = old.PersonId;
+        END
+        ''',
+        '''
+        CREATE TRIGGER TR_PersonsSearch_Update
+        AFTER UPDATE OF FirstName, LastName, PhoneNumber, Intro ON Persons BEGIN
+            UPDATE PersonsSearch SET FirstName = new.FirstName, LastName = new.LastName, PhoneNumber = new.PhoneNumber, Intro = new.Intro
+            WHERE rowid = new.PersonId;
+            UPDATE PhonesSearch SET PhoneNumber = new.PhoneNumber WHERE rowid = new.PersonId;
+        END
+        ''',
+        '''
+        CREATE TRIGGER TR_BlessesSearch_Insert AFTER INSERT ON Blesses BEGIN
+            INSERT INTO BlessesSearch (rowid, Bless) VALUES (new.BlessId, new.Bless);
+        END
+        ''',
+        '''
+        CREATE TRIGGER TR_BlessesSearch_Delete AFTER DELETE ON Blesses BEGIN
+            DELETE FROM BlessesSearch WHERE rowid = old.BlessId;
+        END
+        ''',
+        '''
+        CREATE TRIGGER TR_BlessesSearch_Update AFTER UPDATE OF Bless ON Blesses BEGIN
+            UPDATE BlessesSearch SET Bless = new.Bless WHERE rowid = new.BlessId;
+        END
+        ''',
+        '''
+        INSERT INTO PersonsSearch (rowid, FirstName, LastName, PhoneNumber, Intro)
+        SELECT PersonId, fold(FirstName), fold(LastName), fold(PhoneNumber), fold(Intro) FROM Persons
+        ''',
+        'INSERT INTO PhonesSearch (rowid, PhoneNumber) SELECT PersonId, digits(PhoneNumber) FROM Persons',
+        'INSERT INTO BlessesSearch (rowid, Bless) SELECT BlessId, fold(Bless) FROM Blesses',
+    ]),
+]
+
+
+def get_schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def run_migrations(conn, migrations=MIGRATIONS):
+    # Each migration and its version bump commit atomically; returns the versions applied
+    register_functions(conn)
+    current = get_schema_version(conn)
+    applied = []
+    for version, description, statements in migrations:
+        if version <= current:
+            continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Another process may have migrated while we waited for the write lock
+            if get_schema_version(conn) >= version:
+                conn.rollback()
+                continue
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        logger.info(f"Applied migration {version}: {description}")
+        applied.append(version)
+    if applied:
+        analyze(conn)
+    return applied
+
+
+def analyze(conn):
+    # FTS5 shadow tables are skipped: statistics taken while they are still small make its internal queries crawl
+    tables = [row[0] for row in conn.execute("SELECT name FROM pragma_table_list WHERE schema = 'main' AND type = 'table' AND name NOT LIKE 'sqlite_%'")]
+    for table in tables:
+        conn.execute(f'ANALYZE "{table}"')
+    conn.commit()
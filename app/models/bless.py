@@ -2,7 +2,7 @@ from pydantic import BaseModel
 from typing import Optional, List
 
 class Bless(BaseModel):
-    BlessId: Optional[int]
+    BlessId: Optional[int] = None
     GenderId: int
     LanguageId: int
     Bless: str
@@ -0,0 +1,10 @@
+from pydantic import BaseModel, ConfigDict
+from typing import Optional
+
+class BlessPatch(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    BlessId: int
+    GenderId: Optional[int] = None
+    LanguageId: Optional[int] = None
+    Bless: Optional[str] = None
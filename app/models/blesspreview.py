@@ -0,0 +1,7 @@
+from pydantic import BaseModel
+from typing import Optional
+
+class BlessPreview(BaseModel):
+    BlessId: Optional[int] = None
+    Bless: Optional[str] = None
+    PersonId: Optional[int] = None
@@ -2,5 +2,5 @@ from pydantic import BaseModel
 from typing import Optional, List
 
 class Gender(BaseModel):
-    GenderId: Optional[int]
+    GenderId: Optional[int] = None
     Gender: str
\ No newline at end of file
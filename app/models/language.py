@@ -2,5 +2,5 @@ from pydantic import BaseModel
 from typing import Optional, List
 
 class Language(BaseModel):
-    LanguageId: Optional[int]
+    LanguageId: Optional[int] = None
     Language: str
\ No newline at end of file
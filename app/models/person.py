@@ -2,7 +2,7 @@ from pydantic import BaseModel
 from typing import Optional, List
 
 class Person(BaseModel):
-    PersonId: Optional[int]
+    PersonId: Optional[int] = None
     FirstName: str
     LastName: str
     BirthDate: str
@@ -10,4 +10,5 @@ class Person(BaseModel):
     LanguageId: int
     PhoneNumber: str
     PreferredHour: Optional[int]
-    Intro: str
\ No newline at end of file
+    Intro: str
+    TimeZone: Optional[str] = None
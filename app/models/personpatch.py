@@ -0,0 +1,16 @@
+from pydantic import BaseModel, ConfigDict
+from typing import Optional
+
+class PersonPatch(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    PersonId: int
+    FirstName: Optional[str] = None
+    LastName: Optional[str] = None
+    BirthDate: Optional[str] = None
+    GenderId: Optional[int] = None
+    LanguageId: Optional[int] = None
+    PhoneNumber: Optional[str] = None
+    PreferredHour: Optional[int] = None
+    Intro: Optional[str] = None
+    TimeZone: Optional[str] = None
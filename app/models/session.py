@@ -0,0 +1,11 @@
+from pydantic import BaseModel, Field
+from typing import Optional
+
+class Session(BaseModel):
+    SessionId: Optional[int] = None
+    Name: str
+    WhatsappApiUrl: str
+    WhatsappApiToken: str
+    WhatsappApiSessionName: str
+    RateLimit: Optional[float] = Field(None, gt=0)
+    Enabled: bool = True
@@ -0,0 +1,110 @@
+import os
+import time
+import uuid
+import threading
+from loguru import logger
+from prometheus_client import Gauge, Histogram
+
+DUE_MESSAGES = Gauge("blessed_outbox_due_messages", "Outbox messages due and waiting for a worker")
+SEND_BATCH_SECONDS = Histogram("blessed_outbox_send_batch_seconds", "Time to send one claimed outbox batch",
+                               buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300))
+
+
+class OutboxWorker:
+    """Delivers the Outbox table with at-least-once semantics.
+
+    Each worker claims a batch with a single UPDATE ... RETURNING, sends it and
+    records the outcome in a single transaction. The (PersonId, Year) unique
+    key means a greeting can only ever be enqueued once, and rows claimed by a
+    worker that died are put back to pending by recover().
+    """
+
+    def __init__(self, db, sender_factory, workers=None, batch_size=None, max_attempts=None, retry_backoff=None,
+                 claim_timeout=None, delivery_log=None):
+        self.db = db
+        self.sender_factory = sender_factory
+        # Optional DeliveryLog recording every send attempt
+        self.delivery_log = delivery_log
+        self.workers = int(workers or os.getenv("OUTBOX_WORKERS", 4))
+        self.batch_size = int(batch_size or os.getenv("OUTBOX_BATCH_SIZE", 200))
+        self.max_attempts = int(max_attempts or os.getenv("OUTBOX_MAX_ATTEMPTS", 5))
+        self.retry_backoff = int(retry_backoff or os.getenv("OUTBOX_RETRY_BACKOFF", 60))
+        self.claim_timeout = int(claim_timeout or os.getenv("OUTBOX_CLAIM_TIMEOUT", 600))
+        self.node_id = uuid.uuid4().hex[:12]
+        self.drain_lock = threading.Lock()
+        # Counted when metrics are scraped, the dispatch path pays nothing for it
+        DUE_MESSAGES.set_function(self.due_count)
+
+    def due_count(self):
+        try:
+            return self.db.count_due_outbox(int(time.time()))
+        except Exception as e:
+            logger.error(f"Failed counting due outbox messages: {e}")
+            return float("nan")
+
+    def enqueue(self, persons, blesses, year):
+        persons = [person for person in persons if person["PersonId"] in blesses]
+        messages = self.db.templates.render_batch([(*blesses[person["PersonId"]], person) for person in persons], year)
+        rows = [(person["PersonId"], year, blesses[person["PersonId"]][0], person["PhoneNumber"], message)
+                for person, message in zip(persons, messages) if message is not None]
+        enqueued = self.db.enqueue_outbox(rows, int(time.time()))
+        logger.info(f"Enqueued {enqueued} of {len(rows)} messages for {year}")
+        return enqueued
+
+    def recover(self, claimed_before=None):
+        recovered = self.db.recover_outbox(claimed_before if claimed_before is not None else int(time.time()) - self.claim_timeout)
+        if recovered:
+            logger.warning(f"Recovered {recovered} outbox messages left in sending state")
+        return recovered
+
+    def work(self, worker_id, sender):
+        delivered = 0
+        while True:
+            now = int(time.time())
+            batch = self.db.claim_outbox(worker_id, self.batch_size, now)
+            if not batch:
+                return delivered
+            with SEND_BATCH_SECONDS.time():
+                results = sender.send_batch_sync([(row["PhoneNumber"], row["Message"]) for row in batch])
+            sent_ids = []
+            failures = []
+            for row, result in zip(batch, results):
+                if result["Sent"]:
+                    sent_ids.append(row["OutboxId"])
+                elif not result.get("Retryable", True):
+                    # Rejected by the API (4xx), another attempt would be rejected the same way
+                    failures.append((row["OutboxId"], result.get("Error"), None))
+                else:
+                    failures.append((row["OutboxId"], result.get("Error"), now + self.retry_backoff * 2 ** (row["Attempts"] - 1)))
+            self.db.complete_outbox(worker_id, sent_ids, failures, self.max_attempts)
+            if self.delivery_log is not None:
+                self.delivery_log.record(batch, results, self.max_attempts)
+            delivered += len(sent_ids)
+
+    def drain(self):
+        # Runs the configured number of workers until no message is due; overlapping drains are skipped
+        if not self.drain_lock.acquire(blocking=False):
+            return 0
+        try:
+            self.recover()
+            sender = self.sender_factory()
+            if sender is None:
+                return 0
+            results = [0] * self.workers
+
+            def run(index):
+                results[index] = self.work(f"{self.node_id}-{index}", sender)
+
+            threads = [threading.Thread(target=run, args=(index,), name=f"outbox-{index}") for index in range(self.workers)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            delivered = sum(results)
+            if delivered:
+                logger.info(f"Outbox delivered {delivered} messages")
+            if self.delivery_log is not None:
+                self.delivery_log.flush()
+            return delivered
+        finally:
+            self.drain_lock.release()
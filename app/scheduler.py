@@ -0,0 +1,95 @@
+import heapq
+import threading
+
+
+class TimerScheduler:
+    """Min-heap of fire timestamps with lazy cancellation.
+
+    Items sharing a timestamp share one heap entry, so the heap holds at most
+    one entry per distinct fire time (date, hour and zone) rather than one per
+    item. Rescheduling or cancelling an item only touches its bucket; empty
+    buckets are skipped when they reach the top of the heap.
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.buckets = {}
+        self.fire_times = {}
+        self.condition = threading.Condition()
+
+    def __len__(self):
+        return len(self.fire_times)
+
+    def _discard(self, item_id):
+        fire_time = self.fire_times.pop(item_id, None)
+        if fire_time is not None:
+            bucket = self.buckets.get(fire_time)
+            if bucket is not None:
+                bucket.discard(item_id)
+
+    def schedule(self, item_id, fire_time):
+        with self.condition:
+            self._discard(item_id)
+            self.fire_times[item_id] = fire_time
+            bucket = self.buckets.get(fire_time)
+            if bucket is None:
+                bucket = self.buckets[fire_time] = set()
+                heapq.heappush(self.heap, fire_time)
+                # The new timer may be earlier than the one the loop is sleeping on
+                if self.heap[0] == fire_time:
+                    self.condition.notify_all()
+            bucket.add(item_id)
+
+    def schedule_many(self, items):
+        # Bulk load: builds the buckets first and heapifies once
+        with self.condition:
+            for item_id, fire_time in items:
+                self._discard(item_id)
+                self.fire_times[item_id] = fire_time
+                self.buckets.setdefault(fire_time, set()).add(item_id)
+            self.heap = list(self.buckets)
+            heapq.heapify(self.heap)
+            self.condition.notify_all()
+
+    def cancel(self, item_id):
+        with self.condition:
+            self._discard(item_id)
+
+    def clear(self):
+        with self.condition:
+            self.heap = []
+            self.buckets = {}
+            self.fire_times = {}
+            self.condition.notify_all()
+
+    def _next_fire_time(self):
+        while self.heap and not self.buckets.get(self.heap[0]):
+            self.buckets.pop(heapq.heappop(self.heap), None)
+        return self.heap[0] if self.heap else None
+
+    def next_fire_time(self):
+        with self.condition:
+            return self._next_fire_time()
+
+    def pop_due(self, now):
+        due = []
+        with self.condition:
+            while True:
+                fire_time = self._next_fire_time()
+                if fire_time is None or fire_time > now:
+                    break
+                heapq.heappop(self.heap)
+                for item_id in self.buckets.pop(fire_time):
+                    del self.fire_times[item_id]
+                    due.append(item_id)
+        return due
+
+    def wait(self, clock, timeout=None):
+        # Sleeps until the earliest timer is due, a timer is added in front of it or timeout passes
+        with self.condition:
+            fire_time = self._next_fire_time()
+            delay = timeout
+            if fire_time is not None:
+                delay = max(0, fire_time - clock()) if delay is None else max(0, min(delay, fire_time - clock()))
+            if delay is None or delay > 0:
+                self.condition.wait(delay)
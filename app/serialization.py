@@ -0,0 +1,36 @@
+import json
+from starlette.responses import Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+# Fastest available encoder: orjson, then ujson, then the stdlib; always returns UTF-8 bytes
+if orjson is not None:
+    def dumps(value):
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+elif ujson is not None:
+    def dumps(value):
+        return ujson.dumps(value, ensure_ascii=False, escape_forward_slashes=False).encode("utf-8")
+else:
+    def dumps(value):
+        return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def columnar(columns, rows):
+    # Column names once plus one array per row, instead of repeating every key in every row
+    return {"columns": list(columns), "rows": rows}
+
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content):
+        return dumps(content)
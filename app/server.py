@@ -1,36 +1,95 @@
-import os
 import time
+# Measured before the other imports, see IMPORT_TIME_BUDGET
+IMPORT_STARTED = time.perf_counter()
+import io
+import os
+import csv
+import json
 import shutil
-import uvicorn
-import schedule
+import sqlite3
+import tempfile
 import threading
-from zipfile import ZipFile
+from zipfile import ZipFile, ZIP_DEFLATED, BadZipFile, is_zipfile
 from loguru import logger
-from pydantic import BaseModel
+from datetime import datetime, date, timedelta
+from pydantic import ValidationError
 from typing import Optional, List
-from sqliteconnector import SqliteConnector
+from sqliteconnector import SqliteConnector, STATS_DIMENSIONS
+from dispatcher import Dispatcher
+from outbox import OutboxWorker
+from deliverylog import DeliveryLog
+from leader import LeaderElection
+from forecast import SendForecast
+from serialization import FastJSONResponse, columnar, dumps
+from contextlib import contextmanager, asynccontextmanager
 from models.bless import Bless
 from models.gender import Gender
 from models.person import Person
 from models.language import Language
 from models.configuration import Configuration
-from fastapi import FastAPI, Request, File, Form, UploadFile, HTTPException, BackgroundTasks
-from fastapi.responses import UJSONResponse
-from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import JSONResponse
-from starlette.responses import FileResponse
+from models.blesspreview import BlessPreview
+from models.personpatch import PersonPatch
+from models.blesspatch import BlessPatch
+from models.session import Session
+from fastapi import FastAPI, Request, File, UploadFile, HTTPException, Query, Body
+from fastapi.responses import Response
 from starlette.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.encoders import jsonable_encoder
-from starlette_exporter import PrometheusMiddleware, handle_metrics
+from prometheus_client import Gauge
+from starlette_exporter import handle_metrics
+
+IMPORT_SECONDS = time.perf_counter() - IMPORT_STARTED
+STARTUP_PHASES = Gauge("blessed_startup_phase_seconds", "Duration of each startup phase", ["phase"])
+
+
+CHUNK_SIZE = 1024 * 1024
+MAX_FORECAST_DAYS = 732
+DEFAULT_SESSION = "default"
+MAX_CHANGES_WAIT = 60
+CHANGES_KEEP_ALIVE = 15
+PREVIEW_PERSON = {"FirstName": "Israel", "LastName": "Israeli", "BirthDate": "1990-01-01", "Intro": "Hi Israel"}
+
+
+class ChunkBuffer(io.RawIOBase):
+    # Unseekable sink that lets ZipFile write a streamed archive we drain chunk by chunk
+    def __init__(self):
+        self.chunks = []
+        self.total = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.total += len(data)
+        return len(data)
 
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
 
 
 class Server:
     def __init__(self):
         self.db = SqliteConnector()
+        self.deliveries = DeliveryLog(self.db)
+        self.outbox = OutboxWorker(self.db, self.create_sender, delivery_log=self.deliveries)
+        # Unhealthy-until times of the WhatsApp sessions, kept across outbox drains
+        self.session_health = {}
+        # Rate limit buckets of the WhatsApp sessions, so a new sender does not start with a fresh burst
+        self.session_buckets = {}
+        self.dispatcher = Dispatcher(self.db, handler=self.send_blesses, retry_handler=self.outbox.drain)
+        self.workers = int(os.getenv("WORKERS", 1))
+        # Every worker serves HTTP, only the lease holder runs the dispatcher
+        self.forecast = SendForecast(self.db, self.dispatcher.zone_for, self.dispatcher.default_zone)
+        self.leader = LeaderElection(self.db, on_elected=self.on_elected, on_demoted=self.dispatcher.stop)
+        # Set by start() when this is the only process, so every claim left in sending state can be recovered
+        self.recover_all_claims = False
+        self.ready = False
+        self.phases = {}
+        self.record_phase("imports", IMPORT_SECONDS)
         self.tags_metadata = [
             {
                 "name": "Blesses",
@@ -53,7 +112,7 @@ class Server:
                 "description": "Utilitis API endpoints (Database backup/restore, Configuration, etc.)",
             },
         ]
-        self.app = FastAPI(title="Blessed by the bot | Tomer Klein", description="Whatsapp bot for automated blesses and whishes by @Tomer Klein", version='1.0.0', openapi_tags=self.tags_metadata, contact={"name": "Tomer Klein", "email": "tomer.klein@gmail.com", "url": "https://github.com/t0mer/blessed-by-the-bot"})
+        self.app = FastAPI(title="Blessed by the bot | Tomer Klein", description="Whatsapp bot for automated blesses and whishes by @Tomer Klein", version='1.0.0', openapi_tags=self.tags_metadata, lifespan=self.lifespan, contact={"name": "Tomer Klein", "email": "tomer.klein@gmail.com", "url": "https://github.com/t0mer/blessed-by-the-bot"})
         self.app.add_route("/metrics", handle_metrics)
         self.origins = ["*"]
 
@@ -69,39 +128,114 @@ class Server:
    
             
         @self.app.get("/languages/",tags=['Languages'], summary="Get the list of languages")
-        def get_languages():
-            languages = self.db.select_all_languages(True)
-            return JSONResponse(languages)
+        def get_languages(request: Request):
+            return self.cached_response(request, self.db.select_all_languages_entry(True))
 
         @self.app.get("/genders/", tags=['Genders'], summary="Get the list of genders")
-        def get_genders():
-            genders = self.db.select_all_genders()
-            return JSONResponse(genders)
+        def get_genders(request: Request):
+            return self.cached_response(request, self.db.select_all_genders_entry(True))
         
         @self.app.get("/blesses/", tags=['Blesses'], summary="Get the list of blesses")
-        def get_blesses():
-            blesses = self.db.select_all_blesses()
-            return JSONResponse(blesses)
+        def get_blesses(after_id: Optional[int] = None, limit: Optional[int] = Query(None, ge=1, le=10000),
+                        gender_id: Optional[int] = None, language_id: Optional[int] = None, stream: bool = False,
+                        format: str = Query("objects", pattern="^(objects|columns)$")):
+            if stream:
+                return self.ndjson_response(self.db.iter_blesses(after_id, gender_id, language_id))
+            if format == "columns":
+                return self.columnar_response(*self.db.select_blesses_page(after_id, limit, gender_id, language_id, columnar=True), limit)
+            blesses = self.db.select_blesses_page(after_id, limit, gender_id, language_id, True)
+            return self.page_response(blesses, limit, "BlessId")
         
         @self.app.get("/persons/", tags=['Persons'], summary="Get the list of persons")
-        def get_persons():
-            persons = self.db.select_all_persons()
-            return JSONResponse(persons)
+        def get_persons(after_id: Optional[int] = None, limit: Optional[int] = Query(None, ge=1, le=10000),
+                        gender_id: Optional[int] = None, language_id: Optional[int] = None, stream: bool = False,
+                        format: str = Query("objects", pattern="^(objects|columns)$")):
+            if stream:
+                return self.ndjson_response(self.db.iter_persons(after_id, gender_id, language_id))
+            if format == "columns":
+                return self.columnar_response(*self.db.select_persons_page(after_id, limit, gender_id, language_id, columnar=True), limit)
+            persons = self.db.select_persons_page(after_id, limit, gender_id, language_id, True)
+            return self.page_response(persons, limit, "PersonId")
         
+        @self.app.get("/persons/search", tags=['Persons'], summary="Search persons by name, phone number or intro")
+        def search_persons(q: str = Query(..., min_length=2, max_length=200), limit: int = Query(20, ge=1, le=100)):
+            return FastJSONResponse(self.db.search_persons(q, limit, True))
+
+        @self.app.get("/blesses/search", tags=['Blesses'], summary="Search blesses by keyword")
+        def search_blesses(q: str = Query(..., min_length=2, max_length=200), limit: int = Query(20, ge=1, le=100)):
+            return FastJSONResponse(self.db.search_blesses(q, limit, True))
+
         @self.app.get("/configuration/", tags=['Utils'], summary="Get the current configuration")
-        def get_configuration():
-            configuration = self.db.get_configuration(True)
-            return JSONResponse(configuration)      
+        def get_configuration(request: Request):
+            return self.cached_response(request, self.db.get_configuration_entry(True))      
+
+        @self.app.get("/ready", tags=['Utils'], summary="Readiness probe, 503 until the startup warm-up is done")
+        def get_ready():
+            return FastJSONResponse({"ready": self.ready, "phases": self.phases}, status_code=200 if self.ready else 503)
+
+        @self.app.get("/forecast", tags=['Utils'], summary="Forecast the number of messages sent per day and hour")
+        def get_forecast(start: Optional[date] = None, end: Optional[date] = None, time_zone: Optional[str] = None,
+                         top: int = Query(10, ge=1, le=100), window: int = Query(3600, ge=1, le=3600)):
+            # window is the number of seconds allowed for delivering one hour's messages
+            start = start or date.today()
+            end = end or start + timedelta(days=6)
+            if end < start or (end - start).days >= MAX_FORECAST_DAYS:
+                raise HTTPException(status_code=400, detail=f"end must be on or after start and at most {MAX_FORECAST_DAYS} days later")
+            if time_zone and self.dispatcher.get_zone(time_zone) is None:
+                raise HTTPException(status_code=400, detail=f"Unknown time zone {time_zone}")
+            return self.forecast.forecast(start, end, time_zone, top, window)
+
+        @self.app.get("/stats", tags=['Utils'], summary="Delivery attempts per UTC day, language, gender, session and status")
+        def get_stats(start: Optional[date] = None, end: Optional[date] = None, group_by: str = "status"):
+            # group_by is a comma separated list of day, language, gender, session and status; unknown ids read as 0
+            end = end or datetime.utcnow().date()
+            start = start or end - timedelta(days=29)
+            if end < start:
+                raise HTTPException(status_code=400, detail="end must be on or after start")
+            dimensions = list(dict.fromkeys(name.strip() for name in group_by.split(",") if name.strip()))
+            unknown = [name for name in dimensions if name not in STATS_DIMENSIONS]
+            if unknown:
+                raise HTTPException(status_code=400, detail=f"Unknown group_by {', '.join(unknown)}, expected any of {', '.join(STATS_DIMENSIONS)}")
+            rows = self.db.select_delivery_stats(start.isoformat(), end.isoformat(), dimensions)
+            return FastJSONResponse({"start": start.isoformat(), "end": end.isoformat(), "group_by": dimensions,
+                                     "total": sum(row["Count"] for row in rows), "rows": rows})
+
+        @self.app.get("/changes", tags=['Utils'], summary="Changes after a sequence, as a long poll or a server-sent event stream")
+        async def get_changes(request: Request, after: Optional[int] = Query(None, ge=0), timeout: float = Query(25, ge=0, le=MAX_CHANGES_WAIT),
+                              stream: bool = False):
+            # Without after (or Last-Event-ID), and whenever reset is true, the client reloads what it needs and resumes from seq
+            if after is None and request.headers.get("last-event-id", "").isdigit():
+                after = int(request.headers["last-event-id"])
+            if stream or "text/event-stream" in request.headers.get("accept", ""):
+                return StreamingResponse(self.change_events(request, after), media_type="text/event-stream",
+                                         headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+            if after is None:
+                return FastJSONResponse({"seq": self.db.changes.last_seq or 0, "reset": True, "changes": []})
+            changes, reset = await self.changes_since(after)
+            if not changes and not reset and timeout:
+                await self.db.changes.wait(after, timeout)
+                changes, reset = await self.changes_since(after)
+            seq = (self.db.changes.last_seq or 0) if reset else changes[-1]["seq"] if changes else after
+            return FastJSONResponse({"seq": seq, "reset": reset, "changes": changes})
+
+        # Batch routes are registered before the /{id} routes they would otherwise be matched by
+        @self.app.delete("/blesses/batch", tags=['Blesses'], summary="Delete a list of blesses in one transaction")
+        def delete_blesses(ids: List[int] = Body(..., max_length=100000)):
+            return self.batch_result("BlessId", ids, self.db.delete_blesses(ids), "deleted")
+
+        @self.app.delete("/persons/batch", tags=['Persons'], summary="Delete a list of persons in one transaction")
+        def delete_persons(ids: List[int] = Body(..., max_length=100000)):
+            return self.batch_result("PersonId", ids, self.db.delete_persons(ids), "deleted")
 
         @self.app.delete("/languages/{language_id}",tags=['Languages'], summary="Delete the requested language")
-        def delete_language(language_id: int):
-            self.db.delete_language(language_id=language_id)
-            return {"message": "Language deleted successfully"}
+        def delete_language(language_id: int, cascade: bool = False):
+            deleted = self.db.delete_language(language_id=language_id, cascade=cascade)
+            return {"message": "Language deleted successfully", "cascaded": deleted}
 
         @self.app.delete("/genders/{gender_id}", tags=['Genders'], summary="Delete the requested gender")
-        def delete_gender(gender_id: int):
-            self.db.delete_gender(gender_id=gender_id)
-            return {"message": "Gender deleted successfully"}
+        def delete_gender(gender_id: int, cascade: bool = False):
+            deleted = self.db.delete_gender(gender_id=gender_id, cascade=cascade)
+            return {"message": "Gender deleted successfully", "cascaded": deleted}
 
         @self.app.delete("/blesses/{bless_id}", tags=['Blesses'], summary="Delete the requested bless")
         def delete_bless(bless_id: int):
@@ -119,30 +253,85 @@ class Server:
             return {"message": "Configuration deleted successfully"}
 
 
+        @self.app.patch("/blesses/batch", tags=['Blesses'], summary="Update a list of blesses in one transaction")
+        async def update_blesses(request: Request):
+            rows, errors = await run_in_threadpool(self.validate_rows, await self.read_patch_rows(request), BlessPatch, self.patch_params("BlessId"),
+                                                   check=self.check_patch("BlessId", lambda bless: bless.Bless is None or self.db.templates.validate(bless.Bless)))
+            found = await run_in_threadpool(self.db.update_blesses, rows) if rows else set()
+            return {**self.batch_result("BlessId", [bless_id for bless_id, _ in rows], found, "updated"), "errors": errors}
+
+        @self.app.patch("/persons/batch", tags=['Persons'], summary="Update a list of persons in one transaction")
+        async def update_persons(request: Request):
+            rows, errors = await run_in_threadpool(self.validate_rows, await self.read_patch_rows(request), PersonPatch, self.patch_params("PersonId"),
+                                                   check=self.check_patch("PersonId", lambda person: self.check_time_zone(person.TimeZone)))
+            found = await run_in_threadpool(self.db.update_persons, rows) if rows else set()
+            return {**self.batch_result("PersonId", [person_id for person_id, _ in rows], found, "updated"), "errors": errors}
+
         @self.app.put("/languages/{language_id}", response_model=Language, tags=['Languages'], summary="Update the language name")
         def update_language(language_id: int, language: Language):
-            self.db.update_language(language_id=language_id,new_language=language)
+            self.db.update_language(language_id=language_id,new_language=language.Language)
             return {**language.dict(), "LanguageId": language_id}
 
         @self.app.put("/genders/{gender_id}", response_model=Gender, tags=['Genders'], summary="Update the gender name")
         def update_gender(gender_id: int, gender: Gender):
-            self.db.update_gender(gender_id=gender_id,gender=gender.Gender)
+            self.db.update_gender(gender_id=gender_id,new_gender=gender.Gender)
             return {**gender.dict(), "GenderId": gender_id}
 
         @self.app.put("/blesses/{bless_id}", response_model=Bless, tags=['Blesses'], summary="Update the bless")
         def update_bless(bless_id: int, bless: Bless):
-            self.db.update_bless(bless_id=bless_id,gender_id=bless.GenderId,language_id=bless.LanguageId,bless=bless.Bless)
+            try:
+                self.db.update_bless(bless_id=bless_id,gender_id=bless.GenderId,language_id=bless.LanguageId,bless=bless.Bless)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
             return {**bless.dict(), "BlessId": bless_id}
 
         @self.app.put("/persons/{person_id}", response_model=Person, tags=['Persons'], summary="Update the person")
         def update_person(person_id: int, person: Person):
+            try:
+                self.check_time_zone(person.TimeZone)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
             self.db.update_person(person_id=person_id,first_name=person.FirstName, last_name=person.LastName,
                                   birth_date=person.BirthDate,gender_id=person.GenderId,language_id=person.LanguageId,
-                                  phone_number=person.PhoneNumber,preferred_hour=person.PreferredHour, intro=person.Intro)
+                                  phone_number=person.PhoneNumber,preferred_hour=person.PreferredHour, intro=person.Intro,
+                                  time_zone=person.TimeZone)
             return {**person.dict(), "PersonId": person_id}
 
 
-        @self.app.put("/configuration/", response_model=Configuration, tags=['Utils'], summary="Update the configuration")
+        @self.app.get("/configuration/sessions", tags=['Utils'], summary="Get the additional WhatsApp sessions")
+        def get_sessions(request: Request):
+            return self.cached_response(request, self.db.select_sessions_entry(True))
+
+        @self.app.post("/configuration/sessions", response_model=Session, tags=['Utils'], summary="Add a WhatsApp session")
+        def create_session(session: Session):
+            self.check_session_name(session.Name)
+            try:
+                session_id = self.db.insert_session(session.Name, session.WhatsappApiUrl, session.WhatsappApiToken,
+                                                    session.WhatsappApiSessionName, session.RateLimit, session.Enabled)
+            except sqlite3.IntegrityError:
+                raise HTTPException(status_code=409, detail=f"Session {session.Name} already exists")
+            return {**session.dict(), "SessionId": session_id}
+
+        @self.app.put("/configuration/sessions/{session_id}", response_model=Session, tags=['Utils'], summary="Update a WhatsApp session")
+        def update_session(session_id: int, session: Session):
+            self.check_session_name(session.Name)
+            try:
+                found = self.db.update_session(session_id, Name=session.Name, WhatsappApiUrl=session.WhatsappApiUrl,
+                                               WhatsappApiToken=session.WhatsappApiToken, WhatsappApiSessionName=session.WhatsappApiSessionName,
+                                               RateLimit=session.RateLimit, Enabled=session.Enabled)
+            except sqlite3.IntegrityError:
+                raise HTTPException(status_code=409, detail=f"Session {session.Name} already exists")
+            if not found:
+                raise HTTPException(status_code=404, detail=f"Session {session_id} not found")
+            return {**session.dict(), "SessionId": session_id}
+
+        @self.app.delete("/configuration/sessions/{session_id}", tags=['Utils'], summary="Delete a WhatsApp session")
+        def delete_session(session_id: int):
+            if not self.db.delete_session(session_id):
+                raise HTTPException(status_code=404, detail=f"Session {session_id} not found")
+            return {"message": "Session deleted successfully"}
+
+        @self.app.put("/configuration/", tags=['Utils'], summary="Update the configuration")
         def update_configuration(configuration: Configuration):
             self.db.update_configuration(whatsapp_api_session_name=configuration.WhatsappApiSessionName,whatsapp_api_token=configuration.WhatsappApiToken,
                                          whatsapp_api_url=configuration.WhatsappApiUrl)
@@ -159,15 +348,45 @@ class Server:
 
         @self.app.post("/genders/", response_model=Gender, tags=['Genders'], summary="Add a new gender to the genders list")
         def create_gender(gender: Gender):
-            gender_id = self.db.insert_gender(gender=gender_id)
+            gender_id = self.db.insert_gender(gender=gender.Gender)
             return {**gender.dict(), "GenderId": gender_id}
 
 
         @self.app.post("/blesses/", response_model=Bless, tags=['Blesses'], summary="Add a new bless to the blesses list")
         def create_bless(bless: Bless):
-            bless_id = self.db.insert_bless(gender_id=bless.GenderId,language_id=bless.LanguageId, bless=bless.Bless)
+            try:
+                bless_id = self.db.insert_bless(gender_id=bless.GenderId,language_id=bless.LanguageId, bless=bless.Bless)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
             return {**bless.dict(), "BlessId": bless_id}
 
+        @self.app.post("/blesses/preview", tags=['Blesses'], summary="Render a bless for a person without sending it")
+        def preview_bless(preview: BlessPreview):
+            if preview.Bless is None and preview.BlessId is None:
+                raise HTTPException(status_code=400, detail="Either BlessId or Bless is required")
+            if preview.Bless is not None:
+                bless_id, text = None, preview.Bless
+            else:
+                blesses = self.db.fetch_all('SELECT BlessId, Bless FROM Blesses WHERE BlessId = ?', (preview.BlessId,))
+                if not blesses:
+                    raise HTTPException(status_code=404, detail="Bless not found")
+                bless_id, text = blesses[0]
+            person = PREVIEW_PERSON
+            if preview.PersonId is not None:
+                persons = self.db.select_persons_by_ids([preview.PersonId], True)
+                if not persons:
+                    raise HTTPException(status_code=404, detail="Person not found")
+                person = persons[0]
+            try:
+                # Unsaved texts are compiled on the fly and never enter the template cache
+                if bless_id is None:
+                    message = self.db.templates.render_compiled(self.db.templates.parse(text), person, datetime.now().year)
+                else:
+                    message = self.db.templates.render(bless_id, text, person, datetime.now().year)
+            except Exception as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            return {"message": message}
+
         @self.app.post("/configuration/", tags=['Utils'], summary="Create configuration")
         def create_configuration(configuration: Configuration):
             person_id = self.db.insert_configurarion(whatsapp_api_session_name=configuration.WhatsappApiSessionName,whatsapp_api_token=configuration.WhatsappApiToken,
@@ -176,35 +395,239 @@ class Server:
 
 
 
+        @self.app.post("/blesses/bulk", tags=['Blesses'], summary="Import blesses from a JSON array or a CSV file")
+        async def bulk_create_blesses(request: Request):
+            rows, errors = await run_in_threadpool(self.validate_rows, await self.read_bulk_rows(request), Bless,
+                                                   lambda bless: (bless.GenderId, bless.LanguageId, bless.Bless),
+                                                   check=lambda bless: self.db.templates.validate(bless.Bless))
+            inserted = await run_in_threadpool(self.db.bulk_insert_blesses, rows) if rows else 0
+            return {"inserted": inserted, "errors": errors}
+
+        @self.app.post("/persons/bulk", tags=['Persons'], summary="Import persons from a JSON array or a CSV file")
+        async def bulk_create_persons(request: Request):
+            rows, errors = await run_in_threadpool(self.validate_rows, await self.read_bulk_rows(request), Person,
+                                                   lambda person: (person.FirstName, person.LastName, person.BirthDate, person.GenderId,
+                                                                   person.LanguageId, person.PhoneNumber, person.PreferredHour, person.Intro, person.TimeZone),
+                                                   required=("PreferredHour",), check=lambda person: self.check_time_zone(person.TimeZone))
+            inserted = await run_in_threadpool(self.db.bulk_insert_persons, rows) if rows else 0
+            return {"inserted": inserted, "errors": errors}
+
+
         @self.app.get("/backup", tags=['Utils'], summary="Create a database backup")
-        async def create_backup(background_tasks: BackgroundTasks):
-            zip_file = "backup.zip"
-            try:
-                with ZipFile(zip_file, 'w') as zipf:
-                    zipf.write(self.db.db_path)
-                return FileResponse(zip_file, media_type='application/zip', filename=zip_file)
-            except Exception as e:
-                raise HTTPException(status_code=500, detail=str(e))
-            finally:
-                background_tasks.add_task(self.delete_file, zip_file)
+        def create_backup():
+            return StreamingResponse(self.backup_chunks(), media_type='application/zip',
+                                     headers={"Content-Disposition": 'attachment; filename="backup.zip"'})
 
 
         @self.app.post("/restore", tags=['Utils'], summary="Restore the database")
-        async def restore_database(background_tasks: BackgroundTasks,file: UploadFile = File(...)):
-            zip_file = "restored.zip"
+        async def restore_database(file: UploadFile = File(...)):
+            # Other workers keep connections and caches on the file that would be replaced under them
+            if self.workers > 1:
+                raise HTTPException(status_code=409, detail="Restore is not available with more than one worker, run it with WORKERS=1.")
+            db_dir = os.path.dirname(self.db.db_path) or "."
+            upload_fd, upload_path = tempfile.mkstemp(dir=db_dir, suffix=".upload")
+            restore_path = upload_path
+            started = time.monotonic()
+            size = 0
             try:
-                if os.path.exists(self.db.db_path):
-                    os.remove(self.db.db_path)
-                with open(zip_file, "wb") as buffer:
-                    shutil.copyfileobj(file.file, buffer)
-                with ZipFile(zip_file, 'r') as zipf:
-                    zipf.extractall()
-                
-                return {"message": "Database restored successfully."}
+                with os.fdopen(upload_fd, "wb") as buffer:
+                    while chunk := await file.read(CHUNK_SIZE):
+                        buffer.write(chunk)
+                        size += len(chunk)
+                if is_zipfile(upload_path):
+                    restore_fd, restore_path = tempfile.mkstemp(dir=db_dir, suffix=".restore")
+                    await run_in_threadpool(self.extract_database, upload_path, restore_fd)
+                await run_in_threadpool(self.db.restore, restore_path)
+                elapsed = time.monotonic() - started
+                logger.info(f"Restored {size} bytes in {elapsed:.2f}s")
+                return {"message": "Database restored successfully.", "bytes": size, "seconds": round(elapsed, 3),
+                        "bytes_per_sec": round(size / elapsed) if elapsed else size}
+            except (BadZipFile, sqlite3.DatabaseError) as e:
+                raise HTTPException(status_code=400, detail=str(e))
             except Exception as e:
                 raise HTTPException(status_code=500, detail=str(e))
             finally:
-                background_tasks.add_task(self.delete_file, zip_file)
+                for path in {upload_path, restore_path}:
+                    if os.path.exists(path):
+                        self.delete_file(path)
+
+
+    def backup_chunks(self):
+        started = time.monotonic()
+        snapshot_path = self.db.snapshot()
+        try:
+            size = os.path.getsize(snapshot_path)
+            buffer = ChunkBuffer()
+            with ZipFile(buffer, "w", ZIP_DEFLATED) as zipf, open(snapshot_path, "rb") as source:
+                with zipf.open(self.db.db_path, "w", force_zip64=True) as entry:
+                    while data := source.read(CHUNK_SIZE):
+                        entry.write(data)
+                        chunk = buffer.drain()
+                        if chunk:
+                            yield chunk
+            yield buffer.drain()
+        finally:
+            self.delete_file(snapshot_path)
+        elapsed = time.monotonic() - started
+        logger.info(f"Backed up {size} bytes ({buffer.total} compressed) in {elapsed:.2f}s, "
+                    f"{size / elapsed if elapsed else size:.0f} bytes/sec")
+
+    # Streams the first database member of a backup zip into the given file descriptor
+    def extract_database(self, zip_path, fd):
+        with ZipFile(zip_path) as zipf, os.fdopen(fd, "wb") as target:
+            members = [name for name in zipf.namelist() if name.endswith(".db")]
+            if not members:
+                raise BadZipFile("No database file found in the archive")
+            with zipf.open(members[0]) as source:
+                shutil.copyfileobj(source, target, CHUNK_SIZE)
+
+    # Serves a cached JSON body with a strong ETag, or 304 when the client copy is current
+    def cached_response(self, request: Request, entry):
+        body, etag = entry.encoded()
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and (if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]):
+            return Response(status_code=304, headers=headers)
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    # A full page means there may be more rows, so hand the client the next keyset cursor
+    def page_response(self, rows, limit, id_column):
+        headers = {}
+        if limit is not None and len(rows) == limit:
+            headers["X-Next-After-Id"] = str(rows[-1][id_column])
+        return FastJSONResponse(rows, headers=headers)
+
+    # {"columns": [...], "rows": [[...]]}, the id is always the first column
+    def columnar_response(self, columns, rows, limit):
+        headers = {}
+        if limit is not None and len(rows) == limit:
+            headers["X-Next-After-Id"] = str(rows[-1][0])
+        return FastJSONResponse(columnar(columns, rows), headers=headers)
+
+    def ndjson_response(self, rows, batch_size=500):
+        def lines():
+            batch = []
+            for row in rows:
+                batch.append(dumps(row))
+                if len(batch) >= batch_size:
+                    yield b"\n".join(batch) + b"\n"
+                    batch = []
+            if batch:
+                yield b"\n".join(batch) + b"\n"
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+    # Bulk payloads are a JSON array, a text/csv body or a multipart upload of either.
+    # Only the upload is awaited on the event loop, parsing up to 100k rows runs in the threadpool.
+    async def read_bulk_rows(self, request: Request):
+        content_type = request.headers.get("content-type", "")
+        if content_type.startswith("multipart/form-data"):
+            form = await request.form()
+            upload = form.get("file")
+            if upload is None:
+                raise HTTPException(status_code=400, detail="Missing 'file' in the upload form")
+            data = await upload.read()
+            is_csv = not (upload.filename or "").lower().endswith(".json")
+        else:
+            data = await request.body()
+            is_csv = "csv" in content_type
+        return await run_in_threadpool(self.parse_bulk_rows, data, is_csv)
+
+    def parse_bulk_rows(self, data, is_csv):
+        try:
+            if is_csv:
+                return list(csv.DictReader(io.StringIO(data.decode("utf-8-sig"))))
+            rows = json.loads(data)
+        except (ValueError, csv.Error) as e:
+            raise HTTPException(status_code=400, detail=f"Unable to parse payload: {e}")
+        if not isinstance(rows, list):
+            raise HTTPException(status_code=400, detail="Expected a JSON array of rows")
+        return rows
+
+    def validate_rows(self, rows, model, to_params, required=(), check=None):
+        valid = []
+        errors = []
+        for index, row in enumerate(rows):
+            try:
+                if not isinstance(row, dict):
+                    raise TypeError("Row must be an object")
+                item = model(**row)
+                missing = [field for field in required if getattr(item, field) is None]
+                if missing:
+                    raise TypeError(f"Missing required fields: {', '.join(missing)}")
+                if check:
+                    check(item)
+            except ValidationError as e:
+                errors.append({"index": index, "errors": [{"loc": list(error["loc"]), "msg": error["msg"]} for error in e.errors()]})
+                continue
+            except (TypeError, ValueError) as e:
+                errors.append({"index": index, "errors": [{"loc": [], "msg": str(e)}]})
+                continue
+            valid.append(to_params(item))
+        return valid, errors
+
+    # Blank CSV cells mean "unchanged", like a missing JSON key
+    async def read_patch_rows(self, request: Request):
+        return await run_in_threadpool(self.drop_blank_cells, await self.read_bulk_rows(request))
+
+    @staticmethod
+    def drop_blank_cells(rows):
+        return [{key: value for key, value in row.items() if value != ""} if isinstance(row, dict) else row for row in rows]
+
+    # Batch rows are (id, {column: value}) with only the fields that were sent and are not null
+    def patch_params(self, id_field):
+        def to_params(item):
+            changes = item.dict(exclude_none=True)
+            return changes.pop(id_field), changes
+        return to_params
+
+    def check_patch(self, id_field, check=None):
+        def check_item(item):
+            if not item.dict(exclude_none=True).keys() - {id_field}:
+                raise ValueError("No fields to update")
+            if check:
+                check(item)
+        return check_item
+
+    def batch_result(self, id_field, ids, found, status):
+        results = [{id_field: row_id, "status": status if row_id in found else "not_found"} for row_id in ids]
+        return {status: len(found), "results": results}
+
+    # Unknown zones would silently fall back to the default zone when the person is scheduled
+    def check_time_zone(self, time_zone):
+        if time_zone and self.dispatcher.get_zone(time_zone) is None:
+            raise ValueError(f"Unknown time zone {time_zone}")
+
+    def check_session_name(self, name):
+        if name == DEFAULT_SESSION:
+            raise HTTPException(status_code=400, detail=f"The session name {DEFAULT_SESSION} is reserved for the configuration")
+
+    # The Configuration row plus every enabled session, sharded by phone number
+    def create_sender(self):
+        from whatsappsender import WhatsappSender, ShardedSender
+        configuration = self.db.get_configuration(True)
+        senders = {}
+        if configuration:
+            senders[DEFAULT_SESSION] = WhatsappSender.from_configuration(configuration[0])
+        for session in self.db.select_sessions(True):
+            if session["Enabled"]:
+                senders[session["Name"]] = WhatsappSender.from_configuration(session)
+        for name, sender in senders.items():
+            bucket = self.session_buckets.get(name)
+            if bucket is not None and bucket.rate == sender.rate_limit:
+                sender.bucket = bucket
+            else:
+                self.session_buckets[name] = sender.bucket
+        if not senders:
+            logger.warning("No WhatsApp configuration found, skipping dispatch.")
+            return None
+        return ShardedSender(senders, self.session_health)
+
+    def send_blesses(self, persons):
+        year = datetime.now().year
+        blesses = self.db.bless_index.choose_for_persons(persons, year)
+        self.outbox.enqueue(persons, blesses, year)
+        return self.outbox.drain()
 
 
     def delete_file(self,file_path: str):
@@ -214,5 +637,104 @@ class Server:
             logger.warning(f"Error deleting file: {e}") 
 
         
+    async def changes_since(self, after):
+        changes, reset = self.db.changes.since(after)
+        if reset and after > (self.db.changes.last_seq or 0):
+            # The sequence may come from another worker this one has not caught up with yet
+            await run_in_threadpool(self.db.changes.sync)
+            changes, reset = self.db.changes.since(after)
+        return changes, reset
+
+    async def change_events(self, request: Request, after):
+        cursor = after
+        if cursor is None:
+            cursor = self.db.changes.last_seq or 0
+            yield f"retry: 3000\nevent: reset\nid: {cursor}\ndata: {cursor}\n\n"
+        while not await request.is_disconnected():
+            changes, reset = await self.changes_since(cursor)
+            if reset:
+                cursor = self.db.changes.last_seq or 0
+                yield f"event: reset\nid: {cursor}\ndata: {cursor}\n\n"
+            elif changes:
+                yield "".join(f"id: {change['seq']}\nevent: change\ndata: {dumps(change).decode()}\n\n" for change in changes)
+                cursor = changes[-1]["seq"]
+            elif not await self.db.changes.wait(cursor, CHANGES_KEEP_ALIVE):
+                # Comments keep proxies from closing an idle stream
+                yield ": keep-alive\n\n"
+
+    def record_phase(self, name, seconds):
+        self.phases[name] = round(seconds, 4)
+        STARTUP_PHASES.labels(name).set(seconds)
+        logger.info(f"Startup phase {name} took {seconds:.3f}s")
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        yield
+        self.record_phase(name, time.perf_counter() - started)
+
+    # Blocking part of the startup: no request is served before the schema is current
+    def initialize(self):
+        budget = float(os.getenv("IMPORT_TIME_BUDGET", 1.0))
+        if IMPORT_SECONDS > budget:
+            logger.warning(f"Server imports took {IMPORT_SECONDS:.3f}s, over the {budget}s budget")
+        with self.phase("pool"):
+            with self.db.pool.connection():
+                pass
+        with self.phase("migrations"):
+            self.db.create_tables()
+        if self.recover_all_claims:
+            self.outbox.recover(int(time.time()) + 1)
+
+    # Loads what the first requests and the first dispatch would otherwise load on demand
+    def warm_up(self):
+        try:
+            with self.phase("caches"):
+                self.db.select_all_languages_entry(True).encoded()
+                self.db.select_all_genders_entry(True).encoded()
+                self.db.get_configuration_entry(True).encoded()
+            with self.phase("bless_index"):
+                self.db.bless_index.get_buckets()
+            with self.phase("templates"):
+                for bless_id, _, _, text in self.db.select_all_blesses():
+                    try:
+                        self.db.templates.compile(bless_id, text)
+                    except ValueError as e:
+                        logger.warning(f"Bless {bless_id} is not a valid template: {e}")
+            with self.phase("forecast"):
+                self.forecast.refresh()
+        except Exception as e:
+            # Everything warmed here is also loaded lazily, so the server can still serve
+            logger.error(f"Warm-up failed: {e}")
+        self.ready = True
+        logger.info(f"Server ready, startup phases: {self.phases}")
+
+    @asynccontextmanager
+    async def lifespan(self, app):
+        await run_in_threadpool(self.initialize)
+        threading.Thread(target=self.warm_up, name="warm-up", daemon=True).start()
+        await run_in_threadpool(self.db.changes.start)
+        self.deliveries.start()
+        self.leader.start()
+        yield
+        await run_in_threadpool(self.leader.stop)
+        await run_in_threadpool(self.deliveries.stop)
+        await run_in_threadpool(self.db.changes.stop)
+
+    def on_elected(self):
+        # Claims older than the claim timeout belong to a worker that is gone
+        self.outbox.recover()
+        self.dispatcher.start()
+
     def start(self):
-        uvicorn.run(self.app, host="0.0.0.0", port=8082)
\ No newline at end of file
+        import uvicorn
+        if self.workers > 1:
+            uvicorn.run("server:create_app", factory=True, workers=self.workers, host="0.0.0.0", port=8082)
+        else:
+            # Nothing else is running yet, so every claim still in sending state is orphaned
+            self.recover_all_claims = True
+            uvicorn.run(self.app, host="0.0.0.0", port=8082)
+
+
+def create_app():
+    return Server().app
@@ -1,132 +1,453 @@
-from loguru import logger
+import os
+import re
+import time
 import sqlite3
+import tempfile
+from loguru import logger
+from contextlib import contextmanager
+from connectionpool import ConnectionPool
+from blessindex import BlessIndex
+from blesstemplates import BlessTemplates
+from cache import ReadThroughCache
+from changefeed import ChangeFeed
+from instrumentation import QueryMetrics, is_lock_error
+from migrations import run_migrations, register_functions, fold_text, MIGRATIONS
+
+PERSON_COLUMNS = 'PersonId, FirstName, LastName, BirthDate, GenderId, LanguageId, PhoneNumber, PreferredHour, Intro, TimeZone'
+BLESS_COLUMNS = 'BlessId, GenderId, LanguageId, Bless'
+SESSION_COLUMNS = 'SessionId, Name, WhatsappApiUrl, WhatsappApiToken, WhatsappApiSessionName, RateLimit, Enabled'
+# /stats dimensions and their DeliveryStats columns
+STATS_DIMENSIONS = {'day': 'Day', 'language': 'LanguageId', 'gender': 'GenderId', 'session': 'Session', 'status': 'Status'}
+MIGRATION_BUSY_TIMEOUT = 300000
+# Pages copied per backup step, 4MB with the default page size
+BACKUP_STEP_PAGES = 1024
+REQUIRED_TABLES = ('Languages', 'Genders', 'Blesses', 'Persons', 'Configuration')
+PHONE_QUERY = re.compile(r'^\+?[\d\s()-]+$')
+# Read-through cache names of the tables they hold
+CACHED_TABLES = {'Languages': 'languages', 'Genders': 'genders', 'Configuration': 'configuration', 'Sessions': 'sessions'}
+# The search triggers index raw text; these fold what the connector wrote, by rowid, where folding changes anything
+SEARCH_FOLDING = {
+    'Persons': ['''UPDATE PersonsSearch SET FirstName = fold(FirstName), LastName = fold(LastName), PhoneNumber = fold(PhoneNumber), Intro = fold(Intro)
+                   WHERE rowid = ? AND (FirstName IS NOT fold(FirstName) OR LastName IS NOT fold(LastName)
+                                        OR PhoneNumber IS NOT fold(PhoneNumber) OR Intro IS NOT fold(Intro))''',
+                'UPDATE PhonesSearch SET PhoneNumber = digits(PhoneNumber) WHERE rowid = ? AND PhoneNumber IS NOT digits(PhoneNumber)'],
+    'Blesses': ['UPDATE BlessesSearch SET Bless = fold(Bless) WHERE rowid = ? AND Bless IS NOT fold(Bless)'],
+}
+# Per-row insert triggers a bulk load replaces with set based statements
+BULK_LOAD_TRIGGERS = {'Persons': ('TR_Persons_Insert', 'TR_PersonsSearch_Insert'), 'Blesses': ('TR_BlessesSearch_Insert',)}
+# Person matches ranked per search; the rest of a very common prefix is never read
+SEARCH_CANDIDATES = int(os.getenv("SEARCH_CANDIDATES", 200))
+
+
+def match_query(text):
+    # Every word becomes a quoted term, so user input is never parsed as FTS5 syntax.
+    # Folded like the indexed text, so pointed and unpointed Hebrew match either way.
+    # Only the word still being typed is a prefix: FTS5 merges the doclists of every term a prefix longer
+    # than the prefix indexes covers, while whole words are read only as far as the LIMIT.
+    # Single characters are skipped: the prefix indexes start at 2, a 1 character prefix would scan every term.
+    words = [word.replace('"', '""') for word in fold_text(text).split() if len(word) >= 2]
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    if not text[-1].isspace():
+        terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def like_pattern(text):
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def name_score(text):
+    # Per searched word, 2 points for a whole first or last name and 1 for a name prefix;
+    # words found only in the intro or inside a name score nothing
+    words = [like_pattern(word) for word in fold_text(text).split() if len(word) >= 2]
+    terms, params = [], []
+    for word in words:
+        for column in ('FirstName', 'LastName'):
+            terms.append(f"(fold(Persons.{column}) LIKE ? ESCAPE '\\') + (fold(Persons.{column}) LIKE ? ESCAPE '\\')")
+            params += [word, word + '%']
+    return ' + '.join(terms), params
+
+
+def phone_score(digits):
+    # The whole number first, then numbers starting or ending with the digits
+    score = "2 * (digits(Persons.PhoneNumber) = ?) + (digits(Persons.PhoneNumber) LIKE ? OR digits(Persons.PhoneNumber) LIKE ?)"
+    return score, [digits, digits + '%', '%' + digits]
 
 class SqliteConnector:
-    def __init__(self):
-        self.db_path = "db/data.db"
-        self.conn = None
-    # Connect to the SQLite database
-    def open_connection(self):
-        if self.conn is None:
+    def __init__(self, db_path=None, pool_size=None, **pragmas):
+        self.db_path = db_path or os.getenv("DB_PATH", "db/data.db")
+        self.pool = ConnectionPool(self.db_path, pool_size=pool_size, **pragmas)
+        # fold() and digits() normalize the search text the connector writes
+        self.pool.on_connect = register_functions
+        self.metrics = QueryMetrics()
+        if self.metrics.enabled:
+            self.pool.acquire_observer = self.metrics.observe_acquire
+        # Single statement writes are retried this many times when they find the database locked
+        self.lock_retries = int(os.getenv("DB_LOCK_RETRIES", 2))
+        self.bless_index = BlessIndex(self)
+        self.templates = BlessTemplates()
+        self.cache = ReadThroughCache()
+        self.columns = {}
+        self.changes = ChangeFeed(self)
+        self.changes.listeners.append(self.apply_changes)
+        # Callbacks taking a list of changed PersonIds, or None when every person may have changed
+        self.person_listeners = []
+
+    # Run a unit of work on a pooled connection, committing on success
+    @contextmanager
+    def transaction(self):
+        with self.pool.connection() as conn:
             try:
-                self.conn = sqlite3.connect(self.db_path)
-                logger.info("Connection opened successfully.")
-            except sqlite3.Error as e:
-                logger.error(f"Error connecting to database: {e}")
-        else:
-            logger.debug("Connection is already open.")
-
-
-    def close_connection(self):
-        if self.conn is not None:
-            self.conn.close()
-            self.conn = None
-            logger.info("Connection closed.")
-        else:
-            logger.info("No connection to close.")
-
+                yield conn
+                self.metrics.commit(conn)
+            except Exception:
+                conn.rollback()
+                raise
+
+    def close(self):
+        self.pool.close_all()
+
+    def fold_search(self, conn, table, ids):
+        for statement in SEARCH_FOLDING.get(table, ()):
+            conn.executemany(statement, [(row_id,) for row_id in ids])
+
+    # Drops the table's per-row insert triggers for a bulk load and recreates them before it commits. Other
+    # connections never see them missing, and a failed load gets them back with its rollback.
+    @contextmanager
+    def insert_triggers_dropped(self, conn, table):
+        if not conn.in_transaction:
+            conn.execute('BEGIN IMMEDIATE')
+        names = BULK_LOAD_TRIGGERS[table]
+        triggers = conn.execute(f"SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND name IN ({', '.join('?' * len(names))})",
+                                names).fetchall()
+        for name, _ in triggers:
+            conn.execute(f'DROP TRIGGER {name}')
+        yield
+        for _, sql in triggers:
+            conn.execute(sql)
+
+    def notify_persons_changed(self, person_ids):
+        for listener in self.person_listeners:
+            try:
+                listener(person_ids)
+            except Exception as e:
+                logger.error(f"Person listener failed: {e}")
+
+    # Writes of this process invalidate its caches right away, those of other worker processes once the change feed syncs them
+    def apply_changes(self, changes):
+        names = set()
+        # Changed BlessIds, None when any bless may have changed
+        bless_ids = set()
+        blesses = False
+        for change in changes:
+            if change["op"] == 'reset':
+                names.update(CACHED_TABLES.values())
+                blesses, bless_ids = True, None
+            elif change["table"] in CACHED_TABLES:
+                names.add(CACHED_TABLES[change["table"]])
+            elif change["table"] == 'Blesses':
+                blesses = True
+                if change["ids"] is None:
+                    bless_ids = None
+                elif bless_ids is not None:
+                    bless_ids.update(change["ids"])
+        for name in names:
+            self.cache.invalidate(name)
+        if blesses:
+            if bless_ids is None:
+                self.templates.clear()
+            else:
+                for bless_id in bless_ids:
+                    self.templates.evict(bless_id)
+            self.bless_index.invalidate()
+
+    # Online snapshot through the SQLite backup API into a temporary file next to the database, which the caller
+    # removes. Memory stays flat whatever the database size, at the cost of as much free disk space. The read
+    # transaction pins one WAL snapshot across the steps, so concurrent writes neither restart the copy nor block.
+    def snapshot(self):
+        fd, path = tempfile.mkstemp(dir=os.path.dirname(self.db_path) or ".", suffix=".snapshot")
+        os.close(fd)
+        try:
+            target = sqlite3.connect(path)
+            try:
+                with self.pool.connection() as conn:
+                    conn.execute("BEGIN")
+                    try:
+                        conn.execute("SELECT count(*) FROM sqlite_master").fetchone()
+                        conn.backup(target, pages=BACKUP_STEP_PAGES, sleep=0)
+                    finally:
+                        conn.rollback()
+            finally:
+                target.close()
+        except Exception:
+            os.remove(path)
+            raise
+        return path
+
+    @staticmethod
+    def verify_database(path):
+        conn = sqlite3.connect(path)
+        try:
+            # Leave the candidate in rollback journal mode so no -wal/-shm files follow it around
+            conn.execute("PRAGMA journal_mode=DELETE")
+            result = conn.execute("PRAGMA integrity_check").fetchone()[0]
+            if result != "ok":
+                raise sqlite3.DatabaseError(f"Integrity check failed: {result}")
+            tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            missing = set(REQUIRED_TABLES) - tables
+            if missing:
+                raise sqlite3.DatabaseError(f"Missing tables: {', '.join(sorted(missing))}")
+        finally:
+            conn.close()
 
-    # Create tables
-    def create_tables(self):
+    # Brings a candidate file up to the current schema, a failure leaves the live database untouched
+    @staticmethod
+    def migrate_database(path):
+        conn = sqlite3.connect(path)
         try:
-            self.open_connection()
-            cursor = self.conn.cursor()
-            cursor.execute('''
-                        CREATE TABLE IF NOT EXISTS Languages (
-                            LanguageId INTEGER PRIMARY KEY AUTOINCREMENT,
-                            Language TEXT NOT NULL UNIQUE)
-                        ''')
-
-            cursor.execute('''
-                        CREATE TABLE IF NOT EXISTS Genders (
-                            GenderId INTEGER PRIMARY KEY AUTOINCREMENT,
-                            Gender TEXT NOT NULL UNIQUE)
-                            ''')
-
-            cursor.execute('''
-                        CREATE TABLE IF NOT EXISTS Blesses (
-                            BlessId INTEGER PRIMARY KEY AUTOINCREMENT,
-                            GenderId INTEGER,
-                            LanguageId INTEGER,
-                            Bless TEXT NOT NULL,
-                            FOREIGN KEY(GenderId) REFERENCES Genders(GenderId),
-                            FOREIGN KEY(LanguageId) REFERENCES Languages(LanguageId))
-                            ''')
-
-            cursor.execute('''
-                        CREATE TABLE IF NOT EXISTS Persons (
-                            PersonId INTEGER PRIMARY KEY AUTOINCREMENT,
-                            FirstName TEXT NOT NULL,
-                            LastName TEXT NOT NULL,
-                            BirthDate DATE NOT NULL,
-                            GenderId INTEGER,
-                            LanguageId INTEGER,
-                            PhoneNumber TEXT NOT NULL,
-                            PreferredHour INTEGER NOT NULL,
-                            Intro TEXT NOT NULL,
-                            FOREIGN KEY(GenderId) REFERENCES Genders(GenderId),
-                            FOREIGN KEY(LanguageId) REFERENCES Languages(LanguageId))
-                            ''')
-            
-            cursor.execute('''
-                        CREATE TABLE IF NOT EXISTS Configuration (
-                        ConfigId INTEGER PRIMARY KEY CHECK (ConfigId = 1),
-                        WhatsappApiUrl TEXT NOT NULL,
-                        WhatsappApiToken TEXT NOT NULL,
-                        WhatsappApiSessionName TEXT NOT NULL)
-                        ''')
-            
-            self.conn.commit()
-            self.close_connection()
-            logger.info("Tables created successfully")
-        except sqlite3.Error as e:
-            logger.error(str(e))
-
-    def execute_query(self, query, params=(),is_insert=False):
-        self.open_connection()
-        cursor = self.conn.cursor()
-        cursor.execute(query, params)
-        self.conn.commit()
-        if is_insert:
-            lastrowid = cursor.lastrowid
-            self.close_connection()
-            return lastrowid
-        self.close_connection()
+            run_migrations(conn)
+        finally:
+            conn.close()
+
+    # Swaps a verified, migrated database file in place of the live one while the pool is drained
+    def restore(self, path):
+        self.verify_database(path)
+        self.migrate_database(path)
+        with self.pool.drained():
+            conn = sqlite3.connect(self.db_path)
+            try:
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            finally:
+                conn.close()
+            for suffix in ("-wal", "-shm"):
+                if os.path.exists(self.db_path + suffix):
+                    os.remove(self.db_path + suffix)
+            os.replace(path, self.db_path)
+        self.bless_index.invalidate()
+        self.cache.clear()
+        self.notify_persons_changed(None)
+        # Sequences of the old file mean nothing here: every client takes a new snapshot
+        self.changes.reset()
+        with self.transaction() as conn:
+            for table in ('Languages', 'Genders', 'Blesses', 'Persons', 'Configuration', 'Sessions'):
+                self.changes.record(conn, table, 'reset')
+        self.changes.refresh()
+        logger.info("Database restored successfully.")
+
+
+    # Create tables and bring the schema up to date. A failed migration is raised: serving on a half-migrated schema is worse than not starting
+    def create_tables(self):
+        with self.pool.connection() as conn:
+            # Workers starting together queue up behind whichever one is migrating
+            conn.execute(f"PRAGMA busy_timeout = {MIGRATION_BUSY_TIMEOUT}")
+            try:
+                applied = run_migrations(conn)
+            finally:
+                conn.execute(f"PRAGMA busy_timeout = {self.pool.busy_timeout}")
+        logger.info(f"Schema at version {MIGRATIONS[-1][0]}, applied migrations: {applied or 'none'}")
+
+    # change is an optional (table, operation, ids) ChangeLog entry written in the same transaction,
+    # ids None on an insert standing for the new row id
+    def execute_query(self, query, params=(),is_insert=False, change=None):
+        for attempt in range(self.lock_retries + 1):
+            try:
+                with self.transaction() as conn:
+                    if self.metrics.active:
+                        started = time.perf_counter()
+                        cursor = conn.execute(query, params)
+                        self.metrics.observe(query, started)
+                    else:
+                        cursor = conn.execute(query, params)
+                    if change:
+                        table, operation, ids = change
+                        ids = [cursor.lastrowid] if ids is None and is_insert else ids
+                        self.changes.record(conn, table, operation, ids)
+                        if operation in ('insert', 'update'):
+                            self.fold_search(conn, table, ids)
+                    if is_insert:
+                        return cursor.lastrowid
+                    return
+            except sqlite3.OperationalError as e:
+                # The busy timeout does not cover every lock conflict, e.g. a WAL snapshot that went stale
+                if attempt == self.lock_retries or not is_lock_error(e):
+                    raise
+                self.metrics.retried(query, e)
+                time.sleep(0.05 * 2 ** attempt)
+
+    def fetch_all(self, query, params=(), api_call=False):
+        if api_call == True:
+            columns, rows = self.fetch_columns(query, params)
+            return [dict(zip(columns, row)) for row in rows]
+        with self.pool.connection() as conn:
+            if self.metrics.active:
+                started = time.perf_counter()
+                cursor = conn.execute(query, params)
+                rows = cursor.fetchall()
+                self.metrics.observe(query, started, len(rows))
+            else:
+                cursor = conn.execute(query, params)
+                rows = cursor.fetchall()
+            cursor.close()
+            return rows
+
+    # Plain row tuples plus the column names, which are resolved once per distinct query
+    def fetch_columns(self, query, params=()):
+        with self.pool.connection() as conn:
+            if self.metrics.active:
+                started = time.perf_counter()
+                cursor = conn.execute(query, params)
+                rows = cursor.fetchall()
+                self.metrics.observe(query, started, len(rows))
+            else:
+                cursor = conn.execute(query, params)
+                rows = cursor.fetchall()
+            columns = self.columns.get(query)
+            if columns is None:
+                columns = self.columns[query] = tuple(column[0] for column in cursor.description)
+            cursor.close()
+            return columns, rows
+
+    # Yields a keyset paginated listing as dicts, one page query at a time. The pooled connection and its
+    # read transaction are released between pages, so a slow client neither pins a connection nor holds
+    # back WAL checkpoints; the listing is consistent per page only. The id must be the first column.
+    def iter_pages(self, table, columns, id_column, after_id=None, batch_size=1000, **filters):
+        while True:
+            query, params = self.build_list_query(table, columns, id_column, after_id, batch_size, **filters)
+            names, rows = self.fetch_columns(query, params)
+            for row in rows:
+                yield dict(zip(names, row))
+            if len(rows) < batch_size:
+                return
+            after_id = rows[-1][0]
+
+    # Keyset pagination: rows after the given id, ordered by id, with optional equality filters
+    def build_list_query(self, table, columns, id_column, after_id=None, limit=None, **filters):
+        clauses = []
+        params = []
+        if after_id is not None:
+            clauses.append(f'{id_column} > ?')
+            params.append(after_id)
+        for column, value in filters.items():
+            if value is not None:
+                clauses.append(f'{column} = ?')
+                params.append(value)
+        query = f'SELECT {columns} FROM {table}'
+        if clauses:
+            query += ' WHERE ' + ' AND '.join(clauses)
+        query += f' ORDER BY {id_column}'
+        if limit is not None:
+            query += ' LIMIT ?'
+            params.append(limit)
+        return query, params
             
 
     # Inserts
     def insert_language(self, language):
         query = 'INSERT INTO Languages (Language) VALUES (?)'
-        return self.execute_query(query, (language,),True)
+        row_id = self.execute_query(query, (language,),True, change=('Languages', 'insert', None))
+        self.cache.invalidate('languages')
+        self.changes.refresh()
+        return row_id
 
     def insert_gender(self, gender):
         query = 'INSERT INTO Genders (Gender) VALUES (?)'
-        return self.execute_query(query, (gender,),True)
+        row_id = self.execute_query(query, (gender,),True, change=('Genders', 'insert', None))
+        self.cache.invalidate('genders')
+        self.changes.refresh()
+        return row_id
 
     def insert_bless(self, gender_id, language_id, bless):
+        self.templates.validate(bless)
         query = 'INSERT INTO Blesses (GenderId, LanguageId, Bless) VALUES (?, ?, ?)'
-        return self.execute_query(query, (gender_id, language_id, bless),True)
-
-    def insert_person(self, first_name, last_name, birth_date, gender_id, language_id, phone_number, preferred_hour, intro):
-        query = 'INSERT INTO Persons (FirstName, LastName, BirthDate, GenderId, LanguageId, PhoneNumber, PreferredHour, intro) VALUES (?, ?, ?, ?, ?, ?, ?, ?)'
-        return self.execute_query(query, (first_name, last_name, birth_date, gender_id, language_id, phone_number, preferred_hour, intro),True)
+        bless_id = self.execute_query(query, (gender_id, language_id, bless),True, change=('Blesses', 'insert', None))
+        self.templates.compile(bless_id, bless)
+        self.bless_index.invalidate()
+        self.changes.refresh()
+        return bless_id
+
+    def insert_person(self, first_name, last_name, birth_date, gender_id, language_id, phone_number, preferred_hour, intro, time_zone=None):
+        query = 'INSERT INTO Persons (FirstName, LastName, BirthDate, GenderId, LanguageId, PhoneNumber, PreferredHour, intro, TimeZone) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)'
+        person_id = self.execute_query(query, (first_name, last_name, birth_date, gender_id, language_id, phone_number, preferred_hour, intro, time_zone),True,
+                                      change=('Persons', 'insert', None))
+        self.notify_persons_changed([person_id])
+        self.changes.refresh()
+        return person_id
 
     def insert_configurarion(self,whatsapp_api_url, whatsapp_api_token, whatsapp_api_session_name):
         query = 'INSERT OR IGNORE INTO Configuration (ConfigId, WhatsappApiUrl, WhatsappApiToken, WhatsappApiSessionName) VALUES (1, ?, ?, ?)'''
-        return self.execute_query(query, (whatsapp_api_url, whatsapp_api_token, whatsapp_api_session_name),True)
+        row_id = self.execute_query(query, (whatsapp_api_url, whatsapp_api_token, whatsapp_api_session_name),True,
+                                   change=('Configuration', 'insert', [1]))
+        self.cache.invalidate('configuration')
+        self.changes.refresh()
+        return row_id
         
     
     
     
+    def insert_session(self, name, whatsapp_api_url, whatsapp_api_token, whatsapp_api_session_name, rate_limit=None, enabled=True):
+        query = 'INSERT INTO Sessions (Name, WhatsappApiUrl, WhatsappApiToken, WhatsappApiSessionName, RateLimit, Enabled) VALUES (?, ?, ?, ?, ?, ?)'
+        session_id = self.execute_query(query, (name, whatsapp_api_url, whatsapp_api_token, whatsapp_api_session_name, rate_limit, int(enabled)), True,
+                                        change=('Sessions', 'insert', None))
+        self.cache.invalidate('sessions')
+        self.changes.refresh()
+        return session_id
+
+    # Bulk inserts run as chunked executemany batches inside a single transaction
+    def bulk_insert_blesses(self, rows, chunk_size=5000):
+        query = 'INSERT INTO Blesses (GenderId, LanguageId, Bless) VALUES (?, ?, ?)'
+        with self.transaction() as conn, self.insert_triggers_dropped(conn, 'Blesses'):
+            for start in range(0, len(rows), chunk_size):
+                conn.executemany(query, rows[start:start + chunk_size])
+            last_id = conn.execute('SELECT last_insert_rowid()').fetchone()[0]
+            if rows:
+                # One FTS statement instead of one per row, each of which would flush its own index segment
+                conn.execute('INSERT INTO BlessesSearch (rowid, Bless) SELECT BlessId, fold(Bless) FROM Blesses WHERE BlessId BETWEEN ? AND ?',
+                             (last_id - len(rows) + 1, last_id))
+                self.changes.record(conn, 'Blesses', 'insert', range(last_id - len(rows) + 1, last_id + 1))
+        if rows:
+            self.bless_index.invalidate()
+            self.changes.refresh()
+        return len(rows)
+
+    def bulk_insert_persons(self, rows, chunk_size=5000):
+        query = 'INSERT INTO Persons (FirstName, LastName, BirthDate, GenderId, LanguageId, PhoneNumber, PreferredHour, Intro, TimeZone) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)'
+        with self.transaction() as conn, self.insert_triggers_dropped(conn, 'Persons'):
+            for start in range(0, len(rows), chunk_size):
+                conn.executemany(query, rows[start:start + chunk_size])
+            last_id = conn.execute('SELECT last_insert_rowid()').fetchone()[0]
+            # A single transaction on an AUTOINCREMENT table hands out a contiguous id range.
+            # The insert triggers are dropped meanwhile, the range is indexed set based instead.
+            if rows:
+                first_id = last_id - len(rows) + 1
+                conn.execute('''
+                    INSERT INTO PersonsSearch (rowid, FirstName, LastName, PhoneNumber, Intro)
+                    SELECT PersonId, fold(FirstName), fold(LastName), fold(PhoneNumber), fold(Intro)
+                    FROM Persons WHERE PersonId BETWEEN ? AND ?''', (first_id, last_id))
+                conn.execute('INSERT INTO PhonesSearch (rowid, PhoneNumber) SELECT PersonId, digits(PhoneNumber) FROM Persons WHERE PersonId BETWEEN ? AND ?',
+                             (first_id, last_id))
+                conn.execute('INSERT INTO PersonChanges (PersonId) SELECT PersonId FROM Persons WHERE PersonId BETWEEN ? AND ?',
+                             (first_id, last_id))
+                self.changes.record(conn, 'Persons', 'insert', range(first_id, last_id + 1))
+        if rows:
+            self.notify_persons_changed(list(range(last_id - len(rows) + 1, last_id + 1)))
+            self.changes.refresh()
+        return len(rows)
+
     # Updates
 
     def update_language(self, language_id, new_language):
         query = 'UPDATE Languages SET Language = ? WHERE LanguageId = ?'
-        self.execute_query(query, (new_language, language_id))
+        self.execute_query(query, (new_language, language_id), change=('Languages', 'update', [language_id]))
+        self.cache.invalidate('languages')
+        self.changes.refresh()
 
     def update_gender(self, gender_id, new_gender):
         query = 'UPDATE Genders SET Gender = ? WHERE GenderId = ?'
-        self.execute_query(query, (new_gender, gender_id))
+        self.execute_query(query, (new_gender, gender_id), change=('Genders', 'update', [gender_id]))
+        self.cache.invalidate('genders')
+        self.changes.refresh()
 
     def update_bless(self, bless_id, gender_id=None, language_id=None, bless=None):
         query = 'UPDATE Blesses SET '
@@ -138,13 +459,19 @@ class SqliteConnector:
             query += 'LanguageId=?, '
             params.append(language_id)
         if bless:
+            self.templates.validate(bless)
             query += 'Bless=?, '
             params.append(bless)
         query = query.rstrip(', ') + ' WHERE BlessId=?'
         params.append(bless_id)
-        self.execute_query(query, params)
+        self.execute_query(query, params, change=('Blesses', 'update', [bless_id]))
+        if bless:
+            self.templates.evict(bless_id)
+            self.templates.compile(bless_id, bless)
+        self.bless_index.invalidate()
+        self.changes.refresh()
 
-    def update_person(self, person_id, first_name=None, last_name=None, birth_date=None, gender_id=None, language_id=None, phone_number=None, preferred_hour=None, intro=None):
+    def update_person(self, person_id, first_name=None, last_name=None, birth_date=None, gender_id=None, language_id=None, phone_number=None, preferred_hour=None, intro=None, time_zone=None):
         query = 'UPDATE Persons SET '
         params = []
         if first_name:
@@ -171,10 +498,71 @@ class SqliteConnector:
         if intro:
             query += 'Intro=?, '
             params.append(intro)
+        if time_zone:
+            query += 'TimeZone=?, '
+            params.append(time_zone)
         query = query.rstrip(', ') + ' WHERE PersonId=?'
         params.append(person_id)
-        self.execute_query(query, params)
-
+        self.execute_query(query, params, change=('Persons', 'update', [person_id]))
+        self.notify_persons_changed([person_id])
+        self.changes.refresh()
+
+
+    def existing_ids(self, conn, table, id_column, ids, chunk_size=500):
+        ids = list(dict.fromkeys(ids))
+        found = set()
+        for start in range(0, len(ids), chunk_size):
+            chunk = ids[start:start + chunk_size]
+            placeholders = ', '.join('?' * len(chunk))
+            found.update(row[0] for row in conn.execute(f'SELECT {id_column} FROM {table} WHERE {id_column} IN ({placeholders})', chunk))
+        return found
+
+    # rows are (id, {column: value}) pairs; rows changing the same set of columns share one prepared executemany,
+    # and every group runs in the same transaction, together with the ChangeLog entry. Returns the ids that exist.
+    def batch_update(self, table, id_column, columns, rows):
+        groups = {}
+        for row_id, changes in rows:
+            unknown = set(changes) - set(columns)
+            if unknown:
+                raise ValueError(f"Unknown {table} columns: {', '.join(sorted(unknown))}")
+            changed = tuple(column for column in columns if column in changes)
+            groups.setdefault(changed, []).append((*(changes[column] for column in changed), row_id))
+        with self.transaction() as conn:
+            found = self.existing_ids(conn, table, id_column, [row_id for row_id, _ in rows])
+            for changed, params in groups.items():
+                if changed:
+                    conn.executemany(f'UPDATE {table} SET {", ".join(f"{column} = ?" for column in changed)} WHERE {id_column} = ?', params)
+            if found:
+                self.changes.record(conn, table, 'update', sorted(found))
+                self.fold_search(conn, table, found)
+        if found:
+            self.changes.refresh()
+        return found
+
+    def update_blesses(self, rows):
+        for _, changes in rows:
+            if changes.get('Bless'):
+                self.templates.validate(changes['Bless'])
+        found = self.batch_update('Blesses', 'BlessId', BLESS_COLUMNS.split(', ')[1:], rows)
+        for bless_id, changes in rows:
+            if bless_id in found and changes.get('Bless'):
+                self.templates.evict(bless_id)
+                self.templates.compile(bless_id, changes['Bless'])
+        self.bless_index.invalidate()
+        return found
+
+    def update_persons(self, rows):
+        found = self.batch_update('Persons', 'PersonId', PERSON_COLUMNS.split(', ')[1:], rows)
+        self.notify_persons_changed(list(found))
+        return found
+
+    def update_session(self, session_id, **changes):
+        # changes maps Sessions columns to their new values
+        if 'Enabled' in changes:
+            changes['Enabled'] = int(changes['Enabled'])
+        found = self.batch_update('Sessions', 'SessionId', SESSION_COLUMNS.split(', ')[1:], [(session_id, changes)])
+        self.cache.invalidate('sessions')
+        return session_id in found
 
     def update_configuration(self, whatsapp_api_url=None, whatsapp_api_token=None, whatsapp_api_session_name=None):
         try:
@@ -194,135 +582,335 @@ class SqliteConnector:
             # Remove the trailing comma and space
             update_query = update_query[:-2]
             update_query += " WHERE ConfigId=1"
-            self.execute_query(update_query, params)
+            self.execute_query(update_query, params, change=('Configuration', 'update', [1]))
+            self.cache.invalidate('configuration')
+            self.changes.refresh()
             return {"message": "Configuration updated successfully."}
         except Exception as e:
-            self.conn.rollback()
             logger.error(f"Error updating configuration. {e}")
 
 
 
     # Deletes
     
-    def delete_language(self, language_id):
-        query = 'DELETE FROM Languages WHERE LanguageId = ?'
-        self.execute_query(query, (language_id,))
-
-    def delete_gender(self, gender_id):
-        query = 'DELETE FROM Genders WHERE GenderId = ?'
-        self.execute_query(query, (gender_id,))
+    def delete_language(self, language_id, cascade=False):
+        deleted = self.delete_lookup('Languages', 'LanguageId', language_id, cascade)
+        self.cache.invalidate('languages')
+        return deleted
+
+    def delete_gender(self, gender_id, cascade=False):
+        deleted = self.delete_lookup('Genders', 'GenderId', gender_id, cascade)
+        self.cache.invalidate('genders')
+        return deleted
+
+    # With cascade, the persons and blesses referencing the row go too, each through one set based delete on their index
+    def delete_lookup(self, table, id_column, row_id, cascade=False):
+        person_ids = []
+        bless_ids = []
+        with self.transaction() as conn:
+            conn.execute(f'DELETE FROM {table} WHERE {id_column} = ?', (row_id,))
+            if cascade:
+                conn.execute(f'DELETE FROM BlessRotation WHERE PersonId IN (SELECT PersonId FROM Persons WHERE {id_column} = ?)', (row_id,))
+                conn.execute(f'''DELETE FROM Outbox WHERE Status != 'sent'
+                                  AND PersonId IN (SELECT PersonId FROM Persons WHERE {id_column} = ?)''', (row_id,))
+                person_ids = [row[0] for row in conn.execute(f'DELETE FROM Persons WHERE {id_column} = ? RETURNING PersonId', (row_id,)).fetchall()]
+                bless_ids = [row[0] for row in conn.execute(f'DELETE FROM Blesses WHERE {id_column} = ? RETURNING BlessId', (row_id,)).fetchall()]
+            self.changes.record(conn, table, 'delete', [row_id])
+            if person_ids:
+                self.changes.record(conn, 'Persons', 'delete', person_ids)
+            if bless_ids:
+                self.changes.record(conn, 'Blesses', 'delete', bless_ids)
+        self.changes.refresh()
+        if person_ids:
+            self.notify_persons_changed(person_ids)
+        if bless_ids:
+            for bless_id in bless_ids:
+                self.templates.evict(bless_id)
+            self.bless_index.invalidate()
+        return {"persons": len(person_ids), "blesses": len(bless_ids)}
 
     def delete_bless(self, bless_id):
         query = 'DELETE FROM Blesses WHERE BlessId = ?'
-        self.execute_query(query, (bless_id,))
+        self.execute_query(query, (bless_id,), change=('Blesses', 'delete', [bless_id]))
+        self.templates.evict(bless_id)
+        self.bless_index.invalidate()
+        self.changes.refresh()
 
     def delete_person(self, person_id):
-        query = 'DELETE FROM Persons WHERE PersonId = ?'
-        self.execute_query(query, (person_id,))
+        with self.transaction() as conn:
+            conn.execute('DELETE FROM Persons WHERE PersonId = ?', (person_id,))
+            conn.execute('DELETE FROM BlessRotation WHERE PersonId = ?', (person_id,))
+            # Messages not sent yet would still go out to the deleted person's number
+            conn.execute("DELETE FROM Outbox WHERE PersonId = ? AND Status != 'sent'", (person_id,))
+            self.changes.record(conn, 'Persons', 'delete', [person_id])
+        self.notify_persons_changed([person_id])
+        self.changes.refresh()
+
+    def delete_blesses(self, bless_ids):
+        with self.transaction() as conn:
+            found = self.existing_ids(conn, 'Blesses', 'BlessId', bless_ids)
+            conn.executemany('DELETE FROM Blesses WHERE BlessId = ?', [(bless_id,) for bless_id in found])
+            if found:
+                self.changes.record(conn, 'Blesses', 'delete', sorted(found))
+        for bless_id in found:
+            self.templates.evict(bless_id)
+        self.bless_index.invalidate()
+        if found:
+            self.changes.refresh()
+        return found
+
+    def delete_persons(self, person_ids):
+        with self.transaction() as conn:
+            found = self.existing_ids(conn, 'Persons', 'PersonId', person_ids)
+            params = [(person_id,) for person_id in found]
+            conn.executemany('DELETE FROM Persons WHERE PersonId = ?', params)
+            conn.executemany('DELETE FROM BlessRotation WHERE PersonId = ?', params)
+            conn.executemany("DELETE FROM Outbox WHERE PersonId = ? AND Status != 'sent'", params)
+            if found:
+                self.changes.record(conn, 'Persons', 'delete', sorted(found))
+        self.notify_persons_changed(list(found))
+        if found:
+            self.changes.refresh()
+        return found
+
+    def delete_session(self, session_id):
+        with self.transaction() as conn:
+            found = conn.execute('DELETE FROM Sessions WHERE SessionId = ?', (session_id,)).rowcount > 0
+            if found:
+                self.changes.record(conn, 'Sessions', 'delete', [session_id])
+        if found:
+            self.cache.invalidate('sessions')
+            self.changes.refresh()
+        return found
 
     def delete_configuration(self):
         try:
-            self.execute_query("DELETE FROM Configuration WHERE ConfigId=1")
+            self.execute_query("DELETE FROM Configuration WHERE ConfigId=1", change=('Configuration', 'delete', [1]))
+            self.cache.invalidate('configuration')
+            self.changes.refresh()
             return {"message": "Configuration deleted successfully."}
         except Exception as e:
-            self.conn.rollback()
             logger.error(f"Error deleting configuration. {e}")
 
 
 
     # Selects
     
+    # Lookup tables and configuration are served from the read-through cache;
+    # the *_entry variants also expose the cached JSON body and ETag to the API
+    def select_all_languages_entry(self, api_call=False):
+        return self.cache.get('languages', api_call, lambda: self.fetch_all('SELECT LanguageId, Language FROM Languages', api_call=api_call))
+
     def select_all_languages(self, api_call=False):
-        try:
-            self.open_connection()
-            cursor = self.conn.cursor()
-            cursor.execute('SELECT LanguageId, Language FROM Languages')
-            if api_call == True:
-                rows = [dict((cursor.description[i][0], value) \
-                for i, value in enumerate(row)) for row in cursor.fetchall()]
-                cursor.close()      
-                return (rows[0] if rows else None) if False else rows
-            else:
-                rows = cursor.fetchall()
-                cursor.close()
-            return rows
-        finally:
-            self.close_connection()
-            
+        return self.select_all_languages_entry(api_call).value
+
+    def select_all_genders_entry(self, api_call=False):
+        return self.cache.get('genders', api_call, lambda: self.fetch_all('SELECT GenderId, Gender FROM Genders', api_call=api_call))
 
     def select_all_genders(self, api_call=False):
-        try:
-            self.open_connection()
-            cursor = self.conn.cursor()
-            cursor.execute('SELECT GenderId, Gender FROM Genders')
-            if api_call == True:
-                rows = [dict((cursor.description[i][0], value) \
-                for i, value in enumerate(row)) for row in cursor.fetchall()]
-                cursor.close()      
-                return (rows[0] if rows else None) if False else rows
-            else:
-                rows = cursor.fetchall()
-                cursor.close()
-            return rows
-        finally:
-            self.close_connection()
-            
-            
+        return self.select_all_genders_entry(api_call).value
+
     def select_all_blesses(self, api_call=False):
-        try:
-            self.open_connection()
-            cursor = self.conn.cursor()
-            cursor.execute('SELECT BlessId, GenderId, LanguageId, Bless FROM Blesses')
-            if api_call == True:
-                rows = [dict((cursor.description[i][0], value) \
-                for i, value in enumerate(row)) for row in cursor.fetchall()]
-                cursor.close()      
-                return (rows[0] if rows else None) if False else rows
-            else:
-                rows = cursor.fetchall()
-                cursor.close()
-            return rows
-        finally:
-            self.close_connection()
-            
+        return self.fetch_all(f'SELECT {BLESS_COLUMNS} FROM Blesses', api_call=api_call)
+
     def select_all_persons(self, api_call=False):
-        try:
-            self.open_connection()
-            cursor = self.conn.cursor()
-            cursor.execute('SELECT PersonId, FirstName, LastName, BirthDate, GenderId, LanguageId, PhoneNumber, PreferredHour, Intro FROM Persons')
-            if api_call == True:
-                rows = [dict((cursor.description[i][0], value) \
-                for i, value in enumerate(row)) for row in cursor.fetchall()]
-                cursor.close()      
-                return (rows[0] if rows else None) if False else rows
-            else:
-                rows = cursor.fetchall()
-                cursor.close()
-            return rows
-        finally:
-            self.close_connection()
+        return self.fetch_all(f'SELECT {PERSON_COLUMNS} FROM Persons', api_call=api_call)
+
+    def select_blesses_page(self, after_id=None, limit=None, gender_id=None, language_id=None, api_call=False, columnar=False):
+        query, params = self.build_list_query('Blesses', BLESS_COLUMNS, 'BlessId', after_id, limit, GenderId=gender_id, LanguageId=language_id)
+        if columnar:
+            return self.fetch_columns(query, params)
+        return self.fetch_all(query, params, api_call=api_call)
+
+    def select_persons_page(self, after_id=None, limit=None, gender_id=None, language_id=None, api_call=False, columnar=False):
+        query, params = self.build_list_query('Persons', PERSON_COLUMNS, 'PersonId', after_id, limit, GenderId=gender_id, LanguageId=language_id)
+        if columnar:
+            return self.fetch_columns(query, params)
+        return self.fetch_all(query, params, api_call=api_call)
+
+    def iter_blesses(self, after_id=None, gender_id=None, language_id=None):
+        return self.iter_pages('Blesses', BLESS_COLUMNS, 'BlessId', after_id, GenderId=gender_id, LanguageId=language_id)
+
+    def iter_persons(self, after_id=None, gender_id=None, language_id=None):
+        return self.iter_pages('Persons', PERSON_COLUMNS, 'PersonId', after_id, GenderId=gender_id, LanguageId=language_id)
+
+    def select_bless_rotation(self, person_ids, chunk_size=500):
+        rotation = {}
+        for start in range(0, len(person_ids), chunk_size):
+            chunk = person_ids[start:start + chunk_size]
+            placeholders = ', '.join('?' * len(chunk))
+            query = f'SELECT PersonId, BlessId, Year FROM BlessRotation WHERE PersonId IN ({placeholders})'
+            for person_id, bless_id, year in self.fetch_all(query, chunk):
+                rotation[person_id] = (bless_id, year)
+        return rotation
+
+    def upsert_bless_rotation(self, rows):
+        if not rows:
+            return
+        with self.transaction() as conn:
+            conn.executemany('INSERT OR REPLACE INTO BlessRotation (PersonId, BlessId, Year) VALUES (?, ?, ?)', rows)
+
+    # Outbox
+
+    def enqueue_outbox(self, rows, now):
+        # rows are (PersonId, Year, BlessId, PhoneNumber, Message); existing (PersonId, Year) rows are kept
+        query = 'INSERT OR IGNORE INTO Outbox (PersonId, Year, BlessId, PhoneNumber, Message, NextAttemptAt) VALUES (?, ?, ?, ?, ?, ?)'
+        with self.transaction() as conn:
+            before = conn.total_changes
+            conn.executemany(query, [(*row, now) for row in rows])
+            return conn.total_changes - before
+
+    def claim_outbox(self, worker_id, limit, now):
+        query = '''UPDATE Outbox SET Status = 'sending', ClaimedBy = ?, ClaimedAt = ?, Attempts = Attempts + 1
+                   WHERE OutboxId IN (SELECT OutboxId FROM Outbox WHERE Status = 'pending' AND NextAttemptAt <= ?
+                                      ORDER BY NextAttemptAt LIMIT ?)
+                   RETURNING OutboxId, PersonId, PhoneNumber, Message, Attempts'''
+        with self.transaction() as conn:
+            cursor = conn.execute(query, (worker_id, now, now, limit))
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def complete_outbox(self, worker_id, sent_ids, failures, max_attempts):
+        # failures are (OutboxId, Error, NextAttemptAt); rows out of attempts, or with no NextAttemptAt
+        # because they must not be retried, are marked failed
+        with self.transaction() as conn:
+            conn.executemany('''UPDATE Outbox SET Status = 'sent', LastError = NULL
+                                WHERE OutboxId = ? AND Status = 'sending' AND ClaimedBy = ?''',
+                             [(outbox_id, worker_id) for outbox_id in sent_ids])
+            conn.executemany('''UPDATE Outbox SET Status = CASE WHEN ?1 IS NULL OR Attempts >= ?2 THEN 'failed' ELSE 'pending' END,
+                                LastError = ?3, NextAttemptAt = coalesce(?1, NextAttemptAt), ClaimedBy = NULL
+                                WHERE OutboxId = ?4 AND Status = 'sending' AND ClaimedBy = ?5''',
+                             [(next_attempt_at, max_attempts, error, outbox_id, worker_id)
+                              for outbox_id, error, next_attempt_at in failures])
+
+    def count_due_outbox(self, now):
+        return self.fetch_all("SELECT count(*) FROM Outbox WHERE Status = 'pending' AND NextAttemptAt <= ?", (now,))[0][0]
+
+    def recover_outbox(self, claimed_before):
+        # Claims left behind by a crashed worker go back to pending
+        query = "UPDATE Outbox SET Status = 'pending', ClaimedBy = NULL WHERE Status = 'sending' AND ClaimedAt < ?"
+        with self.transaction() as conn:
+            return conn.execute(query, (claimed_before,)).rowcount
+
+    # Delivery history
+
+    def insert_deliveries(self, rows):
+        # rows are (OutboxId, PersonId, Session, Status, Attempt, Error, CreatedAt); the person's language and
+        # gender are resolved here, and the new rows are added to the daily rollups in the same transaction
+        query = '''INSERT INTO DeliveryLog (OutboxId, PersonId, LanguageId, GenderId, Session, Status, Attempt, Error, CreatedAt)
+                   VALUES (?1, ?2, (SELECT LanguageId FROM Persons WHERE PersonId = ?2), (SELECT GenderId FROM Persons WHERE PersonId = ?2),
+                           ?3, ?4, ?5, ?6, ?7)'''
+        rollup = '''INSERT INTO DeliveryStats (Day, LanguageId, GenderId, Session, Status, Count)
+                    SELECT date(CreatedAt, 'unixepoch'), coalesce(LanguageId, 0), coalesce(GenderId, 0), coalesce(Session, ''), Status, count(*)
+                    FROM DeliveryLog WHERE LogId BETWEEN ? AND ? GROUP BY 1, 2, 3, 4, 5
+                    ON CONFLICT (Day, LanguageId, GenderId, Session, Status) DO UPDATE SET Count = Count + excluded.Count'''
+        if not rows:
+            return 0
+        with self.transaction() as conn:
+            conn.executemany(query, rows)
+            # The inserts hold the write lock, so the rows just written are exactly the contiguous range ending at
+            # last_insert_rowid(); a max(LogId) read before them also counted rows another writer committed in between
+            last_id = conn.execute('SELECT last_insert_rowid()').fetchone()[0]
+            conn.execute(rollup, (last_id - len(rows) + 1, last_id))
+        return len(rows)
+
+    def prune_deliveries(self, before, chunk_size=10000):
+        # Chunked, so a large backlog never holds the write lock for long
+        pruned = 0
+        while True:
+            with self.transaction() as conn:
+                deleted = conn.execute('DELETE FROM DeliveryLog WHERE LogId IN (SELECT LogId FROM DeliveryLog WHERE CreatedAt < ? LIMIT ?)',
+                                       (before, chunk_size)).rowcount
+            pruned += deleted
+            if deleted < chunk_size:
+                return pruned
+
+    def select_delivery_stats(self, start, end, group_by=()):
+        # start and end are inclusive 'YYYY-MM-DD' UTC days; reads the rollups only
+        columns = [STATS_DIMENSIONS[name] for name in group_by]
+        query = f"SELECT {', '.join(columns + ['sum(Count) AS Count'])} FROM DeliveryStats WHERE Day BETWEEN ? AND ?"
+        if columns:
+            query += f" GROUP BY {', '.join(columns)} ORDER BY {', '.join(columns)}"
+        rows = self.fetch_all(query, (start, end), api_call=True)
+        return [row for row in rows if row['Count'] is not None]
+
+    def search(self, table, columns, content_table, id_column, match, limit, api_call=False, score=None, score_params=()):
+        if score is None:
+            # bm25 reads the doclist of every term, fine for the few blesses
+            query = f'''
+                SELECT {columns} FROM (SELECT rowid, rank FROM {table} WHERE {table} MATCH ? ORDER BY rank LIMIT ?) AS Hits
+                JOIN {content_table} ON {content_table}.{id_column} = Hits.rowid
+                ORDER BY Hits.rank'''
+            return self.fetch_all(query, (match, limit), api_call=api_call)
+        # At a million persons a common prefix matches most of them: only the first SEARCH_CANDIDATES matches,
+        # in rowid order, are read and ordered by score, FTS5 stops reading the doclists there
+        query = f'''
+            SELECT {columns} FROM (SELECT rowid FROM {table} WHERE {table} MATCH ? LIMIT ?) AS Hits
+            JOIN {content_table} ON {content_table}.{id_column} = Hits.rowid
+            ORDER BY {score} DESC, Hits.rowid
+            LIMIT ?'''
+        return self.fetch_all(query, (match, max(limit, SEARCH_CANDIDATES), *score_params, limit), api_call=api_call)
+
+    def search_persons(self, text, limit=20, api_call=False):
+        digits = re.sub(r'\D', '', text)
+        # Phone numbers match on any run of at least 3 digits, names and intros on word prefixes
+        if PHONE_QUERY.match(text.strip()) and len(digits) >= 3:
+            return self.search('PhonesSearch', PERSON_COLUMNS, 'Persons', 'PersonId', f'"{digits}"', limit, api_call,
+                               *phone_score(digits))
+        match = match_query(text)
+        if match is None:
+            return []
+        return self.search('PersonsSearch', PERSON_COLUMNS, 'Persons', 'PersonId', match, limit, api_call, *name_score(text))
+
+    def search_blesses(self, text, limit=20, api_call=False):
+        match = match_query(text)
+        if match is None:
+            return []
+        return self.search('BlessesSearch', BLESS_COLUMNS, 'Blesses', 'BlessId', match, limit, api_call)
+
+    def select_persons_by_ids(self, person_ids, api_call=False, chunk_size=500):
+        rows = []
+        for start in range(0, len(person_ids), chunk_size):
+            chunk = person_ids[start:start + chunk_size]
+            placeholders = ', '.join('?' * len(chunk))
+            rows.extend(self.fetch_all(f'SELECT {PERSON_COLUMNS} FROM Persons WHERE PersonId IN ({placeholders})', chunk, api_call=api_call))
+        return rows
+
+    # Leases
+
+    def acquire_lease(self, name, holder, now, ttl):
+        # Takes or renews the lease in one statement; succeeds only for the holder or once it expired
+        query = '''INSERT INTO Leases (Name, Holder, ExpiresAt) VALUES (?, ?, ?)
+                   ON CONFLICT(Name) DO UPDATE SET Holder = excluded.Holder, ExpiresAt = excluded.ExpiresAt
+                   WHERE Leases.Holder = excluded.Holder OR Leases.ExpiresAt < ?'''
+        with self.transaction() as conn:
+            return conn.execute(query, (name, holder, now + ttl, now)).rowcount == 1
+
+    def release_lease(self, name, holder):
+        self.execute_query('DELETE FROM Leases WHERE Name = ? AND Holder = ?', (name, holder))
+
+    def last_person_change(self):
+        return self.fetch_all('SELECT coalesce(max(Seq), 0) FROM PersonChanges')[0][0]
+
+    def person_change_version(self):
+        # Unlike max(Seq) this never goes back when the change log is pruned
+        rows = self.fetch_all("SELECT seq FROM sqlite_sequence WHERE name = 'PersonChanges'")
+        return rows[0][0] if rows else 0
+
+    def select_person_changes(self, after_seq, limit=10000):
+        return self.fetch_all('SELECT Seq, PersonId FROM PersonChanges WHERE Seq > ? ORDER BY Seq LIMIT ?', (after_seq, limit))
+
+    def prune_person_changes(self, up_to_seq):
+        self.execute_query('DELETE FROM PersonChanges WHERE Seq <= ?', (up_to_seq,))
+
+    def get_configuration_entry(self, api_call=False):
+        return self.cache.get('configuration', api_call, lambda: self.fetch_all("SELECT ConfigId, WhatsappApiUrl, WhatsappApiToken, WhatsappApiSessionName FROM Configuration WHERE ConfigId=1", api_call=api_call))
+
+    def select_sessions_entry(self, api_call=False):
+        return self.cache.get('sessions', api_call, lambda: self.fetch_all(f'SELECT {SESSION_COLUMNS} FROM Sessions ORDER BY SessionId', api_call=api_call))
+
+    def select_sessions(self, api_call=False):
+        return self.select_sessions_entry(api_call).value
 
     def get_configuration(self, api_call=False):
-        try:
-            self.open_connection()
-            cursor = self.conn.cursor()
-            cursor.execute("SELECT ConfigId, WhatsappApiUrl, WhatsappApiToken, WhatsappApiSessionName FROM Configuration WHERE ConfigId=1")
-            if api_call == True:
-                rows = [dict((cursor.description[i][0], value) \
-                for i, value in enumerate(row)) for row in cursor.fetchall()]
-                cursor.close()      
-                return (rows[0] if rows else None) if False else rows
-            else:
-                rows = cursor.fetchall()
-                cursor.close()
-            return rows
-        finally:
-            self.close_connection()
-
-
-# Example usage:
-connector = SqliteConnector()
-connector.create_tables()
-connector.select_all_persons()
-
-
+        return self.get_configuration_entry(api_call).value
@@ -0,0 +1,191 @@
+import os
+import math
+import time
+import hashlib
+import random
+import asyncio
+import threading
+import httpx
+from loguru import logger
+from prometheus_client import Histogram
+
+SEND_SECONDS = Histogram("blessed_send_seconds", "WhatsApp API request latency", ["status"],
+                         buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+
+
+class TokenBucket:
+    """Rate limiter shared by every batch, thread and event loop sending through one session.
+
+    Each acquire() reserves a token under a thread lock, going into debt when
+    the bucket is empty, and then sleeps outside the lock until its token is
+    due, so concurrent senders are served in order at the configured rate.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        # Returns the seconds to wait before the reserved token may be used
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return 0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    async def acquire(self):
+        delay = self.reserve()
+        if delay:
+            await asyncio.sleep(delay)
+
+
+class WhatsappSender:
+    """Sends text messages through the WhatsApp HTTP API.
+
+    A batch is drained by asyncio tasks sharing one keep-alive connection pool,
+    bounded by a concurrency semaphore and a token bucket, with exponential
+    backoff retries on connection errors, 429 and 5xx responses.
+    """
+
+    def __init__(self, api_url, api_token, session_name, concurrency=None, rate_limit=None, max_retries=None,
+                 backoff=None, timeout=None, transport=None, bucket=None):
+        self.api_url = api_url.rstrip("/")
+        self.api_token = api_token
+        self.session_name = session_name
+        self.concurrency = int(concurrency or os.getenv("SEND_CONCURRENCY", 32))
+        self.rate_limit = float(rate_limit or os.getenv("SEND_RATE_LIMIT", 50))
+        self.max_retries = int(max_retries if max_retries is not None else os.getenv("SEND_MAX_RETRIES", 4))
+        self.backoff = float(backoff or os.getenv("SEND_BACKOFF", 0.5))
+        self.timeout = float(timeout or os.getenv("SEND_TIMEOUT", 10))
+        # Optional httpx transport, e.g. httpx.MockTransport for offline tests and benchmarks
+        self.transport = transport
+        # One bucket for every batch sent through this session, whichever thread sends it
+        self.bucket = bucket or TokenBucket(self.rate_limit)
+
+    @classmethod
+    def from_configuration(cls, configuration, **kwargs):
+        kwargs.setdefault("rate_limit", configuration.get("RateLimit"))
+        return cls(configuration["WhatsappApiUrl"], configuration["WhatsappApiToken"],
+                   configuration["WhatsappApiSessionName"], **kwargs)
+
+    @staticmethod
+    def chat_id(phone_number):
+        return "".join(c for c in phone_number if c.isdigit()) + "@c.us"
+
+    async def send(self, client, semaphore, bucket, phone_number, text):
+        payload = {"chatId": self.chat_id(phone_number), "text": text, "session": self.session_name}
+        error = None
+        retryable = True
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                await asyncio.sleep(self.backoff * 2 ** (attempt - 1) * (1 + random.random()))
+            await bucket.acquire()
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    response = await client.post("/api/sendText", json=payload)
+                except httpx.TransportError as e:
+                    SEND_SECONDS.labels("error").observe(time.perf_counter() - started)
+                    error = str(e)
+                    continue
+                SEND_SECONDS.labels(str(response.status_code)).observe(time.perf_counter() - started)
+            if response.status_code < 300:
+                return {"PhoneNumber": phone_number, "Sent": True, "Attempts": attempt + 1}
+            error = f"HTTP {response.status_code}"
+            if response.status_code != 429 and response.status_code < 500:
+                retryable = False
+                break
+        logger.warning(f"Failed sending message to {phone_number}: {error}")
+        # Retryable failures point at the session rather than the recipient
+        return {"PhoneNumber": phone_number, "Sent": False, "Attempts": attempt + 1, "Error": error, "Retryable": retryable}
+
+    async def send_batch(self, messages):
+        # messages is an iterable of (phone_number, text) tuples
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        headers = {"X-Api-Key": self.api_token}
+        semaphore = asyncio.Semaphore(self.concurrency)
+        started = time.monotonic()
+        async with httpx.AsyncClient(base_url=self.api_url, headers=headers, limits=limits, timeout=self.timeout,
+                                     transport=self.transport) as client:
+            results = await asyncio.gather(*(self.send(client, semaphore, self.bucket, phone_number, text)
+                                             for phone_number, text in messages))
+        sent = sum(1 for result in results if result["Sent"])
+        logger.info(f"Sent {sent}/{len(results)} messages in {time.monotonic() - started:.2f}s")
+        return results
+
+    def send_batch_sync(self, messages):
+        return asyncio.run(self.send_batch(messages))
+
+
+class ShardedSender:
+    """Spreads a batch over several WhatsApp sessions.
+
+    Every phone number ranks the sessions by weighted rendezvous hashing (the
+    weight is the session rate limit), so a recipient always hears from the
+    same session while it is healthy, and adding or removing a session only
+    moves that session's recipients. Sessions send concurrently, each within
+    its own rate limit. Messages that failed with a retryable error move on to
+    the recipient's next session, and a session where nothing got through is
+    skipped for a cooldown period.
+    """
+
+    def __init__(self, senders, health=None, cooldown=None):
+        # senders maps a session name to its WhatsappSender; health maps a name to its unhealthy-until time
+        self.senders = senders
+        self.health = health if health is not None else {}
+        self.cooldown = float(cooldown or os.getenv("SESSION_COOLDOWN", 60))
+
+    @staticmethod
+    def score(name, key, weight):
+        digest = hashlib.blake2b(f"{name}:{key}".encode(), digest_size=8).digest()
+        unit = (int.from_bytes(digest, "big") + 0.5) / 2 ** 64
+        return -weight / math.log(unit)
+
+    def ranking(self, phone_number):
+        key = WhatsappSender.chat_id(phone_number)
+        return sorted(self.senders, key=lambda name: self.score(name, key, self.senders[name].rate_limit), reverse=True)
+
+    def healthy(self, now):
+        names = {name for name in self.senders if self.health.get(name, 0) <= now}
+        # With every session cooling down, trying them all beats sending nothing
+        return names or set(self.senders)
+
+    async def send_batch(self, messages):
+        messages = list(messages)
+        results = [None] * len(messages)
+        rankings = [self.ranking(phone_number) for phone_number, _ in messages]
+        healthy = self.healthy(time.monotonic())
+        pending = list(range(len(messages)))
+        tried = [set() for _ in messages]
+        while pending:
+            shards = {}
+            for index in pending:
+                name = next((name for name in rankings[index] if name in healthy and name not in tried[index]), None)
+                if name is not None:
+                    tried[index].add(name)
+                    shards.setdefault(name, []).append(index)
+            if not shards:
+                break
+            names = list(shards)
+            batches = await asyncio.gather(*(self.senders[name].send_batch([messages[index] for index in shards[name]])
+                                             for name in names))
+            pending = []
+            for name, batch in zip(names, batches):
+                failed = []
+                for index, result in zip(shards[name], batch):
+                    results[index] = {**result, "Session": name}
+                    if not result["Sent"] and result.get("Retryable"):
+                        failed.append(index)
+                if failed and len(failed) == len(batch):
+                    logger.warning(f"Session {name} failed {len(failed)} messages, skipping it for {self.cooldown:.0f}s")
+                    self.health[name] = time.monotonic() + self.cooldown
+                    healthy.discard(name)
+                pending.extend(failed)
+        return results
+
+    def send_batch_sync(self, messages):
+        return asyncio.run(self.send_batch(messages))
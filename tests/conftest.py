@@ -0,0 +1,133 @@
+import os
+import sys
+import json
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import warnings
+
+import pytest
+
+# The app modules import each other by their plain names, as when run from app/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app"))
+
+from sqliteconnector import SqliteConnector  # noqa: E402
+from server import Server  # noqa: E402
+
+with warnings.catch_warnings():
+    warnings.simplefilter("ignore")
+    from starlette.testclient import TestClient  # noqa: E402
+
+
+class StubServer(ThreadingHTTPServer):
+    # Every outbox thread opens up to SEND_CONCURRENCY connections at once
+    request_queue_size = 128
+    daemon_threads = True
+
+
+class WhatsappStub:
+    """Local stand-in for the WhatsApp HTTP API.
+
+    Every POST /api/sendText is recorded and answered after latency seconds.
+    failures maps a chat id to the statuses its next requests get, in order,
+    where 0 drops the connection without a response; later requests succeed.
+    """
+
+    def __init__(self):
+        self.latency = 0
+        self.failures = {}
+        self.requests = []
+        self.lock = threading.Lock()
+        self.server = StubServer(("127.0.0.1", 0), self.handler())
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+
+    def handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                with stub.lock:
+                    stub.requests.append({"at": time.monotonic(), "path": self.path, "key": self.headers.get("X-Api-Key"), **payload})
+                    statuses = stub.failures.get(payload["chatId"])
+                    status = statuses.pop(0) if statuses else 201
+                if stub.latency:
+                    time.sleep(stub.latency)
+                if status == 0:
+                    self.close_connection = True
+                    self.connection.shutdown(2)
+                    return
+                body = json.dumps({"id": len(stub.requests)}).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def sent_to(self, chat_id):
+        return [request for request in self.requests if request["chatId"] == chat_id]
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def whatsapp():
+    stub = WhatsappStub()
+    stub.start()
+    yield stub
+    stub.stop()
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "data.db")
+
+
+@pytest.fixture
+def db(db_path):
+    connector = SqliteConnector(db_path, pool_size=4)
+    connector.create_tables()
+    yield connector
+    connector.close()
+
+
+@pytest.fixture
+def lookups(db):
+    # (GenderId, LanguageId) of one gender and language
+    return db.insert_gender("male"), db.insert_language("english")
+
+
+@pytest.fixture
+def server(db_path, monkeypatch):
+    monkeypatch.setenv("DB_PATH", db_path)
+    monkeypatch.setenv("WORKERS", "1")
+    return Server()
+
+
+@pytest.fixture
+def client(server):
+    # Gender and language 1 exist, as most payloads refer to them
+    with TestClient(server.app) as client:
+        client.post("/genders/", json={"Gender": "male"})
+        client.post("/languages/", json={"Language": "english"})
+        yield client
+
+
+def person_row(index, gender_id, language_id, birth_date="1990-05-17", preferred_hour=9, time_zone=None):
+    # Parameters of bulk_insert_persons
+    return (f"First{index}", f"Last{index}", birth_date, gender_id, language_id, f"+972-50-{index:07d}", preferred_hour,
+            f"Intro {index}", time_zone)
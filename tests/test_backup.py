@@ -0,0 +1,50 @@
+import io
+import os
+import sqlite3
+from zipfile import ZipFile
+
+from conftest import person_row
+
+
+def leftovers(db_path):
+    return [name for name in os.listdir(os.path.dirname(db_path)) if name.endswith((".snapshot", ".upload", ".restore"))]
+
+
+def test_backup_restores_the_data_it_was_taken_from(server, client, db_path):
+    server.db.bulk_insert_persons([person_row(index, 1, 1) for index in range(1, 101)])
+    response = client.get("/backup")
+    assert response.status_code == 200
+    backup = response.content
+    with ZipFile(io.BytesIO(backup)) as zipf:
+        assert [name.endswith(".db") for name in zipf.namelist()] == [True]
+    server.db.bulk_insert_persons([person_row(index, 1, 1) for index in range(101, 151)])
+    response = client.post("/restore", files={"file": ("backup.zip", backup, "application/zip")})
+    assert response.status_code == 200
+    assert len(client.get("/persons/", params={"limit": 1000}).json()) == 100
+    # The restored file takes writes right away
+    assert client.post("/genders/", json={"Gender": "female"}).status_code == 200
+    assert leftovers(db_path) == []
+
+
+def test_restore_accepts_a_plain_database_file(server, client, tmp_path):
+    other = tmp_path / "other.db"
+    source = sqlite3.connect(server.db.db_path)
+    target = sqlite3.connect(other)
+    source.backup(target)
+    source.close()
+    target.close()
+    client.post("/genders/", json={"Gender": "female"})
+    response = client.post("/restore", files={"file": ("other.db", other.read_bytes())})
+    assert response.status_code == 200
+    assert [row["Gender"] for row in client.get("/genders/").json()] == ["male"]
+
+
+def test_restore_rejects_unusable_files_and_keeps_the_live_database(server, client, db_path, tmp_path):
+    server.db.bulk_insert_persons([person_row(index, 1, 1) for index in range(1, 11)])
+    empty = tmp_path / "empty.db"
+    sqlite3.connect(empty).execute("CREATE TABLE Unrelated (Id INTEGER)").connection.close()
+    for content in (b"not a database at all", empty.read_bytes()):
+        response = client.post("/restore", files={"file": ("backup.db", content)})
+        assert response.status_code == 400
+    assert len(client.get("/persons/").json()) == 10
+    assert leftovers(db_path) == []
@@ -0,0 +1,51 @@
+def person(index, **fields):
+    return {"FirstName": f"First{index}", "LastName": f"Last{index}", "BirthDate": "1990-05-17", "GenderId": 1,
+            "LanguageId": 1, "PhoneNumber": f"050{index:07d}", "PreferredHour": 9, "Intro": "", **fields}
+
+
+def test_patch_persons_batch(client):
+    client.post("/persons/bulk", json=[person(index) for index in range(1, 4)])
+    response = client.patch("/persons/batch", json=[{"PersonId": 1, "FirstName": "Dana"}, {"PersonId": 2, "PreferredHour": 7},
+                                                    {"PersonId": 99, "LastName": "Nobody"}, {"PersonId": 3},
+                                                    {"PersonId": 3, "Nickname": "Dani"}])
+    body = response.json()
+    assert body["updated"] == 2
+    assert body["results"] == [{"PersonId": 1, "status": "updated"}, {"PersonId": 2, "status": "updated"},
+                               {"PersonId": 99, "status": "not_found"}]
+    assert [error["index"] for error in body["errors"]] == [3, 4]
+    persons = {row["PersonId"]: row for row in client.get("/persons/").json()}
+    assert persons[1]["FirstName"] == "Dana" and persons[1]["LastName"] == "Last1"
+    assert persons[2]["PreferredHour"] == 7 and persons[3]["PreferredHour"] == 9
+
+
+def test_patch_blesses_batch_keeps_blank_csv_cells(client):
+    client.post("/blesses/bulk", json=[{"GenderId": 1, "LanguageId": 1, "Bless": "Mazal tov"}])
+    body = "BlessId,GenderId,LanguageId,Bless\n1,,,Happy birthday {{ first_name }}\n"
+    response = client.patch("/blesses/batch", content=body.encode(), headers={"content-type": "text/csv"})
+    assert response.json()["updated"] == 1
+    bless = client.get("/blesses/").json()[0]
+    assert bless == {"BlessId": 1, "GenderId": 1, "LanguageId": 1, "Bless": "Happy birthday {{ first_name }}"}
+
+
+def test_delete_persons_batch(client):
+    client.post("/persons/bulk", json=[person(index) for index in range(1, 4)])
+    response = client.request("DELETE", "/persons/batch", json=[1, 3, 42])
+    assert response.json()["deleted"] == 2
+    assert [row["PersonId"] for row in client.get("/persons/").json()] == [2]
+
+
+def test_delete_blesses_batch(client):
+    client.post("/blesses/bulk", json=[{"GenderId": 1, "LanguageId": 1, "Bless": f"Bless {index}"} for index in range(3)])
+    response = client.request("DELETE", "/blesses/batch", json=[2, 7])
+    assert response.json()["deleted"] == 1
+    assert [row["BlessId"] for row in client.get("/blesses/").json()] == [1, 3]
+
+
+def test_deleting_a_language_cascades_to_its_rows(client):
+    client.post("/languages/", json={"Language": "hebrew"})
+    client.post("/persons/bulk", json=[person(1), person(2, LanguageId=2), person(3, LanguageId=2)])
+    client.post("/blesses/bulk", json=[{"GenderId": 1, "LanguageId": 2, "Bless": "Mazal tov"}])
+    response = client.delete("/languages/2", params={"cascade": True})
+    assert response.json()["cascaded"] == {"persons": 2, "blesses": 1}
+    assert [row["PersonId"] for row in client.get("/persons/").json()] == [1]
+    assert client.get("/blesses/").json() == []
@@ -0,0 +1,47 @@
+from conftest import person_row
+
+
+def persons(db, gender_id, language_id, count):
+    db.bulk_insert_persons([person_row(index, gender_id, language_id) for index in range(1, count + 1)])
+    return db.select_persons_by_ids(list(range(1, count + 1)), True)
+
+
+def test_nobody_gets_the_same_bless_two_years_in_a_row(db, lookups):
+    for text in ("Mazal tov", "Happy birthday", "Many happy returns"):
+        db.insert_bless(*lookups, text)
+    people = persons(db, *lookups, 50)
+    last = db.bless_index.choose_for_persons(people, 2025)
+    for year in range(2026, 2031):
+        chosen = db.bless_index.choose_for_persons(people, year)
+        assert len(chosen) == 50
+        assert all(chosen[person_id][0] != last[person_id][0] for person_id in chosen)
+        last = chosen
+
+
+def test_the_same_year_keeps_the_chosen_bless(db, lookups):
+    for text in ("Mazal tov", "Happy birthday"):
+        db.insert_bless(*lookups, text)
+    people = persons(db, *lookups, 20)
+    assert db.bless_index.choose_for_persons(people, 2026) == db.bless_index.choose_for_persons(people, 2026)
+
+
+def test_a_single_bless_is_repeated_rather_than_skipped(db, lookups):
+    bless_id = db.insert_bless(*lookups, "Mazal tov")
+    people = persons(db, *lookups, 3)
+    db.bless_index.choose_for_persons(people, 2025)
+    assert {choice[0] for choice in db.bless_index.choose_for_persons(people, 2026).values()} == {bless_id}
+
+
+def test_bless_writes_invalidate_the_index(db, lookups):
+    bless_id = db.insert_bless(*lookups, "Mazal tov")
+    assert db.bless_index.choose(*lookups) == (bless_id, "Mazal tov")
+    db.update_bless(bless_id, bless="Happy birthday")
+    assert db.bless_index.choose(*lookups) == (bless_id, "Happy birthday")
+    db.delete_bless(bless_id)
+    assert db.bless_index.choose(*lookups) is None
+
+
+def test_persons_without_a_matching_bless_are_skipped(db, lookups):
+    other_language = db.insert_language("hebrew")
+    db.insert_bless(lookups[0], other_language, "Mazal tov")
+    assert db.bless_index.choose_for_persons(persons(db, *lookups, 2), 2026) == {}
@@ -0,0 +1,72 @@
+import json
+import sqlite3
+
+import pytest
+
+from conftest import person_row
+
+CSV_HEADER = "FirstName,LastName,BirthDate,GenderId,LanguageId,PhoneNumber,PreferredHour,Intro,TimeZone\n"
+
+
+def person(index, **fields):
+    return {"FirstName": f"First{index}", "LastName": f"Last{index}", "BirthDate": "1990-05-17", "GenderId": 1,
+            "LanguageId": 1, "PhoneNumber": f"050{index:07d}", "PreferredHour": 9, "Intro": "", **fields}
+
+
+def test_bulk_persons_inserts_valid_rows_and_reports_the_rest(client):
+    rows = [person(index) for index in range(1, 1001)]
+    rows[10] = {**rows[10], "GenderId": "male"}
+    rows[20] = {**rows[20], "PreferredHour": None}
+    rows.append("not an object")
+    response = client.post("/persons/bulk", json=rows)
+    assert response.status_code == 200
+    body = response.json()
+    assert body["inserted"] == 998
+    assert [error["index"] for error in body["errors"]] == [10, 20, 1000]
+    assert body["errors"][1]["errors"][0]["msg"] == "Missing required fields: PreferredHour"
+    assert len(client.get("/persons/", params={"limit": 10000}).json()) == 998
+
+
+def test_bulk_persons_accepts_csv_bodies_and_uploads(client):
+    body = CSV_HEADER + "Dana,Levi,1991-02-03,1,1,0501111111,8,,\nOmer,Cohen,1992-03-04,1,1,0502222222,10,Hi,Asia/Jerusalem\n"
+    response = client.post("/persons/bulk", content=body.encode(), headers={"content-type": "text/csv"})
+    assert response.json() == {"inserted": 2, "errors": []}
+    response = client.post("/persons/bulk", files={"file": ("persons.csv", body.encode(), "text/csv")})
+    assert response.json() == {"inserted": 2, "errors": []}
+    upload = json.dumps([person(1)]).encode()
+    response = client.post("/persons/bulk", files={"file": ("persons.json", upload, "application/json")})
+    assert response.json() == {"inserted": 1, "errors": []}
+
+
+@pytest.mark.parametrize("content, detail", [
+    (b"{not json", "Unable to parse payload"),
+    (b'{"FirstName": "Dana"}', "Expected a JSON array of rows"),
+])
+def test_bulk_rejects_unusable_payloads(client, content, detail):
+    response = client.post("/persons/bulk", content=content, headers={"content-type": "application/json"})
+    assert response.status_code == 400
+    assert response.json()["detail"].startswith(detail)
+
+
+def test_bulk_blesses_reports_invalid_rows(client):
+    rows = [{"GenderId": 1, "LanguageId": 1, "Bless": "Mazal tov"}, {"GenderId": 1, "Bless": "Happy birthday"}]
+    body = client.post("/blesses/bulk", json=rows).json()
+    assert body["inserted"] == 1 and [error["index"] for error in body["errors"]] == [1]
+
+
+def bless_row(index, gender_id, language_id):
+    return gender_id, language_id, f"Bless {index}"
+
+
+@pytest.mark.parametrize("insert, table, make_row, bad_row", [
+    ("bulk_insert_persons", "Persons", person_row, ("Dana", None, "1990-05-17", 1, 1, "0501111111", 9, "", None)),
+    ("bulk_insert_blesses", "Blesses", bless_row, (1, 1, None)),
+])
+def test_bulk_inserts_span_several_chunks_in_one_transaction(db, lookups, insert, table, make_row, bad_row):
+    assert getattr(db, insert)([make_row(index, *lookups) for index in range(1, 12)], chunk_size=5) == 11
+    assert db.fetch_all(f"SELECT count(*) FROM {table}") == [(11,)]
+    assert getattr(db, insert)([], chunk_size=5) == 0
+    # A failing row rolls back the chunks before it as well
+    with pytest.raises(sqlite3.IntegrityError):
+        getattr(db, insert)([make_row(index, *lookups) for index in range(12, 20)] + [bad_row], chunk_size=5)
+    assert db.fetch_all(f"SELECT count(*) FROM {table}") == [(11,)]
@@ -0,0 +1,65 @@
+import threading
+
+import pytest
+
+from cache import ReadThroughCache
+
+
+def test_unchanged_lookups_answer_304(client):
+    response = client.get("/genders/")
+    etag = response.headers["ETag"]
+    assert response.json() == [{"GenderId": 1, "Gender": "male"}]
+    assert client.get("/genders/", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get("/genders/", headers={"If-None-Match": f'"other", {etag}'}).status_code == 304
+    assert client.get("/genders/", headers={"If-None-Match": "*"}).status_code == 304
+    assert client.get("/genders/", headers={"If-None-Match": '"other"'}).status_code == 200
+
+
+@pytest.mark.parametrize("path, write", [
+    ("/genders/", lambda client: client.put("/genders/1", json={"Gender": "female"})),
+    ("/languages/", lambda client: client.post("/languages/", json={"Language": "hebrew"})),
+    ("/configuration/", lambda client: client.post("/configuration/", json={
+        "WhatsappApiUrl": "http://localhost", "WhatsappApiToken": "token", "WhatsappApiSessionName": "default"})),
+])
+def test_writes_change_the_etag(client, path, write):
+    before = client.get(path)
+    assert write(client).status_code == 200
+    after = client.get(path, headers={"If-None-Match": before.headers["ETag"]})
+    assert after.status_code == 200
+    assert after.headers["ETag"] != before.headers["ETag"] and after.json() != before.json()
+
+
+def test_cache_loads_once_until_invalidated():
+    cache = ReadThroughCache()
+    loads = []
+
+    def loader():
+        loads.append(1)
+        return [len(loads)]
+
+    assert cache.get("genders", True, loader).value == [1]
+    assert cache.get("genders", True, loader).value == [1]
+    cache.invalidate("languages")
+    assert cache.get("genders", True, loader).value == [1]
+    cache.invalidate("genders")
+    assert cache.get("genders", True, loader).value == [2]
+    cache.clear()
+    assert cache.get("genders", True, loader).value == [3]
+
+
+def test_a_load_racing_an_invalidation_is_not_stored():
+    cache = ReadThroughCache()
+    loading, invalidated = threading.Event(), threading.Event()
+
+    def stale_loader():
+        loading.set()
+        invalidated.wait(1)
+        return ["stale"]
+
+    thread = threading.Thread(target=cache.get, args=("genders", True, stale_loader))
+    thread.start()
+    loading.wait(1)
+    cache.invalidate("genders")
+    invalidated.set()
+    thread.join()
+    assert cache.get("genders", True, lambda: ["fresh"]).value == ["fresh"]
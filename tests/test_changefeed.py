@@ -0,0 +1,100 @@
+import time
+import asyncio
+import threading
+
+from changefeed import ChangeFeed
+from sqliteconnector import SqliteConnector
+
+
+class Request:
+    # Stands in for a client that disconnects after a number of checks
+    def __init__(self, checks):
+        self.checks = checks
+
+    async def is_disconnected(self):
+        self.checks -= 1
+        return self.checks < 0
+
+
+def events(server, after, checks):
+    async def collect():
+        return [event async for event in server.change_events(Request(checks), after)]
+    return asyncio.run(collect())
+
+
+def test_clients_resume_after_their_last_seq(db):
+    start = db.changes.sync()
+    db.insert_gender("male")
+    db.insert_language("english")
+    changes, reset = db.changes.since(start)
+    assert not reset
+    assert [(change["table"], change["op"]) for change in changes] == [("Genders", "insert"), ("Languages", "insert")]
+    changes, reset = db.changes.since(changes[0]["seq"])
+    assert [change["table"] for change in changes] == ["Languages"] and not reset
+    assert db.changes.since(db.changes.last_seq) == ([], False)
+
+
+def test_clients_that_fell_off_the_ring_reset(db):
+    feed = ChangeFeed(db, size=3)
+    start = feed.sync()
+    for index in range(5):
+        db.insert_gender(f"gender {index}")
+    feed.sync()
+    assert [change["seq"] for change in feed.ring] == [start + 3, start + 4, start + 5]
+    assert feed.since(start) == ([], True)
+    assert feed.since(start + 2)[1] is False
+    # A sequence this worker has not seen yet is not in the ring either
+    assert feed.since(start + 99) == ([], True)
+
+
+def test_since_does_not_wait_for_a_sync(db_path):
+    db = SqliteConnector(db_path, pool_size=1, timeout=5)
+    db.create_tables()
+    db.changes.sync()
+    db.insert_gender("male")
+    released = threading.Event()
+
+    def hold_connection():
+        with db.pool.connection():
+            released.wait(5)
+
+    holder = threading.Thread(target=hold_connection)
+    holder.start()
+    time.sleep(0.05)
+    syncing = threading.Thread(target=db.changes.sync)
+    syncing.start()
+    time.sleep(0.05)
+    # The sync waits for the pool; clients on the event loop still read the ring
+    started = time.monotonic()
+    db.changes.since(0)
+    assert time.monotonic() - started < 0.1
+    released.set()
+    holder.join()
+    syncing.join()
+    assert [change["table"] for change in db.changes.ring][-1] == "Genders"
+    db.close()
+
+
+def test_long_poll_resumes_from_last_event_id(client):
+    seq = client.get("/changes").json()["seq"]
+    client.post("/genders/", json={"Gender": "female"})
+    body = client.get("/changes", params={"timeout": 0}, headers={"Last-Event-ID": str(seq)}).json()
+    assert not body["reset"] and [change["table"] for change in body["changes"]] == ["Genders"]
+    assert body["seq"] == body["changes"][-1]["seq"]
+
+
+def test_event_stream_resumes_after_the_last_event_id(server, client):
+    seq = client.get("/changes").json()["seq"]
+    client.post("/genders/", json={"Gender": "female"})
+    client.post("/languages/", json={"Language": "hebrew"})
+    stream = events(server, seq, checks=1)
+    assert [event.split("\n")[:2] for event in "".join(stream).split("\n\n") if event] == [
+        [f"id: {seq + 1}", "event: change"], [f"id: {seq + 2}", "event: change"]]
+
+
+def test_event_stream_without_a_position_starts_with_a_reset(server, client):
+    seq = client.get("/changes").json()["seq"]
+    assert events(server, None, checks=0) == [f"retry: 3000\nevent: reset\nid: {seq}\ndata: {seq}\n\n"]
+    # An id the ring no longer holds is answered with a reset to the current seq
+    server.db.changes.ring.clear()
+    assert events(server, seq + 50, checks=1)[0] == f"event: reset\nid: {seq}\ndata: {seq}\n\n"
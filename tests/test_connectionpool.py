@@ -0,0 +1,112 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from connectionpool import ConnectionPool
+
+
+@pytest.fixture
+def pool(db_path):
+    pool = ConnectionPool(db_path, pool_size=2, timeout=0.5)
+    yield pool
+    pool.close_all()
+
+
+def test_connections_are_reused(pool):
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        assert second is first
+    assert pool._created == 1
+
+
+def test_connections_are_configured(pool):
+    connected = []
+    pool.on_connect = connected.append
+    with pool.connection() as conn:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert conn.execute("PRAGMA busy_timeout").fetchone()[0] == pool.busy_timeout
+    assert connected == [conn]
+
+
+def test_concurrent_checkouts_get_distinct_connections(pool):
+    with pool.connection() as first, pool.connection() as second:
+        assert first is not second
+        assert pool._created == 2
+
+
+def test_exhausted_pool_times_out(pool):
+    with pool.connection(), pool.connection():
+        started = time.monotonic()
+        with pytest.raises(sqlite3.OperationalError, match="Timed out"):
+            pool.acquire()
+        assert time.monotonic() - started >= pool.timeout
+
+
+def test_released_connection_wakes_a_waiter(pool):
+    acquired = []
+    first = pool.acquire()
+    second = pool.acquire()
+
+    def wait():
+        with pool.connection() as conn:
+            acquired.append(conn)
+
+    thread = threading.Thread(target=wait)
+    thread.start()
+    time.sleep(0.05)
+    assert not acquired
+    pool.release(first)
+    thread.join(timeout=1)
+    pool.release(second)
+    assert acquired == [first]
+
+
+def test_release_rolls_back_an_open_transaction(pool):
+    with pool.connection() as conn:
+        conn.execute("CREATE TABLE Items (Id INTEGER PRIMARY KEY)")
+    with pool.connection() as conn:
+        conn.execute("INSERT INTO Items DEFAULT VALUES")
+        assert conn.in_transaction
+    with pool.connection() as conn:
+        assert not conn.in_transaction
+        assert conn.execute("SELECT count(*) FROM Items").fetchone()[0] == 0
+
+
+def test_close_all_retires_connections_still_checked_out(pool):
+    conn = pool.acquire()
+    pool.close_all()
+    pool.release(conn)
+    assert pool._created == 0
+    with pytest.raises(sqlite3.ProgrammingError):
+        conn.execute("SELECT 1")
+    with pool.connection() as fresh:
+        assert fresh is not conn
+
+
+def test_drained_waits_for_work_in_flight_and_blocks_checkouts(pool):
+    events = []
+    busy = pool.acquire()
+
+    def finish():
+        time.sleep(0.1)
+        events.append("released")
+        pool.release(busy)
+
+    def checkout():
+        with pool.connection():
+            events.append("checked out")
+
+    releaser = threading.Thread(target=finish)
+    releaser.start()
+    with pool.drained():
+        events.append("drained")
+        waiter = threading.Thread(target=checkout)
+        waiter.start()
+        time.sleep(0.05)
+        assert "checked out" not in events
+    waiter.join(timeout=1)
+    releaser.join()
+    assert events == ["released", "drained", "checked out"]
@@ -0,0 +1,84 @@
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+from deliverylog import DeliveryLog
+from conftest import person_row
+
+
+@pytest.fixture
+def persons(db, lookups):
+    db.bulk_insert_persons([person_row(index, *lookups) for index in range(1, 4)])
+    return [{"OutboxId": index, "PersonId": index, "Attempts": 1} for index in range(1, 4)]
+
+
+def sent(session="default"):
+    return {"Sent": True, "Session": session}
+
+
+def count(db, table="DeliveryLog"):
+    return db.fetch_all(f"SELECT count(*) FROM {table}")[0][0]
+
+
+def test_attempts_are_written_once_the_batch_is_full(db, persons):
+    deliveries = DeliveryLog(db, batch_size=3)
+    deliveries.record(persons[:2], [sent(), sent()], max_attempts=3)
+    assert count(db) == 0
+    deliveries.record(persons[2:], [{"Sent": False, "Error": "timeout", "Session": "default"}], max_attempts=3)
+    assert count(db) == 3 and deliveries.buffer == []
+    assert db.fetch_all("SELECT Status, Error FROM DeliveryLog WHERE PersonId = 3") == [("retry", "timeout")]
+
+
+def test_rollups_add_up_across_flushes(db, persons):
+    deliveries = DeliveryLog(db, batch_size=1000)
+    deliveries.record(persons, [sent(), sent("second"), sent()], max_attempts=3)
+    deliveries.flush()
+    deliveries.record(persons[:1], [sent()], max_attempts=3)
+    deliveries.flush()
+    day = datetime.now(timezone.utc).date().isoformat()
+    assert db.fetch_all("SELECT Day, LanguageId, GenderId, Session, Status, Count FROM DeliveryStats ORDER BY Session") == [
+        (day, 1, 1, "default", "sent", 3), (day, 1, 1, "second", "sent", 1)]
+
+
+def test_failed_flushes_keep_the_newest_attempts(db, persons, monkeypatch):
+    deliveries = DeliveryLog(db, batch_size=1000, max_buffer=2)
+    deliveries.record(persons, [sent(), sent(), sent()], max_attempts=3)
+
+    def broken(rows):
+        raise RuntimeError("disk full")
+
+    monkeypatch.setattr(db, "insert_deliveries", broken)
+    assert deliveries.flush() == 0
+    assert [entry[1] for entry in deliveries.buffer] == [2, 3]
+    monkeypatch.undo()
+    assert deliveries.flush() == 2
+    assert count(db) == 2
+
+
+def test_prune_drops_old_attempts_and_keeps_the_rollups(db, persons):
+    old = time.time() - 100 * 86400
+    db.insert_deliveries([(1, 1, "default", "sent", 1, None, old), (2, 2, "default", "sent", 1, None, time.time())])
+    assert DeliveryLog(db, retention_days=90).prune() == 1
+    assert [row[0] for row in db.fetch_all("SELECT PersonId FROM DeliveryLog")] == [2]
+    assert db.fetch_all("SELECT sum(Count) FROM DeliveryStats")[0][0] == 2
+
+
+def test_stats_endpoint_reads_the_rollups(server, client):
+    client.post("/persons/bulk", json=[{"FirstName": "Dana", "LastName": "Levi", "BirthDate": "1990-01-02", "GenderId": 1,
+                                        "LanguageId": 1, "PhoneNumber": "0501234567", "PreferredHour": 9, "Intro": ""}])
+    first, second = (datetime(2026, 3, day, 12, tzinfo=timezone.utc).timestamp() for day in (1, 2))
+    server.db.insert_deliveries([(1, 1, "default", "sent", 1, None, first), (2, 1, "second", "failed", 1, "rejected", first),
+                                 (3, 1, "default", "sent", 1, None, second)])
+    body = client.get("/stats", params={"start": "2026-03-01", "end": "2026-03-02", "group_by": "day,status"}).json()
+    assert body["total"] == 3
+    assert body["rows"] == [{"Day": "2026-03-01", "Status": "failed", "Count": 1}, {"Day": "2026-03-01", "Status": "sent", "Count": 1},
+                            {"Day": "2026-03-02", "Status": "sent", "Count": 1}]
+    body = client.get("/stats", params={"start": "2026-03-02", "end": "2026-03-02", "group_by": "session"}).json()
+    assert body["rows"] == [{"Session": "default", "Count": 1}]
+    assert client.get("/stats", params={"start": "2026-03-01", "end": "2026-03-31", "group_by": ""}).json()["rows"] == [{"Count": 3}]
+
+
+@pytest.mark.parametrize("params", [{"group_by": "country"}, {"start": "2026-03-02", "end": "2026-03-01"}])
+def test_stats_endpoint_rejects_bad_parameters(client, params):
+    assert client.get("/stats", params=params).status_code == 400
@@ -0,0 +1,70 @@
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+import pytest
+
+from dispatcher import Dispatcher
+
+UTC = ZoneInfo("UTC")
+JERUSALEM = ZoneInfo("Asia/Jerusalem")
+
+
+def at(zone, *fields):
+    return datetime(*fields, tzinfo=zone).timestamp()
+
+
+@pytest.fixture
+def dispatcher(db):
+    return Dispatcher(db, default_zone="UTC")
+
+
+def test_fires_at_the_preferred_hour_of_the_next_birthday(dispatcher):
+    assert dispatcher.next_fire_time("1990-05-17", 9, None, at(UTC, 2026, 1, 1)) == at(UTC, 2026, 5, 17, 9)
+    # Past this year's birthday, or right at its hour, it is next year's
+    assert dispatcher.next_fire_time("1990-05-17", 9, None, at(UTC, 2026, 5, 17, 9)) == at(UTC, 2027, 5, 17, 9)
+
+
+def test_february_29_fires_on_february_28_in_common_years(dispatcher):
+    assert dispatcher.next_fire_time("2000-02-29", 8, None, at(UTC, 2026, 1, 1)) == at(UTC, 2026, 2, 28, 8)
+    assert dispatcher.next_fire_time("2000-02-29", 8, None, at(UTC, 2027, 3, 1)) == at(UTC, 2028, 2, 29, 8)
+    assert dispatcher.next_fire_time("2000-02-29", 8, None, at(UTC, 2028, 2, 28, 9)) == at(UTC, 2028, 2, 29, 8)
+
+
+def test_preferred_hour_is_local_to_the_person_zone_across_dst(dispatcher):
+    winter = dispatcher.next_fire_time("1990-01-10", 9, "Asia/Jerusalem", at(UTC, 2026, 1, 1))
+    summer = dispatcher.next_fire_time("1990-07-10", 9, "Asia/Jerusalem", at(UTC, 2026, 1, 1))
+    assert winter == at(UTC, 2026, 1, 10, 7) and summer == at(UTC, 2026, 7, 10, 6)
+    assert datetime.fromtimestamp(summer, JERUSALEM).hour == 9
+
+
+def test_the_year_is_taken_in_the_person_zone(dispatcher):
+    # Already January 1st in Auckland while still December 31st in UTC
+    after = at(UTC, 2025, 12, 31, 12)
+    assert dispatcher.next_fire_time("1990-01-01", 0, "Pacific/Auckland", after) == at(ZoneInfo("Pacific/Auckland"), 2027, 1, 1, 0)
+    assert dispatcher.next_fire_time("1990-01-01", 0, None, after) == at(UTC, 2026, 1, 1, 0)
+
+
+def test_unknown_zones_fall_back_to_the_default_zone(dispatcher):
+    after = at(UTC, 2026, 1, 1)
+    assert dispatcher.next_fire_time("1990-05-17", 9, "Mars/Olympus", after) == dispatcher.next_fire_time("1990-05-17", 9, None, after)
+
+
+@pytest.mark.parametrize("birth_date, preferred_hour", [("not a date", 9), (None, 9), ("1990-13-01", 9), ("1990-05-17", 24)])
+def test_unusable_rows_are_not_scheduled(dispatcher, birth_date, preferred_hour):
+    assert dispatcher.next_fire_time(birth_date, preferred_hour, None, at(UTC, 2026, 1, 1)) is None
+
+
+def person(**fields):
+    return {"FirstName": "Dana", "LastName": "Levi", "BirthDate": "1990-05-17", "GenderId": 1, "LanguageId": 1,
+            "PhoneNumber": "0501111111", "PreferredHour": 9, "Intro": "", **fields}
+
+
+def test_the_api_rejects_unknown_time_zones(client):
+    body = client.post("/persons/bulk", json=[person(TimeZone="Asia/Jerusalem"), person(TimeZone="Mars/Olympus")]).json()
+    assert body["inserted"] == 1 and body["errors"] == [{"index": 1, "errors": [{"loc": [], "msg": "Unknown time zone Mars/Olympus"}]}]
+    response = client.put("/persons/1", json=person(TimeZone="Mars/Olympus"))
+    assert response.status_code == 400 and response.json()["detail"] == "Unknown time zone Mars/Olympus"
+    assert client.put("/persons/1", json=person(TimeZone="Europe/London")).status_code == 200
+    body = client.patch("/persons/batch", json=[{"PersonId": 1, "TimeZone": "Mars/Olympus"}]).json()
+    assert body["updated"] == 0 and body["errors"][0]["errors"][0]["msg"] == "Unknown time zone Mars/Olympus"
+    assert client.get("/persons/").json()[0]["TimeZone"] == "Europe/London"
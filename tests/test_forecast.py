@@ -0,0 +1,87 @@
+import random
+from datetime import date, datetime
+from zoneinfo import ZoneInfo
+
+import pytest
+
+from dispatcher import Dispatcher
+from forecast import SendForecast
+from conftest import person_row
+
+UTC = ZoneInfo("UTC")
+# Whole hour offsets: the forecast does not model fractional ones
+ZONES = [None, "UTC", "Asia/Jerusalem", "America/New_York", "Asia/Tokyo", "Pacific/Auckland", "Europe/London"]
+
+
+@pytest.fixture
+def dispatcher(db):
+    return Dispatcher(db, default_zone="UTC")
+
+
+@pytest.fixture
+def forecast(db, dispatcher):
+    return SendForecast(db, dispatcher.zone_for, dispatcher.default_zone)
+
+
+def insert(db, *persons):
+    # persons are (birth_date, preferred_hour, time_zone, gender_id, language_id)
+    db.bulk_insert_persons([person_row(index, gender_id, language_id, birth_date, hour, time_zone)
+                            for index, (birth_date, hour, time_zone, gender_id, language_id) in enumerate(persons)])
+
+
+def test_birthdays_move_to_the_output_zone(db, lookups, forecast):
+    insert(db, ("1990-06-10", 3, "Asia/Tokyo", *lookups))
+    days = forecast.forecast(date(2026, 6, 9), date(2026, 6, 10))["days"]
+    # 03:00 in Tokyo is 18:00 UTC the day before
+    assert [day["total"] for day in days] == [1, 0] and days[0]["hours"][18] == 1
+    days = forecast.forecast(date(2026, 6, 9), date(2026, 6, 10), "Asia/Tokyo")["days"]
+    assert [day["total"] for day in days] == [0, 1] and days[1]["hours"][3] == 1
+
+
+def test_february_29_counts_on_february_28_in_common_years(db, lookups, forecast):
+    insert(db, ("2000-02-29", 9, None, *lookups), ("2000-02-28", 9, None, *lookups))
+    common = forecast.forecast(date(2027, 2, 28), date(2027, 3, 1))
+    assert [day["total"] for day in common["days"]] == [2, 0]
+    leap = forecast.forecast(date(2028, 2, 28), date(2028, 2, 29))
+    assert [day["total"] for day in leap["days"]] == [1, 1]
+
+
+def test_peak_hours_break_down_by_gender_and_language(db, forecast):
+    male, female = db.insert_gender("male"), db.insert_gender("female")
+    english, hebrew = db.insert_language("english"), db.insert_language("hebrew")
+    # Three persons whose local hours all fall on 06:00 UTC on June 10, one an hour later
+    insert(db, ("1990-06-10", 6, None, male, english), ("1990-06-10", 9, "Asia/Jerusalem", female, hebrew),
+           ("1990-06-10", 2, "America/New_York", female, english), ("1990-06-10", 7, None, male, hebrew))
+    result = forecast.forecast(date(2026, 6, 10), date(2026, 6, 10), top=2, window=60)
+    assert result["total"] == 4 and result["genders"] == {male: 2, female: 2}
+    assert result["peak_hours"][0] == {"date": "2026-06-10", "hour": 6, "count": 3, "genders": {male: 1, female: 2},
+                                       "languages": {english: 2, hebrew: 1}}
+    assert result["peak_hours"][1]["hour"] == 7 and result["peak_hours"][1]["count"] == 1
+    assert result["required_sends_per_second"] == 0.05
+
+
+def test_persons_changes_rebuild_the_forecast(db, lookups, forecast):
+    insert(db, ("1990-06-10", 9, None, *lookups))
+    assert forecast.forecast(date(2026, 6, 10), date(2026, 6, 10))["total"] == 1
+    db.delete_person(1)
+    assert forecast.forecast(date(2026, 6, 10), date(2026, 6, 10))["total"] == 0
+
+
+@pytest.mark.parametrize("output_zone", [None, "Asia/Jerusalem", "America/New_York"])
+def test_forecast_agrees_with_the_dispatcher(db, lookups, dispatcher, forecast, output_zone):
+    generator = random.Random(7)
+    persons = [(f"19{generator.randint(50, 99)}-06-{generator.randint(1, 20):02d}", generator.randrange(24),
+                generator.choice(ZONES), *lookups) for _ in range(500)]
+    insert(db, *persons)
+    start, end = date(2026, 6, 5), date(2026, 6, 14)
+    zone = dispatcher.zone_for(output_zone)
+    first = datetime(start.year, start.month, start.day, tzinfo=zone).timestamp()
+    expected = {}
+    for birth_date, hour, time_zone, _, _ in persons:
+        fire_time = datetime.fromtimestamp(dispatcher.next_fire_time(birth_date, hour, time_zone, first - 1), zone)
+        if fire_time.date() <= end:
+            expected[fire_time.date(), fire_time.hour] = expected.get((fire_time.date(), fire_time.hour), 0) + 1
+    result = forecast.forecast(start, end, output_zone)
+    actual = {(date.fromisoformat(day["date"]), hour): count for day in result["days"] for hour, count in enumerate(day["hours"]) if count}
+    assert actual == expected
+    assert result["total"] == sum(expected.values()) > 100
@@ -0,0 +1,85 @@
+import time
+import sqlite3
+import threading
+
+from loguru import logger
+from prometheus_client import REGISTRY
+
+from instrumentation import QueryMetrics
+from sqliteconnector import SqliteConnector
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_statements_are_labeled_by_verb_and_table():
+    metrics = QueryMetrics(enabled=False)
+    assert metrics.operation("SELECT PersonId FROM Persons WHERE PersonId > ?") == "select Persons"
+    assert metrics.operation("INSERT INTO Blesses (Bless) VALUES (?)") == "insert Blesses"
+    assert metrics.operation("update Outbox set Status = 'sent'") == "update Outbox"
+    assert metrics.operation("PRAGMA integrity_check") == "pragma"
+
+
+def test_connector_records_statements_rows_commits_and_pool_waits(db, lookups):
+    queries = sample("blessed_db_query_seconds_count", operation="select Genders")
+    rows = sample("blessed_db_query_rows_sum", operation="select Genders")
+    inserts = sample("blessed_db_query_seconds_count", operation="insert Genders")
+    commits = sample("blessed_db_commit_seconds_count")
+    acquires = sample("blessed_db_connection_acquire_seconds_count")
+    db.insert_gender("female")
+    db.fetch_all("SELECT GenderId, Gender FROM Genders")
+    assert sample("blessed_db_query_seconds_count", operation="select Genders") == queries + 1
+    assert sample("blessed_db_query_rows_sum", operation="select Genders") == rows + 2
+    assert sample("blessed_db_query_seconds_count", operation="insert Genders") == inserts + 1
+    assert sample("blessed_db_commit_seconds_count") > commits
+    assert sample("blessed_db_connection_acquire_seconds_count") > acquires
+
+
+def test_disabled_metrics_skip_the_timing(db_path, monkeypatch):
+    monkeypatch.setenv("DB_METRICS", "false")
+    db = SqliteConnector(db_path)
+    db.create_tables()
+    assert not db.metrics.active and db.pool.acquire_observer is None
+    queries = sample("blessed_db_query_seconds_count", operation="select Genders")
+    db.fetch_all("SELECT GenderId, Gender FROM Genders")
+    assert sample("blessed_db_query_seconds_count", operation="select Genders") == queries
+    db.close()
+
+
+def test_slow_queries_are_logged_and_counted():
+    metrics = QueryMetrics(enabled=False, slow_query_ms=50)
+    messages = []
+    handler = logger.add(messages.append, level="WARNING")
+    slow = sample("blessed_db_slow_queries_total", operation="select Persons")
+    try:
+        metrics.observe("SELECT * FROM Persons", time.perf_counter())
+        metrics.observe("SELECT *\n  FROM Persons", time.perf_counter() - 0.1)
+    finally:
+        logger.remove(handler)
+    assert sample("blessed_db_slow_queries_total", operation="select Persons") == slow + 1
+    assert len(messages) == 1 and "select Persons): SELECT * FROM Persons" in messages[0]
+
+
+def test_locked_writes_are_retried_and_counted(db_path):
+    db = SqliteConnector(db_path, busy_timeout=1)
+    db.create_tables()
+    retries = sample("blessed_db_lock_retries_total", operation="insert Genders")
+    other = sqlite3.connect(db_path, check_same_thread=False)
+    other.execute("BEGIN IMMEDIATE")
+    release = threading.Timer(0.03, other.rollback)
+    release.start()
+    db.insert_gender("male")
+    release.join()
+    assert sample("blessed_db_lock_retries_total", operation="insert Genders") > retries
+    assert [row[1] for row in db.select_all_genders()] == ["male"]
+    other.close()
+    db.close()
+
+
+def test_metrics_endpoint_exports_database_and_dispatch_metrics(client):
+    client.get("/genders/")
+    body = client.get("/metrics").text
+    for name in ("blessed_db_query_seconds_bucket", "blessed_db_connection_acquire_seconds", "blessed_db_commit_seconds",
+                 "blessed_dispatch_lag_seconds", "blessed_dispatch_due_persons", "blessed_outbox_due_messages"):
+        assert name in body
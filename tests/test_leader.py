@@ -0,0 +1,113 @@
+import time
+
+from leader import LeaderElection
+from sqliteconnector import SqliteConnector
+from server import Server
+from conftest import TestClient
+
+
+class Recorder:
+    def __init__(self, fail=False):
+        self.events = []
+        self.fail = fail
+
+    def elected(self):
+        self.events.append("elected")
+        if self.fail:
+            raise RuntimeError("dispatcher failed to start")
+
+    def demoted(self):
+        self.events.append("demoted")
+
+
+def election(db, recorder, ttl=0.3):
+    return LeaderElection(db, on_elected=recorder.elected, on_demoted=recorder.demoted, ttl=ttl)
+
+
+def holder(db):
+    rows = db.fetch_all("SELECT Holder FROM Leases WHERE Name = 'dispatcher'")
+    return rows[0][0] if rows else None
+
+
+def test_only_one_worker_holds_the_lease(db, db_path):
+    first, second = Recorder(), Recorder()
+    leader = election(db, first)
+    # Another worker process, with its own connections
+    other = election(SqliteConnector(db_path), second)
+    assert leader.heartbeat()
+    assert not other.heartbeat()
+    assert leader.heartbeat()
+    assert (leader.is_leader, other.is_leader) == (True, False)
+    assert first.events == ["elected"] and second.events == []
+    assert holder(db) == leader.holder
+
+
+def test_lease_fails_over_once_the_leader_stops_renewing(db, db_path):
+    first, second = Recorder(), Recorder()
+    leader = election(db, first)
+    other = election(SqliteConnector(db_path), second)
+    leader.heartbeat()
+    assert not other.heartbeat()
+    time.sleep(leader.ttl + 0.05)
+    assert other.heartbeat()
+    assert second.events == ["elected"]
+    # The old leader finds out on its next heartbeat and steps down
+    assert not leader.heartbeat()
+    assert first.events == ["elected", "demoted"] and not leader.is_leader
+
+
+def test_stop_hands_the_lease_over_right_away(db, db_path):
+    first, second = Recorder(), Recorder()
+    leader = election(db, first, ttl=30)
+    other = election(SqliteConnector(db_path), second, ttl=30)
+    leader.start()
+    deadline = time.monotonic() + 2
+    while not leader.is_leader and time.monotonic() < deadline:
+        time.sleep(0.01)
+    leader.stop()
+    assert first.events == ["elected", "demoted"]
+    assert holder(db) is None
+    assert other.heartbeat()
+
+
+def test_failed_takeover_releases_the_lease(db, db_path):
+    failing, healthy = Recorder(fail=True), Recorder()
+    leader = election(db, failing, ttl=30)
+    other = election(SqliteConnector(db_path), healthy, ttl=30)
+    assert not leader.heartbeat()
+    assert failing.events == ["elected", "demoted"] and not leader.is_leader
+    assert holder(db) is None
+    assert other.heartbeat() and healthy.events == ["elected"]
+
+
+def test_failed_heartbeat_demotes_the_leader(db):
+    recorder = Recorder()
+    leader = election(db, recorder)
+    leader.heartbeat()
+    db.execute_query("DROP TABLE Leases")
+    assert not leader.heartbeat()
+    assert recorder.events == ["elected", "demoted"] and not leader.is_leader
+
+
+def test_other_workers_drop_their_caches_on_change(db, db_path, lookups):
+    other = SqliteConnector(db_path)
+    db.insert_bless(*lookups, "Mazal tov")
+    other.changes.sync()
+    assert [row[1] for row in other.select_all_genders()] == ["male"]
+    assert other.bless_index.choose(*lookups)[1] == "Mazal tov"
+    db.update_gender(lookups[0], "female")
+    db.update_bless(1, bless="Happy birthday")
+    # Until it reads the change feed the other worker serves what it cached
+    assert [row[1] for row in other.select_all_genders()] == ["male"]
+    other.changes.sync()
+    assert [row[1] for row in other.select_all_genders()] == ["female"]
+    assert other.bless_index.choose(*lookups)[1] == "Happy birthday"
+    other.close()
+
+
+def test_restore_is_refused_with_several_workers(db_path, monkeypatch):
+    monkeypatch.setenv("DB_PATH", db_path)
+    monkeypatch.setenv("WORKERS", "2")
+    with TestClient(Server().app) as client:
+        response = client.post("/restore", files={"file": ("backup.db", b"SQLite format 3\x00")})
+    assert response.status_code == 409
@@ -0,0 +1,44 @@
+import json
+
+from sqliteconnector import SqliteConnector
+from conftest import person_row
+
+
+def test_pages_follow_the_keyset_cursor(server, client):
+    server.db.bulk_insert_persons([person_row(index, 1, 1) for index in range(1, 26)])
+    ids, params = [], {"limit": 10}
+    while True:
+        response = client.get("/persons/", params=params)
+        ids += [row["PersonId"] for row in response.json()]
+        if "X-Next-After-Id" not in response.headers:
+            break
+        params["after_id"] = response.headers["X-Next-After-Id"]
+    assert ids == list(range(1, 26))
+
+
+def test_pages_are_filtered_by_gender_and_language(server, client):
+    client.post("/genders/", json={"Gender": "female"})
+    server.db.bulk_insert_persons([person_row(index, 1 + index % 2, 1) for index in range(1, 11)])
+    rows = client.get("/persons/", params={"gender_id": 2, "limit": 3}).json()
+    assert [row["PersonId"] for row in rows] == [1, 3, 5]
+
+
+def test_streamed_listing_pages_through_every_row(server, client):
+    server.db.bulk_insert_persons([person_row(index, 1, 1) for index in range(1, 2501)])
+    response = client.get("/persons/", params={"stream": "true", "after_id": 5})
+    assert response.headers["content-type"] == "application/x-ndjson"
+    ids = [json.loads(line)["PersonId"] for line in response.text.splitlines()]
+    assert ids == list(range(6, 2501))
+
+
+def test_streamed_listing_holds_no_connection_between_pages(db_path):
+    db = SqliteConnector(db_path, pool_size=1, timeout=1)
+    db.create_tables()
+    gender_id, language_id = db.insert_gender("male"), db.insert_language("english")
+    db.bulk_insert_persons([person_row(index, gender_id, language_id) for index in range(1, 1501)])
+    rows = db.iter_persons()
+    assert next(rows)["PersonId"] == 1
+    # With the only connection pinned by the stream this would time out
+    db.update_person(1, first_name="Dana")
+    assert sum(1 for _ in rows) == 1499
+    db.close()
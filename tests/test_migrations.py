@@ -0,0 +1,82 @@
+import sqlite3
+
+import pytest
+
+from migrations import MIGRATIONS, run_migrations, get_schema_version
+from conftest import TestClient, person_row
+
+
+def names(conn, kind):
+    return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = ?", (kind,))}
+
+
+def unmigratable(path):
+    # A version 3 file that already has the column migration 4 adds
+    conn = sqlite3.connect(path)
+    run_migrations(conn, [migration for migration in MIGRATIONS if migration[0] <= 3])
+    conn.execute("ALTER TABLE Persons ADD COLUMN TimeZone TEXT")
+    conn.close()
+    return path
+
+
+def test_fresh_database_reaches_the_latest_version(db_path):
+    conn = sqlite3.connect(db_path)
+    applied = run_migrations(conn)
+    assert applied == [version for version, _, _ in MIGRATIONS]
+    assert get_schema_version(conn) == MIGRATIONS[-1][0]
+    assert {"Persons", "Blesses", "Outbox", "Leases", "ChangeLog", "DeliveryLog"} <= names(conn, "table")
+    assert {"IX_Persons_Gender", "IX_Blesses_Gender"} <= names(conn, "index")
+    assert "IX_Persons_Birthday" not in names(conn, "index")
+
+
+def test_migrations_are_idempotent(db_path):
+    conn = sqlite3.connect(db_path)
+    run_migrations(conn)
+    assert run_migrations(sqlite3.connect(db_path)) == []
+
+
+def test_migrations_versions_are_ordered_and_unique():
+    versions = [version for version, _, _ in MIGRATIONS]
+    assert versions == sorted(set(versions))
+
+
+def test_failed_migration_rolls_back(db_path):
+    conn = sqlite3.connect(db_path)
+    broken = MIGRATIONS + [(MIGRATIONS[-1][0] + 1, "Broken", ["CREATE TABLE Extra (Id INTEGER)", "NOT SQL"])]
+    with pytest.raises(sqlite3.OperationalError):
+        run_migrations(conn, broken)
+    assert get_schema_version(conn) == MIGRATIONS[-1][0]
+    assert "Extra" not in names(conn, "table")
+
+
+def test_failed_migration_stops_the_startup(server, db_path):
+    unmigratable(db_path)
+    with pytest.raises(sqlite3.OperationalError, match="duplicate column"):
+        with TestClient(server.app):
+            pass
+    assert get_schema_version(sqlite3.connect(db_path)) == 3
+
+
+def test_restore_migrates_an_older_backup(server, client, tmp_path):
+    old = sqlite3.connect(tmp_path / "old.db")
+    run_migrations(old, [migration for migration in MIGRATIONS if migration[0] <= 3])
+    old.execute("INSERT INTO Genders (Gender) VALUES ('female')")
+    old.commit()
+    old.close()
+    response = client.post("/restore", files={"file": ("old.db", (tmp_path / "old.db").read_bytes())})
+    assert response.status_code == 200
+    assert get_schema_version(sqlite3.connect(server.db.db_path)) == MIGRATIONS[-1][0]
+    assert [row["Gender"] for row in client.get("/genders/").json()] == ["female"]
+    # The restored file has the columns the app writes
+    row = {"FirstName": "Dana", "LastName": "Levi", "BirthDate": "1990-05-17", "GenderId": 1, "LanguageId": 1,
+           "PhoneNumber": "0501111111", "PreferredHour": 9, "Intro": "", "TimeZone": "Asia/Jerusalem"}
+    assert client.post("/persons/bulk", json=[row]).json() == {"inserted": 1, "errors": []}
+
+
+def test_restore_that_fails_to_migrate_keeps_the_live_database(server, client, tmp_path):
+    server.db.bulk_insert_persons([person_row(index, 1, 1) for index in range(1, 6)])
+    candidate = unmigratable(str(tmp_path / "candidate.db"))
+    with open(candidate, "rb") as source:
+        response = client.post("/restore", files={"file": ("candidate.db", source.read())})
+    assert response.status_code == 400 and "duplicate column" in response.json()["detail"]
+    assert len(client.get("/persons/").json()) == 5
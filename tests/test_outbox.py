@@ -0,0 +1,133 @@
+import threading
+import time
+
+import pytest
+
+from outbox import OutboxWorker
+from deliverylog import DeliveryLog
+from whatsappsender import WhatsappSender
+from conftest import person_row
+
+
+@pytest.fixture
+def persons(db, lookups):
+    db.bulk_insert_persons([person_row(index, *lookups) for index in range(1, 51)])
+    return db.select_persons_by_ids(list(range(1, 51)), True)
+
+
+def enqueue(db, persons, year=2026):
+    return db.enqueue_outbox([(person["PersonId"], year, None, person["PhoneNumber"], f"Happy birthday {person['FirstName']}")
+                              for person in persons], int(time.time()))
+
+
+def worker(db, stub, **kwargs):
+    kwargs = {"workers": 4, "batch_size": 7, "retry_backoff": 60, "max_attempts": 3, **kwargs}
+    return OutboxWorker(db, lambda: WhatsappSender(stub.url, "token", "default", rate_limit=1000, backoff=0.01, max_retries=0),
+                        **kwargs)
+
+
+def statuses(db):
+    return dict(db.fetch_all("SELECT Status, count(*) FROM Outbox GROUP BY Status"))
+
+
+def test_a_greeting_is_enqueued_once_per_person_and_year(db, persons):
+    assert enqueue(db, persons) == 50
+    assert enqueue(db, persons) == 0
+    assert enqueue(db, persons[:5], year=2027) == 5
+    assert statuses(db) == {"pending": 55}
+
+
+def test_drain_sends_every_message_exactly_once(db, persons, whatsapp):
+    enqueue(db, persons)
+    assert worker(db, whatsapp).drain() == 50
+    assert statuses(db) == {"sent": 50}
+    assert sorted(request["chatId"] for request in whatsapp.requests) == sorted(WhatsappSender.chat_id(person["PhoneNumber"]) for person in persons)
+    assert worker(db, whatsapp).drain() == 0
+    assert len(whatsapp.requests) == 50
+
+
+def test_concurrent_workers_never_send_a_message_twice(db, persons, whatsapp):
+    # Two processes draining the same outbox at once, each with its own threads
+    enqueue(db, persons)
+    whatsapp.latency = 0.01
+    workers = [worker(db, whatsapp), worker(db, whatsapp)]
+    threads = [threading.Thread(target=item.drain) for item in workers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    chat_ids = [request["chatId"] for request in whatsapp.requests]
+    assert len(chat_ids) == len(set(chat_ids)) == 50
+    assert statuses(db) == {"sent": 50}
+
+
+def test_failures_are_retried_later_until_out_of_attempts(db, persons, whatsapp):
+    enqueue(db, persons[:2])
+    failing = WhatsappSender.chat_id(persons[0]["PhoneNumber"])
+    whatsapp.failures[failing] = [500] * 10
+    outbox = worker(db, whatsapp, max_attempts=2)
+    assert outbox.drain() == 1
+    row = db.fetch_all("SELECT Status, Attempts, LastError, NextAttemptAt FROM Outbox WHERE PersonId = ?", (persons[0]["PersonId"],), True)[0]
+    assert row["Status"] == "pending" and row["Attempts"] == 1 and row["LastError"] == "HTTP 500"
+    assert row["NextAttemptAt"] >= time.time() + 50
+    # Not due yet: nothing is sent again
+    assert outbox.drain() == 0
+    assert len(whatsapp.sent_to(failing)) == 1
+    db.execute_query("UPDATE Outbox SET NextAttemptAt = 0")
+    outbox.drain()
+    assert db.fetch_all("SELECT Status, Attempts FROM Outbox WHERE PersonId = ?", (persons[0]["PersonId"],)) == [("failed", 2)]
+
+
+def test_recover_returns_abandoned_claims_and_ignores_their_late_completion(db, persons, whatsapp):
+    enqueue(db, persons[:3])
+    claimed = db.claim_outbox("dead-worker", 10, int(time.time()))
+    assert len(claimed) == 3 and statuses(db) == {"sending": 3}
+    outbox = worker(db, whatsapp, claim_timeout=600)
+    assert outbox.recover() == 0
+    assert outbox.recover(int(time.time()) + 1) == 3
+    assert outbox.drain() == 3
+    # The worker that was presumed dead finishes after all and must not touch the rows again
+    db.complete_outbox("dead-worker", [], [(row["OutboxId"], "late", 0) for row in claimed], 5)
+    assert statuses(db) == {"sent": 3}
+
+
+
+def test_rejected_messages_fail_without_retrying(db, persons, whatsapp):
+    enqueue(db, persons[:2])
+    rejected = WhatsappSender.chat_id(persons[0]["PhoneNumber"])
+    whatsapp.failures[rejected] = [400]
+    assert worker(db, whatsapp, max_attempts=5).drain() == 1
+    assert db.fetch_all("SELECT Status, Attempts, LastError FROM Outbox WHERE PersonId = ?",
+                        (persons[0]["PersonId"],)) == [("failed", 1, "HTTP 400")]
+    db.execute_query("UPDATE Outbox SET NextAttemptAt = 0")
+    assert worker(db, whatsapp, max_attempts=5).drain() == 0
+    assert len(whatsapp.sent_to(rejected)) == 1
+
+
+@pytest.mark.parametrize("delete, cascaded", [
+    (lambda db, person: db.delete_person(person["PersonId"]), False),
+    (lambda db, person: db.delete_persons([person["PersonId"]]), False),
+    # Every test person has the same gender, the cascade takes them all
+    (lambda db, person: db.delete_gender(person["GenderId"], cascade=True), True),
+])
+def test_deleting_persons_cancels_their_unsent_messages(db, persons, whatsapp, delete, cascaded):
+    enqueue(db, persons[:1], year=2025)
+    worker(db, whatsapp).drain()
+    enqueue(db, persons[:2])
+    delete(db, persons[0])
+    remaining = db.fetch_all("SELECT PersonId, Year, Status FROM Outbox ORDER BY PersonId, Year")
+    kept = [] if cascaded else [(persons[1]["PersonId"], 2026, "pending")]
+    assert remaining == [(persons[0]["PersonId"], 2025, "sent")] + kept
+
+
+def test_attempts_are_recorded_in_the_delivery_log(db, persons, whatsapp):
+    enqueue(db, persons[:4])
+    # A rejected message is not retried, a server error is
+    whatsapp.failures[WhatsappSender.chat_id(persons[0]["PhoneNumber"])] = [400]
+    whatsapp.failures[WhatsappSender.chat_id(persons[1]["PhoneNumber"])] = [500]
+    deliveries = DeliveryLog(db, batch_size=1000)
+    outbox = worker(db, whatsapp)
+    outbox.delivery_log = deliveries
+    outbox.drain()
+    assert dict(db.fetch_all("SELECT Status, count(*) FROM DeliveryLog GROUP BY Status")) == {"sent": 2, "failed": 1, "retry": 1}
+    assert dict(db.fetch_all("SELECT Status, sum(Count) FROM DeliveryStats GROUP BY Status")) == {"sent": 2, "failed": 1, "retry": 1}
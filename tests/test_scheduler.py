@@ -0,0 +1,86 @@
+import threading
+import time
+
+from scheduler import TimerScheduler
+
+
+def test_pop_due_returns_items_up_to_now_in_fire_order():
+    timers = TimerScheduler()
+    timers.schedule(1, 30)
+    timers.schedule(2, 10)
+    timers.schedule(3, 20)
+    assert timers.next_fire_time() == 10
+    assert timers.pop_due(5) == []
+    assert timers.pop_due(20) == [2, 3]
+    assert timers.pop_due(100) == [1]
+    assert len(timers) == 0
+    assert timers.next_fire_time() is None
+
+
+def test_items_sharing_a_fire_time_share_one_heap_entry():
+    timers = TimerScheduler()
+    timers.schedule_many([(person_id, 100) for person_id in range(1000)])
+    assert len(timers) == 1000
+    assert timers.heap == [100]
+    assert sorted(timers.pop_due(100)) == list(range(1000))
+
+
+def test_reschedule_moves_an_item():
+    timers = TimerScheduler()
+    timers.schedule(1, 10)
+    timers.schedule(1, 50)
+    assert len(timers) == 1
+    assert timers.pop_due(20) == []
+    assert timers.next_fire_time() == 50
+    assert timers.pop_due(50) == [1]
+
+
+def test_cancel_skips_the_emptied_bucket():
+    timers = TimerScheduler()
+    timers.schedule(1, 10)
+    timers.schedule(2, 20)
+    timers.cancel(1)
+    timers.cancel(42)
+    assert timers.next_fire_time() == 20
+    assert timers.pop_due(100) == [2]
+
+
+def test_schedule_many_replaces_existing_timers():
+    timers = TimerScheduler()
+    timers.schedule(1, 10)
+    timers.schedule_many([(1, 40), (2, 30)])
+    assert timers.pop_due(35) == [2]
+    assert timers.pop_due(40) == [1]
+
+
+def test_clear_drops_everything():
+    timers = TimerScheduler()
+    timers.schedule_many([(1, 10), (2, 20)])
+    timers.clear()
+    assert len(timers) == 0
+    assert timers.pop_due(100) == []
+
+
+def test_wait_returns_when_the_next_timer_is_due():
+    timers = TimerScheduler()
+    timers.schedule(1, time.time() + 0.1)
+    started = time.monotonic()
+    timers.wait(time.time, timeout=5)
+    assert 0.05 <= time.monotonic() - started < 1
+
+
+def test_wait_wakes_up_for_an_earlier_timer():
+    timers = TimerScheduler()
+    timers.schedule(1, time.time() + 60)
+
+    def add_earlier():
+        time.sleep(0.05)
+        timers.schedule(2, time.time())
+
+    thread = threading.Thread(target=add_earlier)
+    thread.start()
+    started = time.monotonic()
+    timers.wait(time.time, timeout=5)
+    thread.join()
+    assert time.monotonic() - started < 1
+    assert timers.pop_due(time.time()) == [2]
@@ -0,0 +1,130 @@
+import sqlite3
+
+import sqliteconnector
+from migrations import MIGRATIONS, run_migrations, fold_text, phone_digits
+from conftest import person_row
+
+
+def add_person(db, lookups, first_name, last_name="Levi", phone_number="+972-50-000-0000", intro=""):
+    return db.insert_person(first_name, last_name, "1990-01-02", *lookups, phone_number, 9, intro)
+
+
+def first_names(rows):
+    return [row["FirstName"] for row in rows]
+
+
+def test_search_text_functions():
+    assert fold_text("שָׁלוֹם") == "שלום"
+    assert fold_text("Renée") == "Renee"
+    assert fold_text("plain") == "plain"
+    assert fold_text(None) is None
+    assert phone_digits("+972 (50) 123-4567") == "972501234567"
+
+
+def test_upgrade_reindexes_search(db_path):
+    # A database created before folded search text, with pointed Hebrew and a punctuated phone number
+    conn = sqlite3.connect(db_path)
+    run_migrations(conn, [migration for migration in MIGRATIONS if migration[0] < 12])
+    conn.execute("INSERT INTO Genders (Gender) VALUES ('male')")
+    conn.execute("INSERT INTO Languages (Language) VALUES ('hebrew')")
+    conn.execute('''INSERT INTO Persons (FirstName, LastName, BirthDate, GenderId, LanguageId, PhoneNumber, PreferredHour, Intro)
+                    VALUES ('שָׁלוֹם', 'כהן', '1990-01-02', 1, 1, '+972-50-123-4567', 9, '')''')
+    conn.commit()
+    assert run_migrations(conn) == [version for version, _, _ in MIGRATIONS if version >= 12]
+    assert conn.execute("SELECT rowid FROM PersonsSearch WHERE PersonsSearch MATCH 'שלום'").fetchall() == [(1,)]
+    assert conn.execute("""SELECT rowid FROM PhonesSearch WHERE PhonesSearch MATCH '"1234567"'""").fetchall() == [(1,)]
+
+
+def test_search_finds_folded_names_and_phone_digits(db, lookups):
+    add_person(db, lookups, "דָּוִד", "לֵוִי", "+972-50-123-4567")
+    db.bulk_insert_persons([person_row(index, *lookups) for index in range(50)])
+    assert first_names(db.search_persons("דוד", api_call=True)) == ["דָּוִד"]
+    assert first_names(db.search_persons("דָּוִד", api_call=True)) == ["דָּוִד"]
+    assert [person["PersonId"] for person in db.search_persons("97250123", api_call=True)] == [1]
+    assert [person["PersonId"] for person in db.search_persons("123-4567", api_call=True)] == [1]
+    assert first_names(db.search_persons("First42", api_call=True)) == ["First42"]
+    # Updates fold the new text as inserts do
+    db.update_person(1, first_name="שְׁלֹמֹה", phone_number="03-555-1212")
+    assert first_names(db.search_persons("שלמה", api_call=True)) == ["שְׁלֹמֹה"]
+    assert db.search_persons("1234567") == []
+    assert len(db.search_persons("5551212")) == 1
+    db.update_persons([(2, {"FirstName": "Renée"})])
+    assert first_names(db.search_persons("Renee", api_call=True)) == ["Renée"]
+
+
+def test_plain_connections_can_write(db, db_path, lookups):
+    # The triggers are plain SQL: a connection without the app's functions still writes
+    conn = sqlite3.connect(db_path)
+    conn.execute('''INSERT INTO Persons (FirstName, LastName, BirthDate, GenderId, LanguageId, PhoneNumber, PreferredHour, Intro)
+                    VALUES ('Moshe', 'Peretz', '1990-01-02', 1, 1, '0501234567', 9, '')''')
+    conn.execute("INSERT INTO Blesses (GenderId, LanguageId, Bless) VALUES (1, 1, 'Mazal tov')")
+    conn.commit()
+    assert first_names(db.search_persons("Moshe", api_call=True)) == ["Moshe"]
+    assert [bless["Bless"] for bless in db.search_blesses("Mazal", api_call=True)] == ["Mazal tov"]
+    conn.execute("UPDATE Persons SET FirstName = 'Avi' WHERE FirstName = 'Moshe'")
+    conn.execute("DELETE FROM Blesses")
+    conn.commit()
+    assert first_names(db.search_persons("Avi", api_call=True)) == ["Avi"]
+    assert db.search_persons("Moshe") == [] and db.search_blesses("Mazal") == []
+    conn.execute("DELETE FROM Persons")
+    conn.commit()
+    assert db.search_persons("Avi") == []
+    conn.close()
+
+
+def test_bulk_inserts_restore_the_insert_triggers(db, lookups):
+    triggers = "SELECT name FROM sqlite_master WHERE type = 'trigger' ORDER BY name"
+    before = db.fetch_all(triggers)
+    db.bulk_insert_persons([person_row(index, *lookups) for index in range(10)])
+    db.bulk_insert_blesses([(*lookups, "Mazal tov")])
+    assert db.fetch_all(triggers) == before
+    # Single inserts index their rows through the restored triggers
+    add_person(db, lookups, "Yael")
+    db.insert_bless(*lookups, "Happy birthday")
+    assert first_names(db.search_persons("Yael", api_call=True)) == ["Yael"]
+    assert [bless["Bless"] for bless in db.search_blesses("Happy", api_call=True)] == ["Happy birthday"]
+
+
+def test_whole_names_rank_before_prefixes_and_intros(db, lookups):
+    add_person(db, lookups, "Yossi", intro="Dan says hi")
+    add_person(db, lookups, "Dana")
+    add_person(db, lookups, "Noa", last_name="Dan")
+    add_person(db, lookups, "Dan")
+    assert first_names(db.search_persons("Dan", api_call=True)) == ["Noa", "Dan", "Dana", "Yossi"]
+    assert first_names(db.search_persons("Dan Levi", api_call=True)) == ["Dan", "Yossi"]
+
+
+def test_only_the_last_word_is_a_prefix(db, lookups):
+    add_person(db, lookups, "Dana", last_name="Cohen")
+    assert first_names(db.search_persons("Dana Co", api_call=True)) == ["Dana"]
+    assert db.search_persons("Dan Co") == []
+    # A trailing space ends the last word too
+    assert db.search_persons("Dana Co ") == []
+    assert first_names(db.search_persons("Dana Cohen ", api_call=True)) == ["Dana"]
+
+
+def test_single_characters_are_not_searched(db, lookups):
+    add_person(db, lookups, "Dana")
+    assert db.search_persons("D") == []
+    assert db.search_blesses("D") == []
+    assert first_names(db.search_persons("Dana L", api_call=True)) == ["Dana"]
+
+
+def test_only_the_first_candidates_are_ranked(db, lookups, monkeypatch):
+    monkeypatch.setattr(sqliteconnector, "SEARCH_CANDIDATES", 30)
+    db.bulk_insert_persons([person_row(index, *lookups) for index in range(50)])
+    # Every person matches the prefix; the whole name match past the candidates is not read
+    add_person(db, lookups, "First")
+    rows = db.search_persons("First", 10, api_call=True)
+    assert [row["PersonId"] for row in rows] == list(range(1, 11))
+
+
+def test_search_endpoints(client):
+    client.post("/persons/bulk", json=[{"FirstName": "Dana", "LastName": "Cohen", "BirthDate": "1990-01-02", "GenderId": 1,
+                                        "LanguageId": 1, "PhoneNumber": "+972-50-123-4567", "PreferredHour": 9, "Intro": ""}])
+    client.post("/blesses/", json={"GenderId": 1, "LanguageId": 1, "Bless": "Mazal tov, Mazal tov"})
+    client.post("/blesses/", json={"GenderId": 1, "LanguageId": 1, "Bless": "Mazal and luck"})
+    assert [person["LastName"] for person in client.get("/persons/search", params={"q": "Dana Co"}).json()] == ["Cohen"]
+    assert client.get("/persons/search", params={"q": "D"}).status_code == 422
+    blesses = client.get("/blesses/search", params={"q": "mazal", "limit": 1}).json()
+    assert [bless["Bless"] for bless in blesses] == ["Mazal tov, Mazal tov"]
@@ -0,0 +1,28 @@
+import json
+
+from serialization import dumps, columnar
+from conftest import person_row
+
+
+def test_dumps_matches_the_stdlib_encoding():
+    value = {"FirstName": "דָּוִד", "Intro": "a/b", "PreferredHour": 9, "TimeZone": None, "Score": 1.5}
+    assert json.loads(dumps(value)) == value
+    assert "דָּוִד".encode("utf-8") in dumps(value)
+
+
+def test_columnar_lists_each_column_once():
+    assert columnar(("PersonId", "FirstName"), [(1, "Dana"), (2, "Omer")]) == {"columns": ["PersonId", "FirstName"],
+                                                                             "rows": [(1, "Dana"), (2, "Omer")]}
+
+
+def test_columns_format_carries_the_same_rows_as_objects(server, client):
+    server.db.bulk_insert_persons([person_row(index, 1, 1) for index in range(1, 8)])
+    objects = client.get("/persons/", params={"limit": 5, "after_id": 1})
+    columns = client.get("/persons/", params={"limit": 5, "after_id": 1, "format": "columns"})
+    body = columns.json()
+    assert [dict(zip(body["columns"], row)) for row in body["rows"]] == objects.json()
+    assert body["columns"][0] == "PersonId"
+    assert columns.headers["X-Next-After-Id"] == objects.headers["X-Next-After-Id"] == "6"
+    body = client.get("/blesses/", params={"format": "columns"}).json()
+    assert body == {"columns": ["BlessId", "GenderId", "LanguageId", "Bless"], "rows": []}
+    assert client.get("/persons/", params={"format": "xml"}).status_code == 422
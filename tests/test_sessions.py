@@ -0,0 +1,44 @@
+import pytest
+
+
+def session(name, **fields):
+    return {"Name": name, "WhatsappApiUrl": "http://whatsapp.invalid", "WhatsappApiToken": "token",
+            "WhatsappApiSessionName": name, **fields}
+
+
+def test_session_crud(client):
+    created = client.post("/configuration/sessions", json=session("second", RateLimit=20)).json()
+    assert created["SessionId"] == 1 and created["RateLimit"] == 20
+    assert client.post("/configuration/sessions", json=session("second")).status_code == 409
+    response = client.put("/configuration/sessions/1", json=session("second", RateLimit=5, Enabled=False))
+    assert response.status_code == 200
+    assert client.get("/configuration/sessions").json() == [{**session("second"), "SessionId": 1, "RateLimit": 5, "Enabled": 0}]
+    assert client.put("/configuration/sessions/7", json=session("third")).status_code == 404
+    assert client.delete("/configuration/sessions/1").status_code == 200
+    assert client.get("/configuration/sessions").json() == []
+
+
+def test_deleting_an_unknown_session_is_not_found(client):
+    response = client.delete("/configuration/sessions/42")
+    assert response.status_code == 404
+    assert response.json()["detail"] == "Session 42 not found"
+
+
+@pytest.mark.parametrize("rate_limit", [0, -5])
+def test_rate_limit_must_be_positive(client, rate_limit):
+    assert client.post("/configuration/sessions", json=session("second", RateLimit=rate_limit)).status_code == 422
+    assert client.get("/configuration/sessions").json() == []
+
+
+def test_default_session_name_is_reserved(client):
+    assert client.post("/configuration/sessions", json=session("default")).status_code == 400
+
+
+def test_enabled_sessions_join_the_sharded_sender(server, client):
+    client.post("/configuration/", json={"WhatsappApiUrl": "http://whatsapp.invalid", "WhatsappApiToken": "token",
+                                         "WhatsappApiSessionName": "default"})
+    client.post("/configuration/sessions", json=session("second", RateLimit=20))
+    client.post("/configuration/sessions", json=session("third", Enabled=False))
+    sender = server.create_sender()
+    assert sorted(sender.senders) == ["default", "second"]
+    assert sender.senders["second"].rate_limit == 20
@@ -0,0 +1,29 @@
+import os
+import subprocess
+import sys
+import time
+
+from conftest import TestClient
+
+
+def test_ready_only_once_the_warm_up_is_done(server, db_path):
+    server.db.create_tables()
+    server.db.insert_bless(server.db.insert_gender("male"), server.db.insert_language("english"), "Hi {{ first_name }}")
+    # Without the lifespan nothing was warmed up
+    assert TestClient(server.app).get("/ready").status_code == 503
+    with TestClient(server.app) as client:
+        deadline = time.monotonic() + 5
+        while (response := client.get("/ready")).status_code != 200 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert response.status_code == 200
+        body = response.json()
+    assert body["ready"]
+    assert {"imports", "pool", "migrations", "caches", "bless_index", "templates", "forecast"} <= body["phases"].keys()
+    assert server.db.bless_index.buckets is not None and len(server.db.templates.compiled) == 1
+
+
+def test_heavy_modules_are_imported_on_first_use():
+    app_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app")
+    script = "import sys, server; print(sorted(m for m in ('jinja2', 'httpx', 'uvicorn') if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", script], cwd=app_dir, capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "[]"
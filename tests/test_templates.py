@@ -0,0 +1,67 @@
+import pytest
+
+from blesstemplates import BlessTemplates
+
+DANA = {"PersonId": 1, "FirstName": "Dana", "LastName": "Levi", "BirthDate": "1990-05-17", "Intro": "Dear Dana,"}
+
+
+def test_renders_person_variables():
+    templates = BlessTemplates()
+    message = templates.render(1, "Happy {{ age }}th, {{ first_name }} {{ last_name }}! {{ intro }}", DANA, 2026)
+    assert message == "Happy 36th, Dana Levi! Dear Dana,"
+
+
+def test_intro_goes_first_when_the_template_does_not_use_it():
+    templates = BlessTemplates()
+    assert templates.render(1, "Mazal tov", DANA, 2026) == "Dear Dana,\nMazal tov"
+    assert templates.render(2, "Mazal tov", {**DANA, "Intro": ""}, 2026) == "Mazal tov"
+
+
+def test_templates_are_compiled_once_per_text_version():
+    templates = BlessTemplates(size=2)
+    first = templates.compile(1, "Mazal tov")
+    assert templates.compile(1, "Mazal tov") is first
+    assert templates.compile(1, "Happy birthday") is not first
+    templates.compile(2, "Hi")
+    # The LRU holds two templates, the oldest version of bless 1 went first
+    assert list(templates.compiled) == [(1, templates.version("Happy birthday")), (2, templates.version("Hi"))]
+    templates.evict(1)
+    assert list(templates.compiled) == [(2, templates.version("Hi"))]
+
+
+def test_templates_are_sandboxed_and_validated():
+    templates = BlessTemplates()
+    with pytest.raises(ValueError, match="Invalid bless template"):
+        templates.validate("Broken {{ first_name")
+    assert templates.render_batch([(1, "{{ first_name.__class__.__mro__ }}", DANA), (2, "Hi {{ first_name }}", DANA)], 2026) == \
+        [None, "Dear Dana,\nHi Dana"]
+
+
+def test_invalid_templates_are_rejected_by_the_api(client):
+    assert client.post("/blesses/", json={"GenderId": 1, "LanguageId": 1, "Bless": "Broken {{ first_name"}).status_code == 400
+    rows = [{"GenderId": 1, "LanguageId": 1, "Bless": "Happy birthday {{ first_name }}"},
+            {"GenderId": 1, "LanguageId": 1, "Bless": "Broken {{ first_name"}]
+    body = client.post("/blesses/bulk", json=rows).json()
+    assert body["inserted"] == 1
+    assert body["errors"][0]["index"] == 1 and body["errors"][0]["errors"][0]["msg"].startswith("Invalid bless template")
+
+
+def test_preview_renders_saved_and_unsaved_blesses(server, client):
+    server.db.insert_bless(1, 1, "Happy birthday {{ first_name }}")
+    server.db.insert_person("Dana", "Levi", "1990-05-17", 1, 1, "0501111111", 9, "")
+    assert client.post("/blesses/preview", json={"BlessId": 1, "PersonId": 1}).json() == {"message": "Happy birthday Dana"}
+    assert client.post("/blesses/preview", json={"Bless": "Hi {{ last_name }}", "PersonId": 1}).json() == {"message": "Hi Levi"}
+    assert client.post("/blesses/preview", json={"Bless": "Hi {{ first_name }}"}).json() == {"message": "Hi Israel\nHi Israel"}
+    # Unsaved texts do not enter the template cache
+    assert [key[0] for key in server.db.templates.compiled] == [1]
+
+
+@pytest.mark.parametrize("payload, status", [
+    ({}, 400),
+    ({"PersonId": 1}, 400),
+    ({"BlessId": 42}, 404),
+    ({"Bless": "Hi", "PersonId": 42}, 404),
+    ({"Bless": "Broken {{ first_name"}, 400),
+])
+def test_preview_rejects_unusable_requests(client, payload, status):
+    assert client.post("/blesses/preview", json=payload).status_code == status
@@ -0,0 +1,80 @@
+import threading
+import time
+
+from whatsappsender import WhatsappSender, ShardedSender, TokenBucket
+
+
+def sender(stub, **kwargs):
+    kwargs = {"rate_limit": 1000, "concurrency": 8, "backoff": 0.01, "timeout": 2, **kwargs}
+    return WhatsappSender(stub.url, "token", "default", **kwargs)
+
+
+def test_sends_every_message(whatsapp):
+    results = sender(whatsapp).send_batch_sync([("+972-50-000-0001", "hello"), ("050-000-0002", "hi")])
+    assert [result["Sent"] for result in results] == [True, True]
+    assert sorted(request["chatId"] for request in whatsapp.requests) == ["0500000002@c.us", "972500000001@c.us"]
+    assert {request["key"] for request in whatsapp.requests} == {"token"}
+    assert {request["session"] for request in whatsapp.requests} == {"default"}
+
+
+def test_retries_server_errors_and_dropped_connections(whatsapp):
+    whatsapp.failures["1@c.us"] = [500, 0, 429]
+    results = sender(whatsapp).send_batch_sync([("1", "hello")])
+    assert results[0]["Sent"] and results[0]["Attempts"] == 4
+    assert len(whatsapp.sent_to("1@c.us")) == 4
+
+
+def test_client_errors_are_not_retried(whatsapp):
+    whatsapp.failures["1@c.us"] = [400]
+    results = sender(whatsapp).send_batch_sync([("1", "hello")])
+    assert results[0] == {"PhoneNumber": "1", "Sent": False, "Attempts": 1, "Error": "HTTP 400", "Retryable": False}
+
+
+def test_gives_up_after_max_retries(whatsapp):
+    whatsapp.failures["1@c.us"] = [503] * 10
+    results = sender(whatsapp, max_retries=2).send_batch_sync([("1", "hello")])
+    assert not results[0]["Sent"] and results[0]["Retryable"]
+    assert results[0]["Error"] == "HTTP 503"
+    assert len(whatsapp.sent_to("1@c.us")) == 3
+
+
+def test_slow_responses_overlap_up_to_the_concurrency(whatsapp):
+    whatsapp.latency = 0.2
+    started = time.monotonic()
+    results = sender(whatsapp, concurrency=10).send_batch_sync([(str(index), "hello") for index in range(10)])
+    assert all(result["Sent"] for result in results)
+    assert time.monotonic() - started < 1
+
+
+def test_timeouts_are_retried_as_transport_errors(whatsapp):
+    whatsapp.latency = 0.3
+    results = sender(whatsapp, timeout=0.1, max_retries=1).send_batch_sync([("1", "hello")])
+    assert not results[0]["Sent"] and results[0]["Retryable"] and results[0]["Attempts"] == 2
+
+
+def test_rate_limit_is_shared_across_threads(whatsapp):
+    bucket = TokenBucket(20)
+    senders = [sender(whatsapp, bucket=bucket) for _ in range(4)]
+    started = time.monotonic()
+    threads = [threading.Thread(target=item.send_batch_sync, args=([(str(index), "hi") for index in range(10)],)) for item in senders]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # 40 messages at 20/s with a burst of 20: about a second, not a quarter of it
+    assert len(whatsapp.requests) == 40
+    assert time.monotonic() - started >= 0.9
+
+
+
+def test_sharded_sender_fails_over_to_the_next_session(whatsapp):
+    senders = {name: WhatsappSender(whatsapp.url, "token", name, rate_limit=1000, backoff=0.01, max_retries=0)
+               for name in ("first", "second")}
+    sharded = ShardedSender(senders, cooldown=60)
+    phone_number = "972500000001"
+    primary = sharded.ranking(phone_number)[0]
+    whatsapp.failures[f"{phone_number}@c.us"] = [500]
+    results = sharded.send_batch_sync([(phone_number, "hello")])
+    assert results[0]["Sent"] and results[0]["Session"] != primary
+    assert [request["session"] for request in whatsapp.requests] == [primary, results[0]["Session"]]
+    assert primary in sharded.health